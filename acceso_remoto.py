@@ -0,0 +1,2450 @@
+# -*- coding: utf-8 -*-
+"""
+Acceso a los CSV de las apps, compartido por todas: pool de conexiones SSH/SFTP con
+métricas, reintentos y circuito, respaldos de almacenamiento (servidor SFTP, archivos
+locales o SQLite), seguimiento incremental de archivos y el diario local de calificaciones.
+
+Cada app define su Config heredando de ConfigRemota y llama a configurar(CONFIG) al
+principio del script. Este módulo se importa una sola vez por proceso, así que su
+estado de clase no se pierde en cada rerun de Streamlit; el pool, la caché y el
+almacenamiento se crean además con st.cache_resource.
+"""
+import abc
+import atexit
+import codecs
+import contextlib
+import csv
+import hashlib
+import heapq
+import hmac
+import io
+import itertools
+import os
+import random
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Optional, List, Dict, Any
+
+import paramiko
+from paramiko.sftp import CMD_DATA, CMD_READ, int64
+import streamlit as st
+
+
+# ====================
+# CONFIGURACIÓN
+# ====================
+class ConfigRemota:
+    """Ajustes del acceso remoto comunes a todas las apps; cada app hereda y añade los suyos"""
+    # Tiempo máximo de espera para conexión (segundos)
+    TIMEOUT = 15
+    # Número máximo de reintentos de conexión
+    MAX_RETRIES = 2
+    # Conexiones simultáneas del pool
+    SSH_MAX_CONEXIONES = 10
+    # Primera espera (segundos) antes de reintentar un handshake u operación remota
+    SSH_REINTENTO_BASE = 1.0
+    # Segundos máximos que una sesión espera turno cuando el pool está lleno
+    SSH_ESPERA_TURNO = 10
+    # Intervalo (segundos) del keepalive del transporte SSH
+    SSH_KEEPALIVE = 15
+    # Inactividad (segundos) tras la cual se revalida una conexión antes de entregarla
+    SSH_INTERVALO_VALIDACION = 30
+    # Conexiones listas que el hilo de precalentamiento mantiene en reposo (0 lo desactiva)
+    SSH_MIN_EN_REPOSO = 2
+    # Segundos entre revisiones del hilo de precalentamiento
+    SSH_INTERVALO_PRECALENTAMIENTO = 30
+    # Autenticar solo con contraseña, sin agente SSH ni llaves de ~/.ssh
+    SSH_SOLO_PASSWORD = False
+    # Archivo en ~ para el respaldo "sqlite" cuando no se indica `almacenamiento_ruta`
+    ALMACEN_SQLITE = ".calificaciones_almacen.db"
+    # Presupuesto de la caché de lecturas completas (get_remote_file); 0 la desactiva. Las
+    # apps de calificaciones leen por rangos y no la usan: activarla solo costaría un stat más
+    CACHE_ARCHIVOS_MB = 0
+
+    def __init__(self):
+        # Configuración para conexión remota
+        self.REMOTE = {
+            'HOST': st.secrets["remote_host"],
+            'USER': st.secrets["remote_user"],
+            'PASSWORD': st.secrets["remote_password"],
+            'PORT': int(st.secrets["remote_port"]),
+            'DIR': st.secrets["remote_dir"],
+        }
+        # Tamaño de cada petición SFTP y peticiones en vuelo al descargar archivos grandes
+        self.SFTP_CHUNK_SIZE = int(st.secrets.get("sftp_chunk_size", 32768))
+        self.SFTP_MAX_PENDIENTES = int(st.secrets.get("sftp_max_pendientes", 64))
+        # Modo multiplexado: las conexiones del pool son canales sobre uno o dos transportes SSH
+        self.SSH_MULTIPLEXAR = bool(st.secrets.get("ssh_multiplexar", False))
+        self.SSH_MAX_CANALES = int(st.secrets.get("ssh_max_canales", 10))
+        # Dónde viven los CSV: "sftp" (servidor remoto), "local" (este equipo) o "sqlite"
+        self.ALMACENAMIENTO = st.secrets.get("almacenamiento", "sftp")
+        # Raíz de las rutas para "local" (sin ella se usan tal cual) o archivo de la base para "sqlite"
+        self.ALMACENAMIENTO_RUTA = st.secrets.get("almacenamiento_ruta")
+
+
+CONFIG: Optional[ConfigRemota] = None  # La de la app en ejecución; la fija configurar()
+
+
+# ==================
+# FUNCIONES SSH/SFTP
+# ==================
+class MetricasSSH:
+    """Contadores e histogramas del pool y de la E/S remota, compartidos por todo el proceso"""
+    LIMITES = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    AYUDA = {
+        'ssh_checkouts_total': "Entregas de conexiones del pool por resultado",
+        'ssh_checkout_espera_segundos': "Tiempo hasta obtener una conexión del pool",
+        'ssh_handshakes_total': "Handshakes SSH por resultado",
+        'ssh_handshake_segundos': "Duración de los handshakes SSH exitosos",
+        'ssh_locks_total': "Intentos de lock de archivo remoto por resultado",
+        'ssh_lock_espera_segundos': "Tiempo esperando el lock de archivo remoto",
+        'ssh_bytes_leidos_total': "Bytes leídos del servidor remoto",
+        'ssh_bytes_escritos_total': "Bytes escritos en el servidor remoto",
+        'ssh_fallos_total': "Operaciones remotas fallidas por tipo",
+        'ssh_canales_total': "Canales SFTP abiertos sobre transportes compartidos por resultado",
+        'ssh_circuito_transiciones_total': "Cambios de estado del circuito hacia el servidor remoto",
+        'ssh_cache_archivos_total': "Lecturas completas resueltas por la caché de archivos por resultado",
+        'diario_registros_total': "Registros confirmados en el diario local",
+        'diario_registros_enviados_total': "Registros del diario entregados al servidor",
+        'diario_lotes_total': "Lotes del diario enviados al servidor por resultado",
+        'diario_errores_total': "Pasadas del hilo de envío del diario interrumpidas por una excepción",
+    }
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}  # (nombre, etiquetas) -> valor
+        self._histogramas = {}  # (nombre, etiquetas) -> {'cubetas': [...], 'suma': s, 'cuenta': n}
+    
+    def incrementar(self, nombre: str, valor: float = 1, **etiquetas):
+        """Suma `valor` al contador `nombre` con las etiquetas indicadas"""
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+    
+    def observar(self, nombre: str, segundos: float, **etiquetas):
+        """Registra una duración en el histograma `nombre`"""
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            hist = self._histogramas.get(clave)
+            if hist is None:
+                hist = {'cubetas': [0] * len(self.LIMITES), 'suma': 0.0, 'cuenta': 0}
+                self._histogramas[clave] = hist
+            for i, limite in enumerate(self.LIMITES):
+                if segundos <= limite:
+                    hist['cubetas'][i] += 1
+                    break
+            hist['suma'] += segundos
+            hist['cuenta'] += 1
+    
+    def contador(self, nombre: str, **etiquetas) -> float:
+        """Valor actual de un contador (suma de todas sus etiquetas si no se indican)"""
+        with self._lock:
+            if etiquetas:
+                return self._contadores.get((nombre, tuple(sorted(etiquetas.items()))), 0)
+            return sum(v for (n, _), v in self._contadores.items() if n == nombre)
+    
+    def percentil(self, nombre: str, q: float) -> Optional[float]:
+        """Estimación del percentil q (0-1) a partir de las cubetas del histograma"""
+        with self._lock:
+            cubetas = [0] * len(self.LIMITES)
+            total = 0
+            for (n, _), hist in self._histogramas.items():
+                if n == nombre:
+                    cubetas = [a + b for a, b in zip(cubetas, hist['cubetas'])]
+                    total += hist['cuenta']
+        if total == 0:
+            return None
+        acumulado = 0
+        for limite, cantidad in zip(self.LIMITES, cubetas):
+            acumulado += cantidad
+            if acumulado >= q * total:
+                return limite
+        return float('inf')
+    
+    def exportar_prometheus(self, medidores: Optional[Dict[str, float]] = None) -> str:
+        """Volcado en formato de texto de Prometheus"""
+        def formato_etiquetas(etiquetas) -> str:
+            if not etiquetas:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in etiquetas) + "}"
+        
+        lineas = []
+        with self._lock:
+            for nombre in sorted({n for n, _ in self._contadores}):
+                if nombre in self.AYUDA:
+                    lineas.append(f"# HELP {nombre} {self.AYUDA[nombre]}")
+                lineas.append(f"# TYPE {nombre} counter")
+                for (n, etiquetas), valor in sorted(self._contadores.items()):
+                    if n == nombre:
+                        lineas.append(f"{nombre}{formato_etiquetas(etiquetas)} {valor:g}")
+            
+            for nombre in sorted({n for n, _ in self._histogramas}):
+                if nombre in self.AYUDA:
+                    lineas.append(f"# HELP {nombre} {self.AYUDA[nombre]}")
+                lineas.append(f"# TYPE {nombre} histogram")
+                for (n, etiquetas), hist in sorted(self._histogramas.items()):
+                    if n != nombre:
+                        continue
+                    acumulado = 0
+                    for limite, cantidad in zip(self.LIMITES, hist['cubetas']):
+                        acumulado += cantidad
+                        lineas.append(f"{nombre}_bucket{formato_etiquetas(etiquetas + (('le', f'{limite:g}'),))} {acumulado}")
+                    lineas.append(f"{nombre}_bucket{formato_etiquetas(etiquetas + (('le', '+Inf'),))} {hist['cuenta']}")
+                    lineas.append(f"{nombre}_sum{formato_etiquetas(etiquetas)} {hist['suma']:.6f}")
+                    lineas.append(f"{nombre}_count{formato_etiquetas(etiquetas)} {hist['cuenta']}")
+        
+        for nombre, valor in (medidores or {}).items():
+            lineas.append(f"# TYPE {nombre} gauge")
+            lineas.append(f"{nombre} {valor:g}")
+        return "\n".join(lineas) + "\n"
+
+
+class PoliticaReintentos:
+    """
+    Cuándo reintentar una operación remota: backoff exponencial con jitter completo y plazo total.
+    
+    La espera tras el intento n es aleatoria entre 0 y min(tope, base·2^n): las sesiones que
+    fallaron a la vez (p. ej. todas esperando el mismo lock) se reparten en el tiempo en lugar
+    de reintentar al unísono. Un mismo objeto se comparte entre operaciones; cada recorrido
+    de intentos() lleva su propia cuenta y su propio plazo.
+    """
+    def __init__(self, base: float, tope: float, max_intentos: Optional[int] = None,
+                 plazo: Optional[float] = None):
+        self.base = base
+        self.tope = tope
+        self.max_intentos = max_intentos
+        self.plazo = plazo
+    
+    def espera(self, intento: int) -> float:
+        """Segundos a esperar después del intento fallido número `intento` (el primero es 0)"""
+        return random.uniform(0, min(self.tope, self.base * 2 ** min(intento, 32)))
+    
+    def intentos(self):
+        """Genera (número de intento, es_el_último) y duerme entre uno y otro.
+        
+        Si el cuerpo del bucle sale con return o break no se espera nada. Un intento es el
+        último cuando se llegó a max_intentos o cuando la espera siguiente pasaría del plazo.
+        """
+        limite = None if self.plazo is None else time.monotonic() + self.plazo
+        for intento in itertools.count():
+            espera = self.espera(intento)
+            ultimo = ((self.max_intentos is not None and intento + 1 >= self.max_intentos)
+                      or (limite is not None and time.monotonic() + espera > limite))
+            yield intento, ultimo
+            if ultimo:
+                return
+            time.sleep(espera)
+
+
+class CircuitoRemoto:
+    """
+    Circuito hacia el servidor remoto: deja de intentar conexiones mientras se sabe que está caído.
+    
+    Cerrado: se conecta normalmente. Tras `umbral_fallos` handshakes fallidos seguidos se abre
+    y durante `intervalo_sondeo` segundos toda conexión nueva falla de inmediato, sin esperar
+    el timeout. Cumplido el intervalo pasa a semiabierto: una sola conexión sale como sondeo y
+    las demás siguen fallando rápido; si el sondeo conecta el circuito se cierra, si no se
+    vuelve a abrir otro intervalo.
+    """
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+    
+    def __init__(self, umbral_fallos: int, intervalo_sondeo: float, metricas: Optional[MetricasSSH] = None):
+        self.umbral_fallos = umbral_fallos
+        self.intervalo_sondeo = intervalo_sondeo
+        self.metricas = metricas
+        self.estado = self.CERRADO
+        self._lock = threading.Lock()
+        self._fallos = 0
+        self._desde = 0.0  # Momento en que se abrió o en que salió el sondeo
+    
+    def _cambiar(self, estado: str):
+        if estado != self.estado:
+            self.estado = estado
+            if self.metricas is not None:
+                self.metricas.incrementar("ssh_circuito_transiciones_total", estado=estado)
+    
+    def disponible(self) -> bool:
+        """Si ahora se permitiría intentar una conexión (no reserva el sondeo)"""
+        with self._lock:
+            return (self.estado == self.CERRADO
+                    or time.monotonic() - self._desde >= self.intervalo_sondeo)
+    
+    def permitir(self) -> bool:
+        """Si se puede intentar una conexión; cuando toca sondear, el primero en pedirlo es el sondeo"""
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return True
+            # Un sondeo que nunca informó (hilo muerto) no bloquea el circuito para siempre
+            if time.monotonic() - self._desde >= self.intervalo_sondeo:
+                self._cambiar(self.SEMIABIERTO)
+                self._desde = time.monotonic()
+                return True
+            return False
+    
+    def segundos_para_sondeo(self) -> float:
+        """Cuánto falta para el siguiente sondeo (0 con el circuito cerrado)"""
+        with self._lock:
+            if self.estado == self.CERRADO:
+                return 0.0
+            return max(0.0, self._desde + self.intervalo_sondeo - time.monotonic())
+    
+    def registrar_exito(self):
+        with self._lock:
+            self._fallos = 0
+            self._cambiar(self.CERRADO)
+    
+    def registrar_fallo(self):
+        with self._lock:
+            self._fallos += 1
+            if self.estado == self.SEMIABIERTO or self._fallos >= self.umbral_fallos:
+                self._cambiar(self.ABIERTO)
+                self._desde = time.monotonic()
+
+
+class CanalSSH:
+    """
+    Conexión del pool en modo multiplexado: un canal SFTP sobre un transporte SSH compartido.
+    
+    Para el pool se comporta como un SSHClient (get_transport, open_sftp, close), así que se
+    entrega, valida, devuelve y expira igual que una conexión propia. close() solo libera el
+    canal: el transporte se cierra cuando ya no le quedan canales.
+    """
+    def __init__(self, transporte: Dict[str, Any], liberar):
+        self._transporte = transporte
+        self._liberar = liberar
+        self._cerrado = False
+    
+    def get_transport(self):
+        return self._transporte['ssh'].get_transport()
+    
+    def open_sftp(self):
+        return self._transporte['ssh'].open_sftp()
+    
+    def close(self):
+        if not self._cerrado:
+            self._cerrado = True
+            self._liberar(self._transporte)
+
+
+class SSHConnectionPool:
+    """Pool de conexiones SSH para manejar múltiples usuarios simultáneos"""
+    _instance = None
+    _lock = threading.Lock()
+    
+    # Prioridades de la cola de espera (menor valor = se atiende antes)
+    PRIORIDAD_ESCRITURA = 0
+    PRIORIDAD_LECTURA = 1
+    PRIORIDAD_SONDEO = 2
+    _NUEVA = object()  # Marca de turno concedido para crear una conexión nueva
+    
+    def __new__(cls):
+        with cls._lock:
+            if cls._instance is None:
+                cls._instance = super(SSHConnectionPool, cls).__new__(cls)
+                cls._instance._initialize()
+            return cls._instance
+    
+    def _initialize(self):
+        self.available_connections = []
+        self.in_use_connections = []
+        self.pending_connections = 0  # Lugares reservados para conexiones en pleno handshake
+        self.checkout_timeout = CONFIG.SSH_ESPERA_TURNO  # Segundos máximos esperando turno cuando el pool está lleno
+        self._disponible = threading.Condition(self._lock)
+        self._cola_espera = []  # Heap de turnos (prioridad, orden de llegada)
+        self._turnos = itertools.count()
+        self._sftp_clients = {}  # Cliente SFTP abierto sobre cada conexión, reutilizado entre operaciones
+        self._directorios_conocidos = {}  # Directorios remotos que ya se vio que existen, por conexión
+        self.metricas = MetricasSSH()
+        self.max_connections = CONFIG.SSH_MAX_CONEXIONES  # Máximo de conexiones simultáneas
+        # Modo multiplexado: cada conexión del pool es un canal y los canales comparten transporte,
+        # así que solo hay un handshake (y un proceso sshd) por cada max_canales_por_transporte
+        self.multiplexar = CONFIG.SSH_MULTIPLEXAR
+        self.max_canales_por_transporte = CONFIG.SSH_MAX_CANALES  # MaxSessions de OpenSSH es 10 por omisión
+        self._transportes = []  # [{'ssh': SSHClient, 'canales': abiertos, 'max_canales': tope}]
+        self._lock_canales = threading.Lock()  # Protege _transportes y sus contadores
+        self._lock_handshake = threading.Lock()  # Un solo transporte nuevo a la vez
+        # Reintentos de handshakes y de operaciones remotas (lecturas, escrituras, appends)
+        self.reintentos = PoliticaReintentos(base=CONFIG.SSH_REINTENTO_BASE, tope=8.0,
+                                             max_intentos=CONFIG.MAX_RETRIES, plazo=60)
+        # Con el servidor caído, fallar de inmediato en lugar de esperar TIMEOUT × MAX_RETRIES por sesión
+        self.circuito = CircuitoRemoto(umbral_fallos=CONFIG.MAX_RETRIES, intervalo_sondeo=30, metricas=self.metricas)
+        self.connection_timeout = 300  # 5 minutos para reutilizar conexión
+        self.keepalive_interval = CONFIG.SSH_KEEPALIVE  # Keepalive del transporte SSH (segundos)
+        self.validation_interval = CONFIG.SSH_INTERVALO_VALIDACION  # Inactividad tras la cual se revalida la conexión
+        self.min_idle_connections = CONFIG.SSH_MIN_EN_REPOSO  # Conexiones listas que mantiene el precalentamiento
+        self.warmup_interval = CONFIG.SSH_INTERVALO_PRECALENTAMIENTO  # Segundos entre revisiones del precalentamiento
+        self._despertar = threading.Event()
+        self._detener = threading.Event()
+        self._hilo_precalentamiento = None
+    
+    def _conexion_activa(self, conn_data) -> bool:
+        """Verifica la conexión a nivel de transporte, sin abrir canales en el servidor"""
+        transport = conn_data['ssh'].get_transport()
+        if not transport or not transport.is_active():
+            return False
+        
+        # Si estuvo inactiva mucho tiempo, enviar un paquete IGNORE: no espera respuesta,
+        # pero falla de inmediato si el socket se cerró. El keepalive detecta el resto en segundo plano.
+        if time.time() - conn_data['last_used'] > self.validation_interval:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+        return transport.is_active()
+    
+    def _cerrar(self, ssh):
+        """Cierra una conexión ignorando errores"""
+        self.discard_sftp(ssh)
+        if not isinstance(ssh, CanalSSH):
+            # Un canal comparte el transporte: sus directorios se olvidan al cerrar el transporte
+            self.olvidar_directorios(ssh)
+        try:
+            ssh.close()
+        except:
+            pass
+    
+    def get_sftp(self, ssh):
+        """Cliente SFTP de la conexión: se abre una sola vez y se reutiliza mientras el canal siga abierto"""
+        sftp = self._sftp_clients.get(ssh)
+        if sftp is None or sftp.sock.closed:
+            sftp = ssh.open_sftp()
+            sftp.get_channel().settimeout(CONFIG.TIMEOUT)
+            self._sftp_clients[ssh] = sftp
+        return sftp
+    
+    def discard_sftp(self, ssh):
+        """Cierra el cliente SFTP de la conexión (p. ej. tras un error) para abrir uno limpio la próxima vez"""
+        sftp = self._sftp_clients.pop(ssh, None)
+        if sftp is not None:
+            try:
+                sftp.close()
+            except:
+                pass
+    
+    def directorios_conocidos(self, ssh) -> set:
+        """Directorios remotos que ya se sabe que existen vistos desde el transporte de esta conexión"""
+        transport = ssh.get_transport()
+        if transport is None:
+            return set()
+        return self._directorios_conocidos.setdefault(transport, set())
+    
+    def olvidar_directorios(self, ssh):
+        """Descarta los directorios conocidos del transporte de la conexión (p. ej. tras un ENOENT)"""
+        self._directorios_conocidos.pop(ssh.get_transport(), None)
+    
+    def get_connection(self, prioridad: Optional[int] = None, timeout: Optional[float] = None):
+        """Obtiene una conexión del pool; si está lleno espera su turno (FIFO por prioridad)"""
+        if prioridad is None:
+            prioridad = self.PRIORIDAD_LECTURA
+        inicio = time.time()
+        limite = inicio + (self.checkout_timeout if timeout is None else timeout)
+        turno = (prioridad, next(self._turnos))
+        
+        # El circuito solo frena handshakes nuevos (_conectar): las conexiones vivas del pool
+        # se siguen entregando aunque otros handshakes hayan fallado
+        while True:
+            conn_data = self._esperar_turno(turno, limite)
+            if conn_data is None:
+                self.metricas.incrementar("ssh_checkouts_total", resultado="agotado")
+                return None
+            
+            if conn_data is self._NUEVA:
+                # El handshake se hace fuera del lock para no bloquear a las demás sesiones
+                ssh = None
+                try:
+                    ssh = self._create_new_connection()
+                finally:
+                    with self._disponible:
+                        self.pending_connections -= 1
+                        if ssh:
+                            self.in_use_connections.append({
+                                'ssh': ssh,
+                                'last_used': time.time()
+                            })
+                        self._disponible.notify_all()
+                if ssh:
+                    resultado = "nueva"
+                else:
+                    resultado = "error" if self.circuito.disponible() else "circuito_abierto"
+                self.metricas.incrementar("ssh_checkouts_total", resultado=resultado)
+                self.metricas.observar("ssh_checkout_espera_segundos", time.time() - inicio)
+                return ssh
+            
+            if self._conexion_activa(conn_data):
+                self.metricas.incrementar("ssh_checkouts_total", resultado="reutilizada")
+                self.metricas.observar("ssh_checkout_espera_segundos", time.time() - inicio)
+                return conn_data['ssh']
+            
+            # Conexión muerta: descartarla y volver a la cola conservando el turno
+            with self._disponible:
+                self.in_use_connections = [
+                    conn for conn in self.in_use_connections
+                    if conn['ssh'] != conn_data['ssh']
+                ]
+                self._disponible.notify_all()
+            self._cerrar(conn_data['ssh'])
+    
+    def _esperar_turno(self, turno, limite: float):
+        """Espera a ser el primero de la cola y a que haya una conexión libre o lugar para crear una"""
+        with self._disponible:
+            heapq.heappush(self._cola_espera, turno)
+            try:
+                while True:
+                    if self._cola_espera[0] == turno:
+                        self._limpiar_expiradas()
+                        
+                        # Reservar la conexión disponible; se verifica fuera del lock
+                        if self.available_connections:
+                            conn_data = self.available_connections.pop()
+                            self.in_use_connections.append({
+                                'ssh': conn_data['ssh'],
+                                'last_used': time.time()
+                            })
+                            if len(self.available_connections) < self.min_idle_connections:
+                                self._despertar.set()
+                            return conn_data
+                        
+                        # Crear nueva conexión si no excedemos el límite: se reserva el lugar
+                        if len(self.in_use_connections) + self.pending_connections < self.max_connections:
+                            self.pending_connections += 1
+                            return self._NUEVA
+                    
+                    restante = limite - time.time()
+                    if restante <= 0:
+                        return None
+                    self._disponible.wait(restante)
+            finally:
+                self._cola_espera.remove(turno)
+                heapq.heapify(self._cola_espera)
+                # El siguiente en la cola puede ser atendido
+                self._disponible.notify_all()
+    
+    def _limpiar_expiradas(self):
+        """Cierra las conexiones en reposo que superaron connection_timeout (llamar con el lock tomado)"""
+        current_time = time.time()
+        vigentes = []
+        for conn in self.available_connections:
+            if (current_time - conn['last_used']) < self.connection_timeout:
+                vigentes.append(conn)
+            else:
+                self._cerrar(conn['ssh'])
+        self.available_connections = vigentes
+    
+    def iniciar_precalentamiento(self):
+        """Arranca el hilo que mantiene min_idle_connections conexiones listas"""
+        with self._lock:
+            if self._hilo_precalentamiento is None or not self._hilo_precalentamiento.is_alive():
+                self._hilo_precalentamiento = threading.Thread(
+                    target=self._mantener_minimo,
+                    name="ssh-pool-precalentamiento",
+                    daemon=True
+                )
+                self._hilo_precalentamiento.start()
+    
+    def _mantener_minimo(self):
+        """Rellena el pool al arrancar, cada warmup_interval y cuando una entrega lo deja bajo el mínimo"""
+        while not self._detener.is_set():
+            self._despertar.clear()
+            try:
+                self._rellenar()
+            except Exception:
+                pass  # Se reintenta en la siguiente vuelta
+            self._despertar.wait(self.warmup_interval)
+    
+    def _rellenar(self):
+        """Crea las conexiones en reposo que falten, sin superar max_connections"""
+        with self._disponible:
+            self._limpiar_expiradas()
+            ocupadas = len(self.in_use_connections) + len(self.available_connections) + self.pending_connections
+            faltantes = min(
+                self.min_idle_connections - len(self.available_connections) - self.pending_connections,
+                self.max_connections - ocupadas
+            )
+            if faltantes <= 0:
+                return
+            self.pending_connections += faltantes
+        
+        for _ in range(faltantes):
+            ssh = None
+            try:
+                ssh = self._create_new_connection()
+            finally:
+                with self._disponible:
+                    self.pending_connections -= 1
+                    if ssh and self._detener.is_set():
+                        # cleanup() llegó durante el handshake: no dejar la conexión abierta
+                        self._cerrar(ssh)
+                    elif ssh:
+                        self.available_connections.append({
+                            'ssh': ssh,
+                            'last_used': time.time()
+                        })
+                    self._disponible.notify_all()
+    
+    def _create_new_connection(self):
+        """Crea una nueva conexión: un transporte SSH propio o, en modo multiplexado, un canal"""
+        if self.multiplexar:
+            return self._abrir_canal()
+        return self._conectar()
+    
+    def _abrir_canal(self) -> Optional[CanalSSH]:
+        """Abre un canal SFTP en el transporte menos ocupado; si todos están llenos, abre otro transporte"""
+        while True:
+            transporte = self._reservar_canal()
+            if transporte is None:
+                # Un handshake a la vez: quien esperaba el lock puede encontrar lugar en el transporte recién abierto
+                with self._lock_handshake:
+                    transporte = self._reservar_canal()
+                    if transporte is None:
+                        ssh = self._conectar()
+                        if ssh is None:
+                            return None
+                        transporte = {'ssh': ssh, 'canales': 1, 'max_canales': self.max_canales_por_transporte}
+                        with self._lock_canales:
+                            self._transportes.append(transporte)
+            
+            try:
+                sftp = transporte['ssh'].open_sftp()
+            except Exception:
+                with self._lock_canales:
+                    transporte['canales'] -= 1
+                    # Tope real del servidor (MaxSessions): no pedir más canales en este transporte
+                    transporte['max_canales'] = transporte['canales']
+                    otros = transporte['canales']
+                if otros == 0:
+                    # Ni un solo canal en el transporte: no es saturación sino un fallo
+                    self._liberar_canal(transporte, reservado=False)
+                    self.metricas.incrementar("ssh_canales_total", resultado="error")
+                    return None
+                self.metricas.incrementar("ssh_canales_total", resultado="rechazado")
+                continue
+            
+            sftp.get_channel().settimeout(CONFIG.TIMEOUT)
+            canal = CanalSSH(transporte, self._liberar_canal)
+            self._sftp_clients[canal] = sftp
+            self.metricas.incrementar("ssh_canales_total", resultado="abierto")
+            return canal
+    
+    def _reservar_canal(self) -> Optional[Dict[str, Any]]:
+        """Aparta un lugar en el transporte activo con menos canales; None si no hay ninguno con lugar"""
+        with self._lock_canales:
+            con_lugar = [
+                t for t in self._transportes
+                if t['canales'] < t['max_canales'] and t['ssh'].get_transport() is not None
+                and t['ssh'].get_transport().is_active()
+            ]
+            if not con_lugar:
+                return None
+            transporte = min(con_lugar, key=lambda t: t['canales'])
+            transporte['canales'] += 1
+            return transporte
+    
+    def _liberar_canal(self, transporte: Dict[str, Any], reservado: bool = True):
+        """Libera el lugar de un canal; el transporte se cierra al quedarse sin canales"""
+        with self._lock_canales:
+            if reservado:
+                transporte['canales'] -= 1
+            if transporte['canales'] > 0:
+                return
+            if transporte in self._transportes:
+                self._transportes.remove(transporte)
+        self._directorios_conocidos.pop(transporte['ssh'].get_transport(), None)
+        try:
+            transporte['ssh'].close()
+        except:
+            pass
+    
+    def _conectar(self):
+        """Handshake y autenticación de un transporte SSH nuevo"""
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        
+        if not self.circuito.permitir():
+            self.metricas.incrementar("ssh_handshakes_total", resultado="circuito_abierto")
+            return None
+        for attempt, ultimo in self.reintentos.intentos():
+            inicio = time.time()
+            try:
+                ssh.connect(
+                    hostname=CONFIG.REMOTE['HOST'],
+                    port=CONFIG.REMOTE['PORT'],
+                    username=CONFIG.REMOTE['USER'],
+                    password=CONFIG.REMOTE['PASSWORD'],
+                    timeout=CONFIG.TIMEOUT,
+                    banner_timeout=30,
+                    allow_agent=not CONFIG.SSH_SOLO_PASSWORD,
+                    look_for_keys=not CONFIG.SSH_SOLO_PASSWORD
+                )
+                ssh.get_transport().set_keepalive(self.keepalive_interval)
+                self.metricas.observar("ssh_handshake_segundos", time.time() - inicio)
+                self.metricas.incrementar("ssh_handshakes_total", resultado="ok")
+                self.circuito.registrar_exito()
+                return ssh
+            except Exception as e:
+                self.metricas.incrementar("ssh_handshakes_total", resultado="error")
+                self.circuito.registrar_fallo()
+                if ultimo or not self.circuito.permitir():
+                    st.error(f"Error de conexión SSH después de {attempt + 1} intentos: {str(e)}")
+                    return None
+    
+    def return_connection(self, ssh):
+        """Devuelve una conexión al pool"""
+        with self._disponible:
+            # Encontrar y remover de in_use_connections
+            self.in_use_connections = [
+                conn for conn in self.in_use_connections
+                if conn['ssh'] != ssh
+            ]
+            
+            # Devolverla al pool solo si el transporte sigue activo
+            transport = ssh.get_transport()
+            # Liberar el lugar para quien espera turno
+            self._disponible.notify_all()
+            if transport and transport.is_active():
+                self.available_connections.append({
+                    'ssh': ssh,
+                    'last_used': time.time()
+                })
+                return
+        self._cerrar(ssh)
+    
+    def estado(self) -> Dict[str, float]:
+        """Medidores instantáneos del pool"""
+        with self._lock:
+            return {
+                'ssh_pool_conexiones_en_uso': len(self.in_use_connections),
+                'ssh_pool_conexiones_en_reposo': len(self.available_connections),
+                'ssh_pool_conexiones_en_handshake': self.pending_connections,
+                'ssh_pool_esperando_turno': len(self._cola_espera),
+                'ssh_pool_max_conexiones': self.max_connections,
+                'ssh_circuito_abierto': int(self.circuito.estado != CircuitoRemoto.CERRADO),
+                'ssh_pool_transportes': (len(self._transportes) if self.multiplexar
+                                         else len(self.in_use_connections) + len(self.available_connections)),
+            }
+    
+    def cleanup(self):
+        """Limpia todas las conexiones"""
+        self._detener.set()
+        self._despertar.set()
+        with self._disponible:
+            for conn_data in self.available_connections + self.in_use_connections:
+                self._cerrar(conn_data['ssh'])
+            self.available_connections = []
+            self.in_use_connections = []
+            self._disponible.notify_all()
+        with self._lock_canales:
+            transportes, self._transportes = self._transportes, []
+        for transporte in transportes:
+            try:
+                transporte['ssh'].close()
+            except:
+                pass
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_pool_conexiones() -> SSHConnectionPool:
+    """Pool único por proceso: Streamlit re-ejecuta el script en cada interacción y en cada sesión"""
+    pool = SSHConnectionPool()
+    if CONFIG.ALMACENAMIENTO == "sftp":
+        pool.iniciar_precalentamiento()
+    atexit.register(pool.cleanup)
+    return pool
+
+
+class CacheArchivosRemotos:
+    """
+    Caché LRU del contenido de archivos remotos, validada con un stat (tamaño + mtime).
+    
+    Si el archivo no cambió desde la última lectura completa se devuelve el contenido
+    guardado en lugar de descargarlo otra vez. El mtime de SFTP tiene resolución de
+    segundos, así que no se guardan archivos modificados hace menos de `margen_mtime`
+    segundos: otra reescritura del mismo tamaño en ese segundo pasaría inadvertida.
+    Con max_bytes=0 está desactivada: las lecturas no hacen el stat de validación.
+    """
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, metricas: Optional[MetricasSSH] = None):
+        self.max_bytes = max_bytes
+        self.margen_mtime = 2
+        self.metricas = metricas
+        self._lock = threading.Lock()
+        self._entradas = OrderedDict()  # ruta -> (tamaño, mtime, contenido); la más reciente al final
+        self._bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+    
+    @property
+    def activa(self) -> bool:
+        return self.max_bytes > 0
+    
+    def _contar(self, resultado: str):
+        if resultado == "acierto":
+            self.aciertos += 1
+        else:
+            self.fallos += 1
+        if self.metricas is not None:
+            self.metricas.incrementar("ssh_cache_archivos_total", resultado=resultado)
+    
+    def obtener(self, ruta: str, atributos) -> Optional[str]:
+        """Contenido guardado si coincide con el stat actual del archivo; None si hay que leerlo"""
+        with self._lock:
+            entrada = self._entradas.get(ruta)
+            if entrada is not None and entrada[:2] == (atributos.st_size, atributos.st_mtime):
+                self._entradas.move_to_end(ruta)
+                self._contar("acierto")
+                return entrada[2]
+            self._contar("fallo")
+            return None
+    
+    def guardar(self, ruta: str, atributos, contenido: str):
+        """Guarda el contenido leído junto con el stat del archivo del que se leyó"""
+        if atributos.st_mtime is None or time.time() - atributos.st_mtime < self.margen_mtime:
+            self.invalidar(ruta)
+            return
+        tamano = atributos.st_size or 0
+        if not self.activa or tamano > self.max_bytes:
+            self.invalidar(ruta)
+            return
+        with self._lock:
+            anterior = self._entradas.pop(ruta, None)
+            if anterior is not None:
+                self._bytes -= anterior[0] or 0
+            self._entradas[ruta] = (atributos.st_size, atributos.st_mtime, contenido)
+            self._bytes += tamano
+            # Desalojar las menos usadas hasta caber en el presupuesto
+            while self._bytes > self.max_bytes:
+                _, (tamano_viejo, _, _) = self._entradas.popitem(last=False)
+                self._bytes -= tamano_viejo or 0
+    
+    def invalidar(self, ruta: str):
+        with self._lock:
+            anterior = self._entradas.pop(ruta, None)
+            if anterior is not None:
+                self._bytes -= anterior[0] or 0
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_cache_archivos() -> CacheArchivosRemotos:
+    """Caché de contenido compartida por todas las sesiones del proceso"""
+    return CacheArchivosRemotos(CONFIG.CACHE_ARCHIVOS_MB * 1024 * 1024, obtener_pool_conexiones().metricas)
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_archivos_verificados() -> set:
+    """Archivos cuyo encabezado y fin de línea ya se comprobaron, para todas las sesiones del proceso"""
+    return set()
+
+
+class _RespuestasLectura:
+    """Receptor de las lecturas asíncronas de SSHManager._leer_bloques.
+    
+    SFTPClient entrega cada respuesta a `_async_response` del objeto con que se pidió;
+    aquí solo se guardan por número de petición hasta que el lector las consume. Es un
+    protocolo interno de paramiko (ver _leer_bloques), válido con la versión fijada 3.4.0.
+    """
+    def __init__(self):
+        self.respuestas = {}
+
+    def _async_response(self, t, msg, num):
+        self.respuestas[num] = (t, msg)
+
+
+class AlmacenArchivos(abc.ABC):
+    """
+    Dónde viven los CSV de la app: la interfaz que usa SSHManager para leerlos y escribirlos.
+
+    Las rutas son las mismas en todos los respaldos (CONFIG.REMOTE['DIR'] + archivo). Las
+    lecturas devuelven ""/b"" si el archivo no existe y None si el almacenamiento no responde;
+    las escrituras devuelven True o False. anexar() y reemplazar() toman ellas mismas el lock
+    del archivo; bloquear() es para excluir a los demás escritores durante varias operaciones
+    (dentro de él no se llama a anexar() ni a reemplazar() sobre el mismo archivo).
+    """
+    descripcion = "almacenamiento"
+
+    @abc.abstractmethod
+    def disponible(self) -> bool:
+        """Sondeo rápido para el estado de la barra lateral"""
+
+    @abc.abstractmethod
+    def leer(self, ruta: str) -> Optional[str]:
+        """Contenido completo del archivo"""
+
+    @abc.abstractmethod
+    def leer_rango(self, ruta: str, offset: int = 0, num_bytes: Optional[int] = None) -> Optional[bytes]:
+        """`num_bytes` a partir de `offset` (negativo: contado desde el final; sin `num_bytes`, hasta el final)"""
+
+    @abc.abstractmethod
+    def iterar_csv(self, ruta: str, **formato):
+        """Filas del CSV sin cargarlo completo; un fallo del almacenamiento se propaga como IOError"""
+
+    @abc.abstractmethod
+    def stat(self, ruta: str) -> Optional[paramiko.SFTPAttributes]:
+        """Tamaño y fecha de modificación (st_size=0 y st_mtime=None si no existe)"""
+
+    @abc.abstractmethod
+    def reemplazar(self, ruta: str, contenido: str) -> bool:
+        """Sustituye el archivo completo de forma atómica: los lectores ven la versión anterior o la nueva"""
+
+    @abc.abstractmethod
+    def anexar(self, ruta: str, contenido: str, encabezado: Optional[str] = None) -> bool:
+        """Añade al final; si el archivo está vacío escribe antes `encabezado`"""
+
+    @abc.abstractmethod
+    def bloquear(self, ruta: str):
+        """Context manager con el lock exclusivo del archivo: entrega el token del dueño o None si no se obtuvo"""
+
+    @staticmethod
+    def _prefijo_registro(tamano: int, ultimo_byte: bytes, encabezado: Optional[str]) -> bytes:
+        """Qué escribir antes del registro: el encabezado si el archivo está vacío o el salto de línea que le falte"""
+        if tamano == 0:
+            return encabezado.encode('utf-8') if encabezado else b""
+        return b"" if ultimo_byte == b"\n" else b"\n"
+
+    @staticmethod
+    def _rango(tamano: int, offset: int, num_bytes: Optional[int]):
+        """Límites [inicio, fin) de una lectura por rango sobre un archivo de `tamano` bytes"""
+        inicio = max(0, tamano + offset) if offset < 0 else offset
+        fin = tamano if num_bytes is None else min(tamano, inicio + num_bytes)
+        return inicio, max(inicio, fin)
+
+    def _registrar_lock(self, inicio: float, adquirido: bool):
+        self.metricas.observar("ssh_lock_espera_segundos", time.time() - inicio)
+        self.metricas.incrementar("ssh_locks_total", resultado="adquirido" if adquirido else "agotado")
+
+
+class AlmacenSFTP(AlmacenArchivos):
+    """Los CSV en el servidor remoto por SFTP, con el pool de conexiones, reintentos y lock de archivo .lock"""
+    descripcion = "servidor"
+
+    def disponible(self) -> bool:
+        # La barra lateral pregunta en cada rerun: se responde con el circuito y las conexiones
+        # que ya existen, sin esperar turno en el pool detrás de las sesiones que leen o escriben
+        pool = SSHManager._connection_pool
+        if not pool.circuito.disponible():
+            return False
+        estado = pool.estado()
+        if estado['ssh_pool_conexiones_en_uso'] or estado['ssh_pool_conexiones_en_reposo']:
+            return True
+        # Pool vacío (primera carga o todas las conexiones se cayeron): un checkout sin espera
+        ssh = SSHManager.get_connection(SSHConnectionPool.PRIORIDAD_SONDEO, timeout=0)
+        if not ssh:
+            return False
+        SSHManager.return_connection(ssh)
+        return True
+
+    def leer(self, ruta: str) -> Optional[str]:
+        """Lee archivo remoto con manejo de errores y reintentos.
+        
+        La lectura no toma el lock: los escritores reemplazan el archivo con un rename atómico
+        o añaden registros completos en una sola escritura, así que siempre se lee una versión consistente.
+        Si el stat coincide con la última lectura se devuelve el contenido de la caché.
+        """
+        for _, ultimo in SSHManager._connection_pool.reintentos.intentos():
+            ssh = SSHManager.get_connection()
+            if not ssh:
+                if ultimo or not SSHManager.servidor_disponible():
+                    return None
+                continue
+            
+            try:
+                sftp = SSHManager._connection_pool.get_sftp(ssh)
+                if SSHManager._cache_archivos.activa:
+                    contenido = SSHManager._cache_archivos.obtener(ruta, sftp.stat(ruta))
+                    if contenido is not None:
+                        return contenido
+                
+                with sftp.file(ruta, 'r') as f:
+                    # El stat del handle abierto corresponde exactamente a lo que se lee
+                    atributos = f.stat()
+                    datos = SSHManager._leer_pipelined(f, atributos.st_size)
+                SSHManager._connection_pool.metricas.incrementar("ssh_bytes_leidos_total", len(datos))
+                contenido = datos.decode('utf-8')
+                SSHManager._cache_archivos.guardar(ruta, atributos, contenido)
+                return contenido
+                    
+            except FileNotFoundError:
+                return ""  # Archivo no existe, retornar vacío
+            except Exception as e:
+                # El canal SFTP pudo quedar en mal estado: descartarlo para abrir uno nuevo
+                SSHManager._connection_pool.discard_sftp(ssh)
+                SSHManager._connection_pool.metricas.incrementar("ssh_fallos_total", operacion="lectura")
+                if ultimo:
+                    st.error(f"Error leyendo archivo remoto: {str(e)}")
+                    return None
+                # En caso de error, reintentar
+            finally:
+                SSHManager.return_connection(ssh)
+        return None
+
+    def leer_rango(self, ruta: str, offset: int = 0, num_bytes: Optional[int] = None) -> Optional[bytes]:
+        """Lee `num_bytes` a partir de `offset` sin descargar el resto del archivo.
+        
+        Un offset negativo cuenta desde el final (-200: los últimos 200 bytes) y sin
+        `num_bytes` se lee hasta el final. Devuelve b"" si el archivo no existe y None
+        si falla la conexión.
+        """
+        for _, ultimo in SSHManager._connection_pool.reintentos.intentos():
+            ssh = SSHManager.get_connection()
+            if not ssh:
+                if ultimo or not SSHManager.servidor_disponible():
+                    return None
+                continue
+            
+            try:
+                sftp = SSHManager._connection_pool.get_sftp(ssh)
+                with sftp.file(ruta, 'r') as f:
+                    inicio, fin = self._rango(f.stat().st_size, offset, num_bytes)
+                    f.seek(inicio)
+                    datos = SSHManager._leer_pipelined(f, fin)
+                SSHManager._connection_pool.metricas.incrementar("ssh_bytes_leidos_total", len(datos))
+                return datos
+                    
+            except FileNotFoundError:
+                return b""
+            except Exception as e:
+                SSHManager._connection_pool.discard_sftp(ssh)
+                SSHManager._connection_pool.metricas.incrementar("ssh_fallos_total", operacion="lectura")
+                if ultimo:
+                    st.error(f"Error leyendo archivo remoto: {str(e)}")
+                    return None
+            finally:
+                SSHManager.return_connection(ssh)
+        return None
+
+    def iterar_csv(self, ruta: str, **formato):
+        """Genera las filas del CSV remoto (listas de str) a medida que se descargan.
+        
+        El archivo no se carga completo: se lee por bloques, se decodifica de forma
+        incremental y se pasa por csv.reader, así que la memoria no crece con el tamaño
+        del archivo. Si no existe no genera filas; un fallo de conexión se propaga como
+        IOError. La conexión queda tomada hasta que el generador termina o se cierra.
+        """
+        ssh = SSHManager.get_connection()
+        if not ssh:
+            raise IOError("No se pudo obtener conexión SSH")
+        
+        try:
+            sftp = SSHManager._connection_pool.get_sftp(ssh)
+            try:
+                f = sftp.file(ruta, 'r')
+            except FileNotFoundError:
+                return
+            with f:
+                metricas = SSHManager._connection_pool.metricas
+                
+                def bloques():
+                    for bloque in SSHManager._leer_bloques(f, f.stat().st_size):
+                        metricas.incrementar("ssh_bytes_leidos_total", len(bloque))
+                        yield bloque
+                
+                yield from csv.reader(SSHManager._lineas_utf8(bloques()), **formato)
+        except Exception:
+            SSHManager._connection_pool.discard_sftp(ssh)
+            SSHManager._connection_pool.metricas.incrementar("ssh_fallos_total", operacion="lectura")
+            raise
+        finally:
+            SSHManager.return_connection(ssh)
+
+    def stat(self, ruta: str) -> Optional[paramiko.SFTPAttributes]:
+        """Tamaño y fecha de modificación sin leer el archivo.
+        
+        Si el archivo no existe devuelve atributos con st_size=0 y st_mtime=None;
+        None si falla la conexión.
+        """
+        for _, ultimo in SSHManager._connection_pool.reintentos.intentos():
+            ssh = SSHManager.get_connection()
+            if not ssh:
+                if ultimo or not SSHManager.servidor_disponible():
+                    return None
+                continue
+            
+            try:
+                sftp = SSHManager._connection_pool.get_sftp(ssh)
+                return sftp.stat(ruta)
+            except FileNotFoundError:
+                atributos = paramiko.SFTPAttributes()
+                atributos.st_size = 0
+                return atributos
+            except Exception as e:
+                SSHManager._connection_pool.discard_sftp(ssh)
+                SSHManager._connection_pool.metricas.incrementar("ssh_fallos_total", operacion="lectura")
+                if ultimo:
+                    st.error(f"Error consultando archivo remoto: {str(e)}")
+                    return None
+            finally:
+                SSHManager.return_connection(ssh)
+        return None
+
+    def reemplazar(self, ruta: str, contenido: str) -> bool:
+        """Escribe en archivo remoto con manejo de errores y reintentos"""
+        for _, ultimo in SSHManager._connection_pool.reintentos.intentos():
+            ssh = SSHManager.get_connection(SSHConnectionPool.PRIORIDAD_ESCRITURA)
+            if not ssh:
+                if ultimo or not SSHManager.servidor_disponible():
+                    return False
+                continue
+            
+            try:
+                sftp = SSHManager._connection_pool.get_sftp(ssh)
+                datos = contenido.encode('utf-8')
+                
+                # Adquirir lock antes de escribir, con un lease que alcance para subir todo el archivo
+                token = SSHManager._acquire_file_lock(ruta, sftp, SSHManager._lease_para(len(datos)))
+                if token is None:
+                    st.warning("Esperando acceso al archivo...")
+                    if ultimo:
+                        return False
+                    continue
+                
+                try:
+                    # Crear directorio si no existe (sin ida y vuelta si ya se comprobó en esta conexión)
+                    SSHManager._crear_directorio_remoto(sftp, os.path.dirname(ruta),
+                                                        SSHManager._connection_pool.directorios_conocidos(ssh))
+                    
+                    # Escribir contenido temporal primero
+                    temp_path = ruta + '.tmp'
+                    SSHManager._escribir_pipelined(sftp, temp_path, datos)
+                    SSHManager._connection_pool.metricas.incrementar("ssh_bytes_escritos_total", len(datos))
+                    
+                    # Reemplazar archivo original de forma atómica (posix-rename sobrescribe el destino),
+                    # para que los lectores sin lock vean la versión anterior o la nueva, nunca una mezcla
+                    try:
+                        sftp.posix_rename(temp_path, ruta)
+                    except IOError:
+                        # Servidor sin la extensión posix-rename@openssh.com
+                        try:
+                            sftp.rename(temp_path, ruta)
+                        except:
+                            # Si falla el rename, intentar escribir directamente
+                            SSHManager._escribir_pipelined(sftp, ruta, datos)
+                    
+                    # El contenido cambió por completo: volver a verificar en el próximo append
+                    SSHManager._archivos_verificados.discard(ruta)
+                    SSHManager._cache_archivos.invalidar(ruta)
+                    return True
+                finally:
+                    # Liberar lock después de escribir
+                    SSHManager._release_file_lock(ruta, sftp, token)
+                    
+            except Exception as e:
+                # El canal SFTP pudo quedar en mal estado: descartarlo para abrir uno nuevo
+                SSHManager._connection_pool.discard_sftp(ssh)
+                if isinstance(e, FileNotFoundError):
+                    # Un directorio que se daba por existente ya no está: volver a comprobarlos
+                    SSHManager._connection_pool.olvidar_directorios(ssh)
+                SSHManager._connection_pool.metricas.incrementar("ssh_fallos_total", operacion="escritura")
+                if ultimo:
+                    st.error(f"Error escribiendo archivo remoto: {str(e)}")
+                    return False
+            finally:
+                SSHManager.return_connection(ssh)
+        return False
+
+    def anexar(self, ruta: str, contenido: str, encabezado: Optional[str] = None) -> bool:
+        """Añade contenido al final del archivo remoto sin descargarlo (modo append de SFTP)"""
+        for _, ultimo in SSHManager._connection_pool.reintentos.intentos():
+            ssh = SSHManager.get_connection(SSHConnectionPool.PRIORIDAD_ESCRITURA)
+            if not ssh:
+                if ultimo or not SSHManager.servidor_disponible():
+                    return False
+                continue
+            
+            try:
+                sftp = SSHManager._connection_pool.get_sftp(ssh)
+                
+                datos = contenido.encode('utf-8')
+                
+                # Adquirir lock antes de escribir
+                token = SSHManager._acquire_file_lock(ruta, sftp, SSHManager._lease_para(len(datos)))
+                if token is None:
+                    st.warning("Esperando acceso al archivo...")
+                    if ultimo:
+                        return False
+                    continue
+                
+                try:
+                    # El encabezado y el salto de línea final se comprueban una sola vez por archivo
+                    if ruta not in SSHManager._archivos_verificados:
+                        try:
+                            tamano = sftp.stat(ruta).st_size
+                        except FileNotFoundError:
+                            tamano = 0
+                        ultimo = b""
+                        if tamano:
+                            # Leer solo el último byte para saber si el archivo termina en nueva línea
+                            with sftp.file(ruta, 'r') as f:
+                                f.seek(tamano - 1)
+                                ultimo = f.read(1)
+                        datos = self._prefijo_registro(tamano, ultimo, encabezado) + datos
+                    
+                    # Escribir únicamente el registro nuevo al final del archivo
+                    with sftp.file(ruta, 'a') as f:
+                        f.write(datos)
+                    SSHManager._connection_pool.metricas.incrementar("ssh_bytes_escritos_total", len(datos))
+                    
+                    SSHManager._archivos_verificados.add(ruta)
+                    SSHManager._cache_archivos.invalidar(ruta)
+                    return True
+                finally:
+                    # Liberar lock después de escribir
+                    SSHManager._release_file_lock(ruta, sftp, token)
+                    
+            except Exception as e:
+                # El canal SFTP pudo quedar en mal estado: descartarlo para abrir uno nuevo
+                SSHManager._connection_pool.discard_sftp(ssh)
+                SSHManager._connection_pool.metricas.incrementar("ssh_fallos_total", operacion="append")
+                if ultimo:
+                    st.error(f"Error añadiendo al archivo remoto: {str(e)}")
+                    return False
+            finally:
+                SSHManager.return_connection(ssh)
+        return False
+
+    @contextlib.contextmanager
+    def bloquear(self, ruta: str):
+        ssh = SSHManager.get_connection(SSHConnectionPool.PRIORIDAD_ESCRITURA)
+        if not ssh:
+            yield None
+            return
+        try:
+            sftp = SSHManager._connection_pool.get_sftp(ssh)
+            token = SSHManager._acquire_file_lock(ruta, sftp)
+        except Exception:
+            SSHManager._connection_pool.discard_sftp(ssh)
+            token = None
+        try:
+            yield token
+        finally:
+            if token is not None:
+                SSHManager._release_file_lock(ruta, sftp, token)
+            SSHManager.return_connection(ssh)
+
+
+class AlmacenLocal(AlmacenArchivos):
+    """
+    Los CSV en el sistema de archivos de esta misma máquina (despliegue en un solo host o pruebas de carga).
+
+    Con `raiz` las rutas se ubican debajo de ese directorio; sin ella se usan tal cual. El lock
+    es un flock sobre `<archivo>.lock`: el sistema lo suelta si el proceso muere, así que no
+    hace falta lease. Cada escritura se sincroniza a disco (fsync) antes de confirmarse.
+    """
+    descripcion = "almacenamiento local"
+
+    def __init__(self, raiz: Optional[str] = None, metricas: Optional[MetricasSSH] = None):
+        self.raiz = raiz
+        self.metricas = metricas or MetricasSSH()
+
+    def _ruta(self, ruta: str) -> str:
+        return ruta if self.raiz is None else os.path.join(self.raiz, ruta.lstrip('/'))
+
+    def _fallo(self, operacion: str, mensaje: str, error: Exception):
+        self.metricas.incrementar("ssh_fallos_total", operacion=operacion)
+        st.error(f"{mensaje}: {str(error)}")
+
+    def disponible(self) -> bool:
+        directorio = self._ruta(CONFIG.REMOTE['DIR'])
+        try:
+            os.makedirs(directorio, exist_ok=True)
+        except OSError:
+            return False
+        return os.access(directorio, os.W_OK)
+
+    def leer(self, ruta: str) -> Optional[str]:
+        datos = self.leer_rango(ruta)
+        return None if datos is None else datos.decode('utf-8')
+
+    def leer_rango(self, ruta: str, offset: int = 0, num_bytes: Optional[int] = None) -> Optional[bytes]:
+        try:
+            with open(self._ruta(ruta), 'rb') as f:
+                inicio, fin = self._rango(os.fstat(f.fileno()).st_size, offset, num_bytes)
+                f.seek(inicio)
+                datos = f.read(fin - inicio)
+        except FileNotFoundError:
+            return b""
+        except OSError as e:
+            self._fallo("lectura", "Error leyendo archivo", e)
+            return None
+        self.metricas.incrementar("ssh_bytes_leidos_total", len(datos))
+        return datos
+
+    def iterar_csv(self, ruta: str, **formato):
+        try:
+            f = open(self._ruta(ruta), 'r', encoding='utf-8', newline='')
+        except FileNotFoundError:
+            return
+        with f:
+            yield from csv.reader(f, **formato)
+
+    def stat(self, ruta: str) -> Optional[paramiko.SFTPAttributes]:
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._ruta(ruta)))
+        except FileNotFoundError:
+            atributos = paramiko.SFTPAttributes()
+            atributos.st_size = 0
+            return atributos
+        except OSError as e:
+            self._fallo("lectura", "Error consultando archivo", e)
+            return None
+
+    @contextlib.contextmanager
+    def bloquear(self, ruta: str):
+        # Solo POSIX: se importa aquí para que el módulo cargue en Windows con los demás almacenamientos
+        import fcntl
+        ruta_lock = self._ruta(ruta) + '.lock'
+        inicio = time.time()
+        os.makedirs(os.path.dirname(ruta_lock), exist_ok=True)
+        with open(ruta_lock, 'a') as f:
+            # Sin bloquear en flock: con el lock ocupado se espera con la misma política que por SFTP
+            for _ in SSHManager._reintentos_lock.intentos():
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    continue
+            else:
+                self._registrar_lock(inicio, False)
+                yield None
+                return
+            self._registrar_lock(inicio, True)
+            try:
+                yield ruta_lock
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def reemplazar(self, ruta: str, contenido: str) -> bool:
+        destino = self._ruta(ruta)
+        datos = contenido.encode('utf-8')
+        with self.bloquear(ruta) as token:
+            if token is None:
+                st.warning("El archivo está ocupado por otro escritor")
+                return False
+            try:
+                temporal = destino + '.tmp'
+                with open(temporal, 'wb') as f:
+                    f.write(datos)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporal, destino)
+            except OSError as e:
+                self._fallo("escritura", "Error escribiendo archivo", e)
+                return False
+        self.metricas.incrementar("ssh_bytes_escritos_total", len(datos))
+        return True
+
+    def anexar(self, ruta: str, contenido: str, encabezado: Optional[str] = None) -> bool:
+        with self.bloquear(ruta) as token:
+            if token is None:
+                st.warning("El archivo está ocupado por otro escritor")
+                return False
+            try:
+                with open(self._ruta(ruta), 'a+b') as f:
+                    tamano = f.seek(0, os.SEEK_END)
+                    ultimo = b""
+                    if tamano:
+                        f.seek(tamano - 1)
+                        ultimo = f.read(1)
+                    # En modo append la escritura va siempre al final, sin importar la posición
+                    datos = self._prefijo_registro(tamano, ultimo, encabezado) + contenido.encode('utf-8')
+                    f.write(datos)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError as e:
+                self._fallo("append", "Error añadiendo al archivo", e)
+                return False
+        self.metricas.incrementar("ssh_bytes_escritos_total", len(datos))
+        return True
+
+
+class AlmacenSQLite(AlmacenArchivos):
+    """
+    Los CSV dentro de una base SQLite (un solo host, sin servidor de archivos).
+
+    Cada archivo es una serie de fragmentos con su offset: un append inserta un fragmento sin
+    reescribir lo anterior, una lectura por rango trae solo los fragmentos que la cubren y un
+    reemplazo borra e inserta en la misma transacción. El lock es una fila con lease en la
+    tabla locks, como el archivo .lock por SFTP. En modo WAL varios procesos comparten la base.
+    """
+    descripcion = "almacenamiento SQLite"
+
+    def __init__(self, ruta_db: str, metricas: Optional[MetricasSSH] = None):
+        os.makedirs(os.path.dirname(os.path.abspath(ruta_db)), exist_ok=True)
+        self.ruta_db = ruta_db
+        self.metricas = metricas or MetricasSSH()
+        self._lock = threading.Lock()
+        self._conn = self._conectar()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS archivos ("
+            " ruta TEXT PRIMARY KEY,"
+            " tamano INTEGER NOT NULL,"
+            " mtime REAL NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS fragmentos ("
+            " ruta TEXT NOT NULL,"
+            " inicio INTEGER NOT NULL,"
+            " datos BLOB NOT NULL,"
+            " PRIMARY KEY (ruta, inicio));"
+            "CREATE TABLE IF NOT EXISTS locks ("
+            " ruta TEXT PRIMARY KEY,"
+            " token TEXT NOT NULL,"
+            " vence REAL NOT NULL);"
+        )
+
+    def _conectar(self) -> sqlite3.Connection:
+        # Sin transacciones implícitas: cada operación abre la suya con _transaccion
+        conn = sqlite3.connect(self.ruta_db, timeout=30, isolation_level=None, check_same_thread=False)
+        # FULL: el commit no regresa hasta que el WAL está en disco (fsync)
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    @contextlib.contextmanager
+    def _transaccion(self, inmediata: bool = False):
+        """Transacción sobre la conexión compartida; IMMEDIATE toma el lock de escritura desde el inicio"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE" if inmediata else "BEGIN")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _fallo(self, operacion: str, mensaje: str, error: Exception):
+        self.metricas.incrementar("ssh_fallos_total", operacion=operacion)
+        st.error(f"{mensaje}: {str(error)}")
+
+    def disponible(self) -> bool:
+        try:
+            with self._transaccion() as conn:
+                conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def leer(self, ruta: str) -> Optional[str]:
+        datos = self.leer_rango(ruta)
+        return None if datos is None else datos.decode('utf-8')
+
+    def leer_rango(self, ruta: str, offset: int = 0, num_bytes: Optional[int] = None) -> Optional[bytes]:
+        try:
+            with self._transaccion() as conn:
+                fila = conn.execute("SELECT tamano FROM archivos WHERE ruta = ?", (ruta,)).fetchone()
+                if fila is None:
+                    return b""
+                inicio, fin = self._rango(fila[0], offset, num_bytes)
+                if inicio == fin:
+                    return b""
+                # Desde el fragmento que contiene `inicio` hasta el último que empieza antes de `fin`
+                fragmentos = conn.execute(
+                    "SELECT inicio, datos FROM fragmentos WHERE ruta = ? AND inicio < ? AND inicio >= "
+                    "(SELECT MAX(inicio) FROM fragmentos WHERE ruta = ? AND inicio <= ?) ORDER BY inicio",
+                    (ruta, fin, ruta, inicio)
+                ).fetchall()
+        except sqlite3.Error as e:
+            self._fallo("lectura", "Error leyendo archivo", e)
+            return None
+        base = fragmentos[0][0]
+        datos = b"".join(fragmento for _, fragmento in fragmentos)[inicio - base:fin - base]
+        self.metricas.incrementar("ssh_bytes_leidos_total", len(datos))
+        return datos
+
+    def iterar_csv(self, ruta: str, **formato):
+        # Conexión propia: el recorrido ve una sola versión del archivo (lectura en WAL) sin
+        # retener la conexión compartida mientras quien consume procesa las filas
+        conn = self._conectar()
+        try:
+            conn.execute("BEGIN")
+            fragmentos = conn.execute(
+                "SELECT datos FROM fragmentos WHERE ruta = ? ORDER BY inicio", (ruta,)
+            )
+            yield from csv.reader(SSHManager._lineas_utf8(datos for (datos,) in fragmentos), **formato)
+        except sqlite3.Error as e:
+            raise IOError(str(e)) from e
+        finally:
+            conn.close()
+
+    def stat(self, ruta: str) -> Optional[paramiko.SFTPAttributes]:
+        try:
+            with self._transaccion() as conn:
+                fila = conn.execute("SELECT tamano, mtime FROM archivos WHERE ruta = ?", (ruta,)).fetchone()
+        except sqlite3.Error as e:
+            self._fallo("lectura", "Error consultando archivo", e)
+            return None
+        atributos = paramiko.SFTPAttributes()
+        atributos.st_size = 0
+        if fila is not None:
+            # Segundos enteros, como los entrega SFTP
+            atributos.st_size, atributos.st_mtime = fila[0], int(fila[1])
+        return atributos
+
+    @contextlib.contextmanager
+    def bloquear(self, ruta: str):
+        token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        inicio = time.time()
+        adquirido = False
+        for _ in SSHManager._reintentos_lock.intentos():
+            try:
+                with self._transaccion(inmediata=True) as conn:
+                    # Un lease vencido es de un proceso que murió con el lock tomado
+                    conn.execute("DELETE FROM locks WHERE ruta = ? AND vence < ?", (ruta, time.time()))
+                    adquirido = conn.execute(
+                        "INSERT OR IGNORE INTO locks (ruta, token, vence) VALUES (?, ?, ?)",
+                        (ruta, token, time.time() + SSHManager._file_lock_lease)
+                    ).rowcount == 1
+            except sqlite3.Error:
+                break
+            if adquirido:
+                break
+        self._registrar_lock(inicio, adquirido)
+        if not adquirido:
+            yield None
+            return
+        try:
+            yield token
+        finally:
+            try:
+                with self._transaccion(inmediata=True) as conn:
+                    conn.execute("DELETE FROM locks WHERE ruta = ? AND token = ?", (ruta, token))
+            except sqlite3.Error:
+                pass  # El lease vence solo
+
+    def reemplazar(self, ruta: str, contenido: str) -> bool:
+        datos = contenido.encode('utf-8')
+        with self.bloquear(ruta) as token:
+            if token is None:
+                st.warning("El archivo está ocupado por otro escritor")
+                return False
+            try:
+                with self._transaccion(inmediata=True) as conn:
+                    conn.execute("DELETE FROM fragmentos WHERE ruta = ?", (ruta,))
+                    if datos:
+                        conn.execute("INSERT INTO fragmentos (ruta, inicio, datos) VALUES (?, 0, ?)", (ruta, datos))
+                    conn.execute("INSERT OR REPLACE INTO archivos (ruta, tamano, mtime) VALUES (?, ?, ?)",
+                                 (ruta, len(datos), time.time()))
+            except sqlite3.Error as e:
+                self._fallo("escritura", "Error escribiendo archivo", e)
+                return False
+        self.metricas.incrementar("ssh_bytes_escritos_total", len(datos))
+        return True
+
+    def anexar(self, ruta: str, contenido: str, encabezado: Optional[str] = None) -> bool:
+        with self.bloquear(ruta) as token:
+            if token is None:
+                st.warning("El archivo está ocupado por otro escritor")
+                return False
+            try:
+                with self._transaccion(inmediata=True) as conn:
+                    fila = conn.execute("SELECT tamano FROM archivos WHERE ruta = ?", (ruta,)).fetchone()
+                    tamano = fila[0] if fila else 0
+                    ultimo = b""
+                    if tamano:
+                        ultimo = conn.execute(
+                            "SELECT substr(datos, -1) FROM fragmentos WHERE ruta = ? ORDER BY inicio DESC LIMIT 1",
+                            (ruta,)
+                        ).fetchone()[0]
+                    datos = self._prefijo_registro(tamano, ultimo, encabezado) + contenido.encode('utf-8')
+                    if datos:
+                        conn.execute("INSERT INTO fragmentos (ruta, inicio, datos) VALUES (?, ?, ?)",
+                                     (ruta, tamano, datos))
+                    conn.execute("INSERT OR REPLACE INTO archivos (ruta, tamano, mtime) VALUES (?, ?, ?)",
+                                 (ruta, tamano + len(datos), time.time()))
+            except sqlite3.Error as e:
+                self._fallo("append", "Error añadiendo al archivo", e)
+                return False
+        self.metricas.incrementar("ssh_bytes_escritos_total", len(datos))
+        return True
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_almacenamiento() -> AlmacenArchivos:
+    """Respaldo de los CSV elegido en secrets (`almacenamiento`): sftp (por omisión), local o sqlite"""
+    metricas = obtener_pool_conexiones().metricas
+    if CONFIG.ALMACENAMIENTO == "sftp":
+        return AlmacenSFTP()
+    if CONFIG.ALMACENAMIENTO == "local":
+        return AlmacenLocal(CONFIG.ALMACENAMIENTO_RUTA, metricas)
+    if CONFIG.ALMACENAMIENTO == "sqlite":
+        ruta_db = CONFIG.ALMACENAMIENTO_RUTA or os.path.join(os.path.expanduser("~"), CONFIG.ALMACEN_SQLITE)
+        return AlmacenSQLite(ruta_db, metricas)
+    raise ValueError(f"Almacenamiento desconocido: {CONFIG.ALMACENAMIENTO!r} (sftp, local o sqlite)")
+
+
+class SSHManager:
+    # Objetos compartidos por todo el proceso; los enlaza configurar()
+    _connection_pool: Optional['SSHConnectionPool'] = None
+    _cache_archivos: Optional['CacheArchivosRemotos'] = None
+    _almacen: Optional['AlmacenArchivos'] = None
+    _archivos_verificados: Optional[set] = None  # Archivos cuyo encabezado y fin de línea ya se comprobaron
+    _file_lock_timeout = 30  # 30 segundos máximo para esperar un lock
+    _file_lock_lease = 20  # Vigencia mínima de un lock; pasado este tiempo se considera abandonado
+    # Ritmo de subida más lento que se supone al alargar el lease de una escritura grande
+    _lock_bytes_por_segundo = 256 * 1024
+    # Espera por el lock ocupado: de 50 ms hasta 0.5 s entre intentos, sin pasar de _file_lock_timeout
+    _reintentos_lock = PoliticaReintentos(base=0.05, tope=0.5, plazo=_file_lock_timeout)
+    # Liberar el lock: intentos rápidos (a lo sumo ~2 s de espera) antes de dejarlo al vencimiento
+    # del lease. Cada intento son tres peticiones, así que con un servidor inestable hacen falta varios
+    _reintentos_liberar = PoliticaReintentos(base=0.05, tope=0.5, max_intentos=8)
+
+    @staticmethod
+    def get_connection(prioridad: Optional[int] = None, timeout: Optional[float] = None):
+        """Obtiene una conexión del pool"""
+        return SSHManager._connection_pool.get_connection(prioridad, timeout)
+
+    @staticmethod
+    def servidor_disponible() -> bool:
+        """Falso mientras el circuito está abierto: el servidor se dio por caído y aún no toca sondearlo"""
+        return SSHManager._connection_pool.circuito.disponible()
+
+    @staticmethod
+    def return_connection(ssh):
+        """Devuelve una conexión al pool"""
+        SSHManager._connection_pool.return_connection(ssh)
+
+    @staticmethod
+    def almacenamiento_disponible() -> bool:
+        """Sondeo rápido del almacenamiento configurado, para el estado de la barra lateral"""
+        return SSHManager._almacen.disponible()
+
+    @staticmethod
+    def cleanup():
+        """Limpia todas las conexiones del pool"""
+        SSHManager._connection_pool.cleanup()
+
+    @staticmethod
+    def _leer_pipelined(f, fin: int) -> bytes:
+        """Lee desde la posición actual hasta el byte `fin` con peticiones concurrentes.
+        
+        Sin pipeline paramiko pide un bloque, espera la respuesta y pide el siguiente:
+        una ida y vuelta por bloque. Con pipeline los bloques se piden por adelantado.
+        """
+        # Unir al final: un solo f.read() enorme concatena en tiempo cuadrático
+        return b"".join(SSHManager._leer_bloques(f, fin))
+
+    @staticmethod
+    def _leer_bloques(f, fin: int):
+        """Genera el archivo desde la posición actual hasta `fin` en bloques de SFTP_CHUNK_SIZE.
+        
+        Mantiene SFTP_MAX_PENDIENTES lecturas en vuelo y pide la siguiente al consumir
+        cada respuesta, así que en memoria nunca hay más de esa ventana sin consumir.
+        No se usa f.prefetch(): su hilo de fondo compite con el lector, a veces da la
+        descarga por terminada antes de tiempo y sigue bloque a bloque (una ida y vuelta
+        cada uno), y con max_concurrent_requests espera activamente decenas de segundos.
+        Aquí las peticiones se envían y se reciben en el hilo que lee.
+        
+        SFTPClient no expone lecturas asíncronas sin prefetch, así que se usan sus métodos
+        privados `_async_request`, `_read_response` y `_convert_status` (y el protocolo de
+        `_async_response` en _RespuestasLectura). Funciona porque requirements.txt fija
+        paramiko==3.4.0: al subir de versión hay que revisar que sigan existiendo con la
+        misma firma (bench_transferencias.py lo ejercita).
+        """
+        sftp = f.sftp
+        receptor = _RespuestasLectura()
+        en_vuelo = deque()
+        siguiente = f.tell()
+
+        def pedir(offset: int, longitud: int):
+            num = sftp._async_request(receptor, CMD_READ, f.handle, int64(offset), int(longitud))
+            return num, offset, longitud
+
+        while True:
+            while siguiente < fin and len(en_vuelo) < CONFIG.SFTP_MAX_PENDIENTES:
+                longitud = min(CONFIG.SFTP_CHUNK_SIZE, fin - siguiente)
+                en_vuelo.append(pedir(siguiente, longitud))
+                siguiente += longitud
+            if not en_vuelo:
+                return
+            num, offset, longitud = en_vuelo.popleft()
+            while num not in receptor.respuestas:
+                sftp._read_response()
+            t, msg = receptor.respuestas.pop(num)
+            if t != CMD_DATA:
+                try:
+                    sftp._convert_status(msg)
+                except EOFError:
+                    # El archivo se acortó desde el stat; las respuestas pendientes
+                    # las descarta SFTPClient al cerrar el archivo
+                    return
+                raise IOError(f"Respuesta inesperada del servidor SFTP: {t}")
+            parte = msg.get_string()
+            if not parte:
+                return
+            if len(parte) < longitud:
+                # Lectura corta (permitida por el protocolo): pedir el resto antes que lo demás
+                en_vuelo.appendleft(pedir(offset + len(parte), longitud - len(parte)))
+            yield parte
+
+    @staticmethod
+    def _lineas_utf8(bloques):
+        """Convierte bloques de bytes en líneas de texto; un carácter partido entre bloques se completa"""
+        decodificador = codecs.getincrementaldecoder('utf-8')()
+        resto = ""
+        for bloque in bloques:
+            *completas, resto = (resto + decodificador.decode(bloque)).split("\n")
+            for linea in completas:
+                yield linea + "\n"
+        resto += decodificador.decode(b"", final=True)
+        if resto:
+            yield resto
+
+    @staticmethod
+    def _escribir_pipelined(sftp, remote_path: str, datos: bytes):
+        """Escribe sin esperar la respuesta de cada bloque y comprueba el tamaño final.
+        
+        En modo pipelined paramiko no revisa las respuestas de las escrituras, así que un
+        error del servidor (disco lleno, cuota) solo se detecta comparando el tamaño.
+        """
+        with sftp.file(remote_path, 'w') as f:
+            f.MAX_REQUEST_SIZE = CONFIG.SFTP_CHUNK_SIZE
+            f.set_pipelined(True)
+            for i in range(0, len(datos), CONFIG.SFTP_CHUNK_SIZE):
+                f.write(datos[i:i + CONFIG.SFTP_CHUNK_SIZE])
+        # El cierre llega después de todas las escrituras: el stat ya las refleja
+        escritos = sftp.stat(remote_path).st_size
+        if escritos != len(datos):
+            raise IOError(f"Escritura incompleta en {remote_path}: {escritos} de {len(datos)} bytes")
+
+    @staticmethod
+    def _crear_directorio_remoto(sftp, dir_path: str, conocidos: Optional[set] = None):
+        """Crea el directorio remoto (y sus padres) si no existe.
+        
+        `conocidos` son los directorios que ya se comprobaron en esta conexión: si
+        `dir_path` está ahí no se hace ninguna petición al servidor.
+        """
+        if conocidos is not None and dir_path in conocidos:
+            return
+        try:
+            sftp.stat(dir_path)
+        except FileNotFoundError:
+            # Crear directorio recursivamente
+            parts = dir_path.split('/')
+            current_path = ""
+            for part in parts:
+                if part:
+                    current_path += '/' + part
+                    try:
+                        sftp.stat(current_path)
+                    except FileNotFoundError:
+                        sftp.mkdir(current_path)
+        if conocidos is not None:
+            conocidos.add(dir_path)
+
+    @staticmethod
+    def _lease_para(num_bytes: int) -> float:
+        """Vigencia del lock para escribir num_bytes: nadie debe romperlo mientras la subida sigue en curso"""
+        return SSHManager._file_lock_lease + num_bytes / SSHManager._lock_bytes_por_segundo
+
+    @staticmethod
+    def _acquire_file_lock(remote_path: str, sftp, lease: Optional[float] = None) -> Optional[str]:
+        """Adquiere un lock exclusivo creando el archivo .lock; devuelve el token del dueño o None.
+        
+        `lease` (por omisión _file_lock_lease) se escribe en el lock como instante de vencimiento:
+        debe cubrir toda la operación, porque pasado ese instante otro escritor puede romperlo.
+        """
+        lock_path = remote_path + '.lock'
+        lease = SSHManager._file_lock_lease if lease is None else lease
+        token = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+        metricas = SSHManager._connection_pool.metricas
+        inicio = time.time()
+        
+        # Con el lock ocupado se espera con backoff y jitter: los escritores que chocaron
+        # no vuelven a intentarlo todos en el mismo instante
+        for _ in SSHManager._reintentos_lock.intentos():
+            while True:
+                try:
+                    # Creación exclusiva (O_CREAT|O_EXCL): el servidor rechaza la apertura si el lock ya existe,
+                    # por lo que solo un escritor puede ganar y sin contención basta una ida y vuelta
+                    f = sftp.open(lock_path, 'wx')
+                    try:
+                        # Escritura con respuesta (sin pipelining): en modo pipelined paramiko pierde el
+                        # error de la escritura al cerrar y el lock quedaría vacío, sin dueño reconocible.
+                        # No cuesta una ida y vuelta más: el cierre espera esa respuesta de todos modos
+                        with f:
+                            f.write(f"{token}\n{time.time() + lease:.3f}\n")
+                    except IOError:
+                        # El lock se creó pero quedó sin token: es nuestro y nadie más lo
+                        # reconocería hasta que venza, así que se quita y se reintenta
+                        SSHManager._quitar_lock_propio(lock_path, sftp)
+                        continue
+                    metricas.observar("ssh_lock_espera_segundos", time.time() - inicio)
+                    metricas.incrementar("ssh_locks_total", resultado="adquirido")
+                    return token
+                except FileNotFoundError:
+                    # El directorio aún no existe: crearlo y reintentar
+                    try:
+                        SSHManager._crear_directorio_remoto(sftp, os.path.dirname(remote_path))
+                    except Exception:
+                        metricas.incrementar("ssh_locks_total", resultado="error")
+                        return None
+                    continue
+                except PermissionError:
+                    metricas.incrementar("ssh_locks_total", resultado="error")
+                    return None
+                except IOError:
+                    # Lock ocupado por otro escritor: si su lease expiró, romperlo y reintentar de inmediato
+                    if SSHManager._reap_expired_lock(lock_path, sftp):
+                        metricas.incrementar("ssh_locks_total", resultado="expirado_roto")
+                        continue
+                break
+        
+        metricas.observar("ssh_lock_espera_segundos", time.time() - inicio)
+        metricas.incrementar("ssh_locks_total", resultado="agotado")
+        return None
+
+    @staticmethod
+    def _quitar_lock_propio(lock_path: str, sftp):
+        """Elimina un lock recién creado por este escritor; un fallo se reintenta unas pocas veces"""
+        for _, ultimo in SSHManager._reintentos_liberar.intentos():
+            try:
+                sftp.remove(lock_path)
+                return
+            except FileNotFoundError:
+                return
+            except IOError:
+                if ultimo:
+                    SSHManager._connection_pool.metricas.incrementar("ssh_locks_total", resultado="liberacion_fallida")
+
+    @staticmethod
+    def _lock_expiration(lock_path: str, sftp, contenido: str) -> float:
+        """Obtiene el instante (epoch) en que vence el lease de un lock"""
+        lineas = contenido.split('\n')
+        if len(lineas) > 1:
+            try:
+                return float(lineas[1])
+            except ValueError:
+                pass
+        
+        # Formato anterior "locked_<iso>" o contenido ilegible
+        if contenido.startswith('locked_'):
+            try:
+                return datetime.fromisoformat(contenido[len('locked_'):].strip()).timestamp() + SSHManager._file_lock_lease
+            except ValueError:
+                pass
+        return sftp.stat(lock_path).st_mtime + SSHManager._file_lock_lease
+
+    @staticmethod
+    def _reap_expired_lock(lock_path: str, sftp) -> bool:
+        """Rompe el lock si su lease venció (p. ej. el proceso dueño murió); True si se eliminó"""
+        try:
+            with sftp.open(lock_path, 'r') as f:
+                contenido = f.read(256).decode('utf-8', errors='replace')
+            if SSHManager._lock_expiration(lock_path, sftp, contenido) > time.time():
+                return False
+            
+            # Apartar el lock con un nombre único: solo un proceso puede ganar este rename
+            apartado = f"{lock_path}.{uuid.uuid4().hex}.stale"
+            sftp.rename(lock_path, apartado)
+            with sftp.open(apartado, 'r') as f:
+                actual = f.read(256).decode('utf-8', errors='replace')
+            if actual != contenido:
+                # Entre la lectura y el rename otro proceso rompió el lock y tomó uno nuevo: devolverlo
+                try:
+                    sftp.rename(apartado, lock_path)
+                except IOError:
+                    sftp.remove(apartado)
+                return False
+            sftp.remove(apartado)
+            return True
+        except FileNotFoundError:
+            # El dueño lo liberó mientras tanto
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _release_file_lock(remote_path: str, sftp, token: Optional[str]) -> bool:
+        """Libera el lock del archivo solo si sigue perteneciendo a este token; False si no se pudo.
+        
+        Un lock sin liberar detiene a todos los escritores hasta que vence su lease, así que
+        los fallos se reintentan: un error del servidor por el mismo canal (con el pool lleno de
+        escritores esperando este lock puede no haber otra conexión) y un canal caído por otra
+        conexión del pool.
+        """
+        lock_path = remote_path + '.lock'
+        pool = SSHManager._connection_pool
+        ssh = None
+        try:
+            for _, ultimo in SSHManager._reintentos_liberar.intentos():
+                try:
+                    if sftp is None:
+                        ssh = SSHManager.get_connection(SSHConnectionPool.PRIORIDAD_ESCRITURA, timeout=1)
+                        if ssh is None:
+                            raise IOError("Sin conexión para liberar el lock")
+                        sftp = pool.get_sftp(ssh)
+                    with sftp.open(lock_path, 'r') as f:
+                        propietario = f.read(256).decode('utf-8', errors='replace').split('\n', 1)[0]
+                    if propietario == token:
+                        sftp.remove(lock_path)
+                    return True
+                except FileNotFoundError:
+                    # Ya no existe: lo liberó un intento anterior cuya respuesta se perdió
+                    return True
+                except Exception as e:
+                    if not isinstance(e, IOError) or sftp is None:
+                        # Canal inservible (o sin conexión): el próximo intento usa otra conexión
+                        if ssh is not None:
+                            pool.discard_sftp(ssh)
+                            SSHManager.return_connection(ssh)
+                            ssh = None
+                        sftp = None
+                    if ultimo:
+                        pool.metricas.incrementar("ssh_locks_total", resultado="liberacion_fallida")
+        finally:
+            if ssh is not None:
+                SSHManager.return_connection(ssh)
+        return False
+
+    @staticmethod
+    def get_remote_file(remote_path: str) -> Optional[str]:
+        """Contenido completo del archivo ("" si no existe, None si falla)"""
+        return SSHManager._almacen.leer(remote_path)
+
+    @staticmethod
+    def get_remote_range(remote_path: str, offset: int = 0, num_bytes: Optional[int] = None) -> Optional[bytes]:
+        """Lee `num_bytes` a partir de `offset` (negativo: desde el final) sin descargar el resto"""
+        return SSHManager._almacen.leer_rango(remote_path, offset, num_bytes)
+
+    @staticmethod
+    def get_remote_head(remote_path: str, num_bytes: int) -> Optional[str]:
+        """Lee solo los primeros `num_bytes` del archivo remoto ("" si no existe, None si falla)"""
+        datos = SSHManager.get_remote_range(remote_path, 0, num_bytes)
+        if datos is None:
+            return None
+        # El corte puede caer a mitad de un carácter multibyte: se descarta ese resto
+        return datos.decode('utf-8', errors='ignore')
+
+    @staticmethod
+    def get_remote_tail(remote_path: str, num_bytes: int = 4096) -> Optional[List[str]]:
+        """Líneas completas contenidas en los últimos `num_bytes` del archivo (la última fila al final)"""
+        # Un byte extra indica si el rango empieza justo después de un salto de línea
+        datos = SSHManager.get_remote_range(remote_path, -(num_bytes + 1))
+        if datos is None:
+            return None
+        if len(datos) > num_bytes:
+            # El rango empieza a mitad de una línea: descartar ese fragmento
+            corte = datos.find(b"\n")
+            datos = datos[corte + 1:] if corte >= 0 else b""
+        return datos.decode('utf-8', errors='replace').splitlines()
+
+    @staticmethod
+    def iter_remote_csv(remote_path: str, **formato):
+        """Filas del CSV (listas de str) a medida que se leen; un fallo se propaga como IOError"""
+        return SSHManager._almacen.iterar_csv(remote_path, **formato)
+
+    @staticmethod
+    def stat_remote_file(remote_path: str) -> Optional[paramiko.SFTPAttributes]:
+        """Tamaño y fecha de modificación sin leer el archivo (st_size=0 si no existe, None si falla)"""
+        return SSHManager._almacen.stat(remote_path)
+
+    @staticmethod
+    def write_remote_file(remote_path: str, content: str) -> bool:
+        """Reemplaza el archivo completo de forma atómica"""
+        return SSHManager._almacen.reemplazar(remote_path, content)
+
+    @staticmethod
+    def append_remote_file(remote_path: str, content: str, header: Optional[str] = None) -> bool:
+        """Añade contenido al final del archivo sin descargarlo"""
+        return SSHManager._almacen.anexar(remote_path, content, header)
+
+
+class LectorIncremental:
+    """
+    Sigue un CSV remoto que solo crece por el final, como `tail -f`.
+    
+    Recuerda hasta qué byte leyó y en cada actualización descarga solo lo nuevo, a
+    partir de unos bytes antes del último offset: si esos bytes ya no coinciden con
+    los que se leyeron, el archivo se truncó o se reemplazó y la vista se reconstruye
+    desde el principio. Las filas incompletas (un append a medias) se dejan para la
+    siguiente actualización.
+    """
+    BYTES_TESTIGO = 64
+    
+    def __init__(self, remote_path: str):
+        self.remote_path = remote_path
+        self._lock = threading.Lock()
+        self._reiniciar()
+        self.reinicios = 0
+    
+    def _reiniciar(self):
+        self.offset = 0
+        self._testigo = b""  # Últimos bytes consumidos, para detectar truncado o rotación
+        self.encabezado = None
+        self.filas = []
+    
+    def actualizar(self) -> Optional[List[List[str]]]:
+        """Descarga y procesa lo añadido desde la última vez; devuelve solo las filas nuevas.
+        
+        Si el archivo se truncó o se reemplazó devuelve todas sus filas. None si falla la conexión.
+        """
+        with self._lock:
+            inicio = self.offset - len(self._testigo)
+            datos = SSHManager.get_remote_range(self.remote_path, inicio)
+            if datos is None:
+                return None
+            
+            if not datos.startswith(self._testigo):
+                # El archivo ya no contiene lo que se leyó: volver a empezar
+                self._reiniciar()
+                self.reinicios += 1
+                datos = SSHManager.get_remote_range(self.remote_path, 0)
+                if datos is None:
+                    return None
+            else:
+                datos = datos[len(self._testigo):]
+            
+            # Procesar solo líneas completas
+            fin = datos.rfind(b"\n") + 1
+            if fin == 0:
+                return []
+            completas = datos[:fin]
+            self.offset += fin
+            self._testigo = (self._testigo + completas)[-self.BYTES_TESTIGO:]
+            
+            nuevas = [fila for fila in csv.reader(io.StringIO(completas.decode('utf-8'))) if fila]
+            if self.encabezado is None and nuevas:
+                self.encabezado = nuevas.pop(0)
+            self.filas.extend(nuevas)
+            return nuevas
+
+
+# ====================
+# DIARIO LOCAL DE CALIFICACIONES
+# ====================
+class DiarioCalificaciones:
+    """
+    Diario local (SQLite en modo WAL) donde se confirma cada registro antes de enviarlo.
+    
+    guardar_calificacion solo espera al commit local; un hilo de fondo envía los
+    registros pendientes en lotes con append_remote_file y reintenta con espera
+    creciente mientras el servidor no responda. La entrega es "al menos una vez":
+    si el proceso muere entre el append remoto y el borrado local, el lote se
+    reenvía al reiniciar.
+    
+    Varios procesos pueden compartir el archivo del diario (p. ej. apps con el mismo CSV
+    de calificaciones): cada hilo de envío reclama su lote dentro de BEGIN IMMEDIATE y
+    lo marca con su dueño y un lease, así dos hilos nunca envían las mismas filas. Un
+    lote reclamado por un proceso que murió se vuelve a entregar al vencer el lease.
+    """
+    def __init__(self, ruta_db: str, metricas: Optional[MetricasSSH] = None):
+        self.ruta_db = ruta_db
+        self.metricas = metricas or MetricasSSH()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(ruta_db, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # FULL: el commit no regresa hasta que el WAL está en disco (fsync)
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pendientes ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " ruta TEXT NOT NULL,"
+            " registro TEXT NOT NULL,"
+            " encabezado TEXT,"
+            " creado REAL NOT NULL)"
+        )
+        # Reclamo del lote en envío; diarios creados antes no tienen estas columnas
+        columnas = {fila[1] for fila in self._conn.execute("PRAGMA table_info(pendientes)")}
+        if "reclamado_por" not in columnas:
+            self._conn.execute("ALTER TABLE pendientes ADD COLUMN reclamado_por TEXT")
+            self._conn.execute("ALTER TABLE pendientes ADD COLUMN reclamado_hasta REAL")
+        self._conn.commit()
+        self._dueno = f"{os.getpid()}:{uuid.uuid4().hex[:8]}"  # Quién reclama los lotes de este diario
+        
+        self.intervalo_envio = 2  # Segundos entre revisiones si no llegan registros nuevos
+        self.max_lote = 200  # Registros por append remoto
+        self.ventana_grupo = 0.25  # Segundos que se juntan envíos de una misma ráfaga
+        self.max_espera_reintento = 60  # Tope de la espera tras un envío fallido
+        # Vigencia del reclamo de un lote: cubre el lock del CSV, los reintentos y el append
+        self.lease_lote = 120
+        self._reintentos = PoliticaReintentos(base=self.intervalo_envio, tope=self.max_espera_reintento)
+        self._hay_pendientes = threading.Event()
+        self._lote_completo = threading.Event()
+        self._nuevos = 0  # Registros llegados desde el último envío
+        self._detener = threading.Event()
+        self._hilo_envio = None
+    
+    def registrar(self, ruta: str, registro: str, encabezado: Optional[str] = None) -> bool:
+        """Guarda el registro de forma durable en el diario y despierta al hilo de envío"""
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO pendientes (ruta, registro, encabezado, creado) VALUES (?, ?, ?, ?)",
+                    (ruta, registro, encabezado, time.time())
+                )
+                self._conn.commit()
+                self._nuevos += 1
+                if self._nuevos >= self.max_lote:
+                    self._lote_completo.set()
+        except sqlite3.Error:
+            return False
+        self.metricas.incrementar("diario_registros_total")
+        self._hay_pendientes.set()
+        return True
+    
+    def pendientes(self) -> int:
+        """Registros confirmados localmente que aún no llegan al servidor"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM pendientes").fetchone()[0]
+    
+    def _siguiente_lote(self):
+        """Reclama el lote libre más antiguo: (ruta, encabezado, ids, registros), o None"""
+        libre = "(reclamado_hasta IS NULL OR reclamado_hasta < ?)"
+        with self._lock:
+            ahora = time.time()
+            # IMMEDIATE toma el lock de escritura antes de leer: otro proceso no puede
+            # reclamar las mismas filas entre el SELECT y el UPDATE
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                fila = self._conn.execute(
+                    f"SELECT ruta, encabezado FROM pendientes WHERE {libre} ORDER BY id LIMIT 1", (ahora,)
+                ).fetchone()
+                if fila is None:
+                    self._conn.rollback()
+                    return None
+                ruta, encabezado = fila
+                filas = self._conn.execute(
+                    f"SELECT id, registro FROM pendientes WHERE ruta = ? AND {libre} ORDER BY id LIMIT ?",
+                    (ruta, ahora, self.max_lote)
+                ).fetchall()
+                self._conn.executemany(
+                    "UPDATE pendientes SET reclamado_por = ?, reclamado_hasta = ? WHERE id = ?",
+                    [(self._dueno, ahora + self.lease_lote, f[0]) for f in filas]
+                )
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+        return ruta, encabezado, [f[0] for f in filas], [f[1] for f in filas]
+    
+    def _confirmar_envio(self, ids: List[int]):
+        with self._lock:
+            self._conn.executemany("DELETE FROM pendientes WHERE id = ?", [(i,) for i in ids])
+            self._conn.commit()
+    
+    def _liberar_lote(self, ids: List[int]):
+        """Devuelve un lote no entregado para que se reintente sin esperar al lease"""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE pendientes SET reclamado_por = NULL, reclamado_hasta = NULL"
+                " WHERE id = ? AND reclamado_por = ?",
+                [(i, self._dueno) for i in ids]
+            )
+            self._conn.commit()
+    
+    def enviar_pendientes(self) -> bool:
+        """Envía todo lo pendiente en lotes; False si algún lote no se pudo entregar"""
+        while not self._detener.is_set():
+            lote = self._siguiente_lote()
+            if lote is None:
+                return True
+            ruta, encabezado, ids, registros = lote
+            
+            try:
+                enviado = SSHManager.append_remote_file(ruta, "".join(registros), header=encabezado)
+            except Exception:
+                self._liberar_lote(ids)
+                raise
+            if not enviado:
+                self._liberar_lote(ids)
+                self.metricas.incrementar("diario_lotes_total", resultado="error")
+                return False
+            self._confirmar_envio(ids)
+            self.metricas.incrementar("diario_lotes_total", resultado="ok")
+            self.metricas.incrementar("diario_registros_enviados_total", len(ids))
+        return False
+    
+    def iniciar_envio(self):
+        """Arranca el hilo de fondo que vacía el diario hacia el servidor"""
+        if self._hilo_envio is not None and self._hilo_envio.is_alive():
+            return
+        self._hilo_envio = threading.Thread(
+            target=self._ciclo_envio, name="diario-calificaciones", daemon=True
+        )
+        self._hilo_envio.start()
+    
+    def _ciclo_envio(self):
+        fallos = 0
+        while not self._detener.is_set():
+            self._hay_pendientes.clear()
+            try:
+                enviado = self.enviar_pendientes()
+            except Exception:
+                # Un error inesperado (p. ej. sqlite3.Error con el disco lleno) no debe matar el
+                # hilo: lo pendiente sigue en el diario y se reintenta como un envío fallido
+                self.metricas.incrementar("diario_errores_total")
+                enviado = False
+            if enviado:
+                fallos = 0
+                if self._hay_pendientes.wait(self.intervalo_envio):
+                    # Group commit: juntar la ráfaga (o un lote lleno) en un solo lock y un solo append
+                    self._lote_completo.wait(self.ventana_grupo)
+                with self._lock:
+                    self._nuevos = 0
+                    self._lote_completo.clear()
+            else:
+                # Servidor caído o lock ocupado: los registros siguen a salvo en el diario. Con
+                # jitter, los procesos que perdieron el servidor a la vez no vuelven todos juntos.
+                # Con el circuito abierto no tiene caso volver antes de que toque sondear
+                espera = self._reintentos.espera(fallos)
+                self._detener.wait(max(espera, SSHManager._connection_pool.circuito.segundos_para_sondeo()))
+                fallos += 1
+    
+    def detener(self, timeout: float = 5):
+        """Detiene el hilo de envío; lo pendiente se envía en el siguiente arranque"""
+        self._detener.set()
+        self._hay_pendientes.set()
+        self._lote_completo.set()
+        if self._hilo_envio is not None:
+            self._hilo_envio.join(timeout)
+        with self._lock:
+            self._conn.close()
+
+
+class EscrituraAgrupada:
+    """
+    Group commit para escribir sin diario: los registros que llegan dentro de una ventana
+    corta (o hasta completar un lote) se envían con un solo lock y un solo append.
+    
+    El primer hilo que abre un lote es el líder: espera la ventana, envía el lote y
+    despierta a los demás con el resultado compartido.
+    """
+    def __init__(self, ventana: float = 0.1, max_registros: int = 200):
+        self.ventana = ventana
+        self.max_registros = max_registros
+        self._lock = threading.Lock()
+        self._lotes_abiertos = {}  # ruta -> lote que aún acepta registros
+    
+    def agregar(self, ruta: str, registro: str, encabezado: Optional[str] = None) -> bool:
+        """Añade el registro al lote abierto de `ruta` y espera a que ese lote se escriba"""
+        with self._lock:
+            lote = self._lotes_abiertos.get(ruta)
+            es_lider = lote is None
+            if es_lider:
+                lote = {'registros': [], 'encabezado': encabezado,
+                        'completo': threading.Event(), 'escrito': threading.Event(), 'ok': False}
+                self._lotes_abiertos[ruta] = lote
+            lote['registros'].append(registro)
+            if len(lote['registros']) >= self.max_registros:
+                # Lote lleno: los siguientes registros abren uno nuevo
+                del self._lotes_abiertos[ruta]
+                lote['completo'].set()
+        
+        if not es_lider:
+            lote['escrito'].wait()
+            return lote['ok']
+        
+        lote['completo'].wait(self.ventana)
+        with self._lock:
+            if self._lotes_abiertos.get(ruta) is lote:
+                del self._lotes_abiertos[ruta]
+            contenido = "".join(lote['registros'])
+        try:
+            lote['ok'] = SSHManager.append_remote_file(ruta, contenido, header=lote['encabezado'])
+        finally:
+            lote['escrito'].set()
+        return lote['ok']
+
+
+@st.cache_resource(show_spinner=False, validate=lambda diario: not diario._detener.is_set())
+def abrir_diario(ruta_db: str, _metricas: Optional[MetricasSSH] = None) -> DiarioCalificaciones:
+    """Diario de `ruta_db` compartido por todo el proceso: un solo hilo de envío por archivo de diario"""
+    return DiarioCalificaciones(ruta_db, _metricas)
+
+
+@st.cache_resource(show_spinner=False)
+def obtener_escritura_agrupada() -> EscrituraAgrupada:
+    """Group commit compartido por todas las sesiones del proceso"""
+    return EscrituraAgrupada()
+
+
+def configurar(config: ConfigRemota):
+    """Enlaza la configuración de la app y los objetos del proceso; se llama en cada ejecución del script"""
+    global CONFIG
+    CONFIG = config
+    SSHManager._connection_pool = obtener_pool_conexiones()
+    SSHManager._cache_archivos = obtener_cache_archivos()
+    SSHManager._almacen = obtener_almacenamiento()
+    SSHManager._archivos_verificados = obtener_archivos_verificados()
+
+
+# ====================
+# FUNCIONES COMUNES DE LAS APPS DE CALIFICACIONES
+# ====================
+# Reciben la Config de la app, que además de lo de ConfigRemota define
+# REMOTE['CALIFICACIONES_FILE'], JOURNAL_DIR y ADMIN_PASSWORD.
+def _ruta_calificaciones(config: ConfigRemota) -> str:
+    return os.path.join(config.REMOTE['DIR'], config.REMOTE['CALIFICACIONES_FILE'])
+
+
+@st.cache_resource(show_spinner=False, validate=lambda diario: diario is None or not diario._detener.is_set())
+def _diario_calificaciones(directorio: str, destino: str) -> Optional[DiarioCalificaciones]:
+    """Diario único por proceso para `destino`; None si no se puede abrir (se escribe directo al servidor)"""
+    nombre = f"diario_{hashlib.sha1(destino.encode('utf-8')).hexdigest()[:12]}.sqlite3"
+    try:
+        os.makedirs(directorio, exist_ok=True)
+        diario = abrir_diario(os.path.join(directorio, nombre), SSHManager._connection_pool.metricas)
+    except (OSError, sqlite3.Error):
+        return None
+    
+    diario.iniciar_envio()
+    # Registrado después del pool: atexit lo ejecuta antes de cerrar las conexiones
+    atexit.register(diario.detener)
+    return diario
+
+
+def obtener_diario_calificaciones(config: ConfigRemota) -> Optional[DiarioCalificaciones]:
+    """Diario local del archivo de calificaciones de la app; None si no se puede abrir"""
+    destino = f"{config.REMOTE['HOST']}:{config.REMOTE['DIR']}/{config.REMOTE['CALIFICACIONES_FILE']}"
+    return _diario_calificaciones(config.JOURNAL_DIR, destino)
+
+
+def persistir_registro(config: ConfigRemota, remote_path: str, registro: str,
+                       encabezado: Optional[str] = None) -> bool:
+    """Confirma el registro en el diario local; sin diario, lo añade al archivo remoto por lotes"""
+    diario = obtener_diario_calificaciones(config)
+    if diario is not None and diario.registrar(remote_path, registro, encabezado):
+        return True
+    return obtener_escritura_agrupada().agregar(remote_path, registro, encabezado)
+
+
+@st.cache_resource(ttl=3600, show_spinner=False)
+def archivos_calificaciones_verificados() -> set:
+    """Archivos cuyo encabezado ya se comprobó en este proceso; se vuelven a comprobar cada hora"""
+    return set()
+
+
+@st.cache_resource(show_spinner=False)
+def _lector_calificaciones(ruta: str) -> LectorIncremental:
+    return LectorIncremental(ruta)
+
+
+def obtener_lector_calificaciones(config: ConfigRemota) -> LectorIncremental:
+    """Vista en memoria del CSV de calificaciones, compartida por todas las sesiones"""
+    return _lector_calificaciones(_ruta_calificaciones(config))
+
+
+def resumen_calificaciones(config: ConfigRemota) -> Optional[Dict[str, Any]]:
+    """Total, promedio y distribución de las calificaciones recorriendo el CSV remoto fila por fila.
+    
+    Solo se acumulan contadores, así que la memoria no depende del tamaño del archivo.
+    Devuelve None si no se pudo leer.
+    """
+    total = 0
+    suma = 0
+    distribucion = {}
+    try:
+        filas = SSHManager.iter_remote_csv(_ruta_calificaciones(config))
+        next(filas, None)  # Encabezado
+        for fila in filas:
+            try:
+                calificacion = int(fila[-1])
+            except (ValueError, IndexError):
+                continue  # Línea vacía o incompleta
+            total += 1
+            suma += calificacion
+            distribucion[calificacion] = distribucion.get(calificacion, 0) + 1
+    except Exception:
+        return None
+    return {
+        'total': total,
+        'promedio': suma / total if total else None,
+        'distribucion': dict(sorted(distribucion.items())),
+    }
+
+
+def show_admin_metrics(config: ConfigRemota):
+    """Panel de métricas del pool y de la E/S remota (visible abriendo la app con ?admin=1)"""
+    if st.query_params.get("admin") != "1":
+        return
+    
+    with st.expander("📊 Métricas del servidor", expanded=False):
+        if not config.ADMIN_PASSWORD:
+            st.info("Define `admin_password` en los secrets para habilitar este panel")
+            return
+        if not st.session_state.get('admin_autenticado'):
+            password = st.text_input("Contraseña de administrador", type="password", key="admin_password")
+            if password:
+                # Comparación en tiempo constante: no revela cuántos caracteres coinciden
+                if hmac.compare_digest(password.encode('utf-8'), config.ADMIN_PASSWORD.encode('utf-8')):
+                    st.session_state.admin_autenticado = True
+                    st.rerun()
+                else:
+                    st.error("Contraseña incorrecta")
+            return
+        
+        pool = SSHManager._connection_pool
+        metricas = pool.metricas
+        estado = pool.estado()
+        
+        col1, col2 = st.columns(2)
+        col1.metric("Conexiones en uso", f"{estado['ssh_pool_conexiones_en_uso']}/{estado['ssh_pool_max_conexiones']}")
+        col2.metric("En reposo", estado['ssh_pool_conexiones_en_reposo'])
+        col1.metric("Esperando turno", estado['ssh_pool_esperando_turno'])
+        col2.metric("Fallos remotos", f"{metricas.contador('ssh_fallos_total'):g}")
+        modo = (f"multiplexado, hasta {pool.max_canales_por_transporte} canales por transporte"
+                if pool.multiplexar else "un transporte por conexión")
+        st.write(f"**Almacenamiento:** {config.ALMACENAMIENTO}")
+        st.write(f"**Transportes SSH:** {estado['ssh_pool_transportes']} ({modo})")
+        circuito = pool.circuito
+        if circuito.estado == circuito.CERRADO:
+            st.write("**Circuito al servidor:** cerrado")
+        else:
+            st.write(f"**Circuito al servidor:** {circuito.estado} "
+                     f"(próximo sondeo en {circuito.segundos_para_sondeo():.0f} s)")
+        
+        diario = obtener_diario_calificaciones(config)
+        if diario is not None:
+            estado['diario_registros_pendientes'] = diario.pendientes()
+            st.write(f"**Diario local:** {estado['diario_registros_pendientes']} calificaciones pendientes de envío")
+        else:
+            st.write("**Diario local:** no disponible, las calificaciones se escriben directo al servidor")
+        
+        reutilizadas = metricas.contador("ssh_checkouts_total", resultado="reutilizada")
+        nuevas = metricas.contador("ssh_checkouts_total", resultado="nueva")
+        if reutilizadas + nuevas:
+            st.write(f"**Reutilización del pool:** {reutilizadas / (reutilizadas + nuevas):.0%} "
+                     f"({reutilizadas:g} reutilizadas, {nuevas:g} nuevas)")
+        
+        # Solo se descargan las filas añadidas desde la última vez que se abrió el panel
+        lector = obtener_lector_calificaciones(config)
+        if lector.actualizar() is not None:
+            ultima = f" · última: {lector.filas[-1][0]}" if lector.filas else ""
+            st.write(f"**Calificaciones en el servidor:** {len(lector.filas)}{ultima}")
+        
+        # El resumen recorre el archivo completo: solo se calcula cuando se pide
+        if st.button("📈 Resumen de calificaciones", key="admin_resumen", use_container_width=True):
+            resumen = resumen_calificaciones(config)
+            if resumen is None:
+                st.error("No se pudo leer el archivo de calificaciones")
+            elif not resumen['total']:
+                st.info("Aún no hay calificaciones registradas")
+            else:
+                st.write(f"**Promedio:** {resumen['promedio']:.2f} en {resumen['total']} calificaciones")
+                st.write("**Distribución:** " + " · ".join(
+                    f"{calificacion}: {alumnos}" for calificacion, alumnos in resumen['distribucion'].items()
+                ))
+        
+        for nombre, titulo in (("ssh_checkout_espera_segundos", "Espera de conexión"),
+                               ("ssh_handshake_segundos", "Handshake SSH"),
+                               ("ssh_lock_espera_segundos", "Espera de lock")):
+            p50 = metricas.percentil(nombre, 0.50)
+            p95 = metricas.percentil(nombre, 0.95)
+            if p50 is None:
+                st.write(f"**{titulo}:** sin datos")
+            else:
+                st.write(f"**{titulo}:** p50 ≤ {p50:g} s · p95 ≤ {p95:g} s")
+        
+        st.write(f"**Transferido:** {metricas.contador('ssh_bytes_leidos_total') / 1024:.1f} KiB leídos, "
+                 f"{metricas.contador('ssh_bytes_escritos_total') / 1024:.1f} KiB escritos")
+        
+        texto = metricas.exportar_prometheus(estado)
+        st.download_button(
+            label="📥 Descargar métricas (Prometheus)",
+            data=texto,
+            file_name="metricas_ssh.prom",
+            mime="text/plain",
+            use_container_width=True
+        )
+        st.code(texto, language="text")
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Mismas operaciones de la app contra cada respaldo de almacenamiento: SFTP, sistema de archivos local y SQLite.
+
+Cada ronda lanza `--sesiones` sesiones simultáneas que hacen lo que una sesión de examen
+sobre el CSV de calificaciones: stat, leer las últimas filas, añadir su registro y, una de
+cada diez, leerlo completo. Todas pasan por la interfaz de SSHManager, así que cualquier
+respaldo nuevo (una subclase de AlmacenArchivos) se mide agregándolo a `respaldos()`.
+SFTP va contra el servidor local con la latencia indicada; local y SQLite, en un
+directorio temporal.
+
+Uso:
+    python benchmarks/bench_almacenamiento.py [--sesiones 50] [--rondas 3] [--rtt-ms 10]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+OPERACIONES = ("stat", "cola", "anexar", "leer")
+
+
+def respaldos(app, directorio: str) -> dict:
+    import acceso_remoto  # Tras cargar_app, que agrega la raíz del repo a sys.path
+    metricas = app.SSHManager._connection_pool.metricas
+    return {
+        'sftp': app.SSHManager._almacen,
+        'local': acceso_remoto.AlmacenLocal(os.path.join(directorio, "local"), metricas),
+        'sqlite': acceso_remoto.AlmacenSQLite(os.path.join(directorio, "almacen.db"), metricas),
+    }
+
+
+def percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+def rafaga(app, ruta: str, sesiones: int, ronda: int, tiempos: dict):
+    """Sesiones simultáneas; acumula la duración de cada operación en `tiempos` y devuelve los envíos fallidos"""
+    fallidos = []
+    barrera = threading.Barrier(sesiones)
+
+    def cronometrar(operacion, funcion, *args):
+        inicio = time.perf_counter()
+        resultado = funcion(*args)
+        tiempos[operacion].append(time.perf_counter() - inicio)
+        return resultado
+
+    def sesion(i):
+        barrera.wait()
+        cronometrar("stat", app.SSHManager.stat_remote_file, ruta)
+        cronometrar("cola", app.SSHManager.get_remote_tail, ruta, 4096)
+        registro = f"2024-01-01 00:00:00,{ronda}-{i},Alumno {i},a{i}@uam.mx,5\n"
+        if not cronometrar("anexar", app.SSHManager.append_remote_file, ruta, registro,
+                           app.ENCABEZADO_CALIFICACIONES):
+            fallidos.append(i)
+        if i % 10 == 0:
+            cronometrar("leer", app.SSHManager.get_remote_file, ruta)
+
+    hilos = [threading.Thread(target=sesion, args=(i,)) for i in range(sesiones)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return len(fallidos)
+
+
+def medir(app, almacen, sesiones: int, rondas: int) -> dict:
+    app.SSHManager._almacen = almacen
+    ruta = ruta_calificaciones(app)
+    app.SSHManager.write_remote_file(ruta, app.ENCABEZADO_CALIFICACIONES)
+
+    tiempos = {operacion: [] for operacion in OPERACIONES}
+    fallidos = 0
+    inicio = time.perf_counter()
+    for ronda in range(rondas):
+        fallidos += rafaga(app, ruta, sesiones, ronda, tiempos)
+    duracion = time.perf_counter() - inicio
+
+    filas = len(app.SSHManager.get_remote_file(ruta).splitlines()) - 1
+    resultado = {
+        'duracion': duracion,
+        'fallidos': fallidos,
+        'perdidas': sesiones * rondas - fallidos - filas,
+    }
+    for operacion, valores in tiempos.items():
+        resultado[operacion] = (percentil(valores, 0.50), percentil(valores, 0.99))
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sesiones", type=int, default=50)
+    parser.add_argument("--rondas", type=int, default=3)
+    parser.add_argument("--rtt-ms", type=float, default=10, help="Ida y vuelta simulada para SFTP, en milisegundos")
+    args = parser.parse_args()
+
+    with ServidorSFTPLocal(latencia=args.rtt_ms / 2000) as servidor:
+        app = cargar_app(servidor)
+        with tempfile.TemporaryDirectory(prefix="benchmark_almacen_") as directorio:
+            resultados = {nombre: medir(app, almacen, args.sesiones, args.rondas)
+                          for nombre, almacen in respaldos(app, directorio).items()}
+        app.SSHManager.cleanup()
+
+    print(f"{args.sesiones} sesiones simultáneas x {args.rondas} rondas (RTT simulado para SFTP {args.rtt_ms:g} ms); "
+          f"p50/p99 en ms")
+    print(f"{'respaldo':<10}" + "".join(f"{operacion:>16}" for operacion in OPERACIONES)
+          + f"{'total s':>9}{'fallidos':>10}{'perdidas':>10}")
+    for nombre, r in resultados.items():
+        columnas = "".join(f"{r[o][0] * 1000:>8.1f}/{r[o][1] * 1000:<7.1f}" for o in OPERACIONES)
+        print(f"{nombre:<10}{columnas}{r['duracion']:>9.2f}{r['fallidos']:>10}{r['perdidas']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+Cuántos alumnos simultáneos aguanta un proceso de la app al enviar el examen.
+
+Cada sesión simulada es un hilo con su propia st.session_state (como un navegador en
+`streamlit run`) que comparte con las demás el pool de conexiones, el diario y las
+cachés del proceso. Al pulsar "Enviar Examen" hace lo mismo que main(): comprueba el
+CSV, llama a calculate_grade, a guardar_calificacion y, si se guardó, a show_results,
+que manda el correo. El servidor SFTP y el de correo son locales, con la latencia indicada.
+
+Se reportan el rendimiento (envíos por segundo), la latencia p50/p95/p99 de cada paso,
+qué parte del tiempo de las sesiones (y del hilo de envío del diario) se fue esperando
+el lock del CSV o una conexión del pool, y las filas perdidas o duplicadas. Con el diario
+(por omisión) quien escribe es el hilo de envío en segundo plano; con --sin-diario, las
+propias sesiones mediante EscrituraAgrupada.
+
+Uso:
+    python benchmarks/bench_carga.py [--sesiones 50] [--rondas 3] [--rtt-ms 10] [--smtp-rtt-ms 20]
+                                     [--max-conexiones 10] [--sin-diario] [--app calificaciones101]
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app, diario_calificaciones, iniciar_sesion, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+from servidor_smtp import ServidorSMTPLocal  # noqa: E402
+
+PASOS = ("comprobar", "calificar", "guardar", "correo", "total")
+
+
+def percentiles(valores) -> tuple:
+    ordenados = sorted(valores)
+    return tuple(ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))] for p in (0.50, 0.95, 0.99))
+
+
+def segundos_observados(metricas, nombre: str) -> float:
+    """Suma de todas las observaciones del histograma `nombre`"""
+    with metricas._lock:
+        return sum(hist['suma'] for (n, _), hist in metricas._histogramas.items() if n == nombre)
+
+
+def esperar_diario(app, limite: float = 120) -> int:
+    """Espera a que el diario entregue lo pendiente; devuelve lo que quedó sin enviar"""
+    diario = diario_calificaciones(app)
+    if diario is None:
+        return 0
+    fin = time.monotonic() + limite
+    while diario.pendientes() and time.monotonic() < fin:
+        time.sleep(0.02)
+    return diario.pendientes()
+
+
+def rafaga(app, sesiones: int, ronda: int, azar: random.Random, tiempos: dict) -> list:
+    """Sesiones que envían el examen a la vez; devuelve el número económico de los envíos guardados"""
+    guardados = []
+    barrera = threading.Barrier(sesiones)
+    # Respuestas decididas antes de lanzar los hilos para que la semilla reproduzca la corrida
+    respuestas = [[azar.choice(p["opciones"]) for p in app.preguntas] for _ in range(sesiones)]
+
+    def sesion(i):
+        iniciar_sesion(f"carga-{ronda}-{i}")
+        estado = app.st.session_state
+        estado.numero_economico = f"{ronda:03d}{i:05d}"
+        estado.nombre_completo = f"Alumno {ronda}-{i}"
+        estado.email = f"a{ronda}-{i}@uam.mx"
+        estado.respuestas = respuestas[i]
+        barrera.wait()
+
+        inicio = time.perf_counter()
+        app.inicializar_archivo_calificaciones()
+        comprobado = time.perf_counter()
+        calificacion, respuestas_correctas = app.calculate_grade()
+        calificado = time.perf_counter()
+        ok = app.guardar_calificacion(estado.numero_economico, estado.nombre_completo, estado.email, calificacion)
+        guardado = time.perf_counter()
+        if ok:
+            app.show_results(calificacion, respuestas_correctas)
+            guardados.append(estado.numero_economico)
+        fin = time.perf_counter()
+
+        tiempos['comprobar'].append(comprobado - inicio)
+        tiempos['calificar'].append(calificado - comprobado)
+        tiempos['guardar'].append(guardado - calificado)
+        if ok:
+            tiempos['correo'].append(fin - guardado)
+        tiempos['total'].append(fin - inicio)
+
+    hilos = [threading.Thread(target=sesion, args=(i,)) for i in range(sesiones)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return guardados
+
+
+def medir(app, smtp, sesiones: int, rondas: int, semilla: int) -> dict:
+    ruta = ruta_calificaciones(app)
+    metricas = app.SSHManager._connection_pool.metricas
+    espera_lock = segundos_observados(metricas, "ssh_lock_espera_segundos")
+    espera_pool = segundos_observados(metricas, "ssh_checkout_espera_segundos")
+    correos = len(smtp.recibidos)
+
+    azar = random.Random(semilla)
+    tiempos = {paso: [] for paso in PASOS}
+    guardados = []
+    inicio = time.perf_counter()
+    for ronda in range(rondas):
+        guardados += rafaga(app, sesiones, ronda, azar, tiempos)
+    duracion_envios = time.perf_counter() - inicio
+    sin_enviar = esperar_diario(app)
+    duracion_entrega = time.perf_counter() - inicio
+
+    espera_lock = segundos_observados(metricas, "ssh_lock_espera_segundos") - espera_lock
+    espera_pool = segundos_observados(metricas, "ssh_checkout_espera_segundos") - espera_pool
+    # Las esperas ocurren en las sesiones y, con diario, en su hilo de envío, activo durante toda la entrega
+    ocupado = sum(tiempos['total'])
+    if diario_calificaciones(app) is not None:
+        ocupado += duracion_entrega
+
+    app.SSHManager._cache_archivos.invalidar(ruta)
+    filas = [linea.split(",")[1] for linea in app.SSHManager.get_remote_file(ruta).splitlines()[1:] if linea]
+    en_servidor = set(filas)
+    return {
+        'tiempos': {paso: percentiles(valores) for paso, valores in tiempos.items() if valores},
+        'envios_por_segundo': len(tiempos['total']) / duracion_envios,
+        'duracion_entrega': duracion_entrega,
+        'espera_lock': espera_lock,
+        'espera_pool': espera_pool,
+        'ocupado': ocupado,
+        'fallidos': sesiones * rondas - len(guardados),
+        'sin_enviar': sin_enviar,
+        'perdidas': sum(1 for numero in guardados if numero not in en_servidor),
+        'duplicadas': len(filas) - len(en_servidor),
+        'correos': len(smtp.recibidos) - correos,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sesiones", type=int, default=50, help="Alumnos que envían el examen a la vez")
+    parser.add_argument("--rondas", type=int, default=3)
+    parser.add_argument("--rtt-ms", type=float, default=10, help="Ida y vuelta simulada al servidor SFTP")
+    parser.add_argument("--smtp-rtt-ms", type=float, default=20, help="Ida y vuelta simulada al servidor de correo")
+    parser.add_argument("--max-conexiones", type=int, default=None, help="Tamaño del pool (por omisión, el de la app)")
+    parser.add_argument("--sin-diario", action="store_true",
+                        help="Escribir desde las sesiones con EscrituraAgrupada en lugar del diario local")
+    parser.add_argument("--app", default="calificaciones101", help="Módulo de la app a cargar")
+    parser.add_argument("--semilla", type=int, default=1)
+    args = parser.parse_args()
+
+    with ServidorSFTPLocal(latencia=args.rtt_ms / 2000) as servidor, \
+            ServidorSMTPLocal(latencia=args.smtp_rtt_ms / 2000) as smtp:
+        secrets = smtp.secrets()
+        if args.sin_diario:
+            # Un archivo donde va el directorio del diario: no se puede abrir y la app escribe directo
+            secrets["journal_dir"] = os.path.join(servidor.directorio, "sin_diario")
+            open(secrets["journal_dir"], "w").close()
+        app = cargar_app(servidor, args.app, secrets_extra=secrets)
+        pool = app.SSHManager._connection_pool
+        if args.max_conexiones:
+            pool.max_connections = args.max_conexiones
+        with open(ruta_calificaciones(app), "w", encoding="utf-8") as f:
+            f.write(app.ENCABEZADO_CALIFICACIONES)
+
+        resultado = medir(app, smtp, args.sesiones, args.rondas, args.semilla)
+        app.SSHManager.cleanup()
+
+    escritura = "EscrituraAgrupada desde las sesiones" if args.sin_diario else "diario local + envío en segundo plano"
+    print(f"{args.app}: {args.sesiones} alumnos simultáneos x {args.rondas} rondas, pool de {pool.max_connections} "
+          f"conexiones, {escritura}")
+    print(f"RTT simulado: SFTP {args.rtt_ms:g} ms, SMTP {args.smtp_rtt_ms:g} ms")
+    print()
+    print(f"{'paso (ms)':<12}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for paso, (p50, p95, p99) in resultado['tiempos'].items():
+        print(f"{paso:<12}{p50 * 1000:>9.1f}{p95 * 1000:>9.1f}{p99 * 1000:>9.1f}")
+    print()
+    print(f"Rendimiento: {resultado['envios_por_segundo']:.1f} envíos/s; todo en el servidor a los "
+          f"{resultado['duracion_entrega']:.2f} s")
+    ocupado = resultado['ocupado']
+    print(f"Esperando el lock del CSV: {resultado['espera_lock']:.2f} s ({resultado['espera_lock'] / ocupado:.1%}); "
+          f"esperando conexión del pool: {resultado['espera_pool']:.2f} s ({resultado['espera_pool'] / ocupado:.1%}) "
+          f"de {ocupado:.1f} s de sesiones{'' if args.sin_diario else ' e hilo de envío'}")
+    print(f"Envíos fallidos: {resultado['fallidos']}  sin enviar: {resultado['sin_enviar']}  "
+          f"perdidos: {resultado['perdidas']}  duplicados: {resultado['duplicadas']}  "
+          f"correos recibidos: {resultado['correos']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Latencia de envío cuando muchas sesiones chocan en el lock del CSV de calificaciones.
+
+Cada ronda lanza `--sesiones` append_remote_file simultáneos sobre el mismo archivo
+y mide cuánto tarda cada uno. Compara las esperas deterministas anteriores (cada
+escritor que pierde el lock duerme lo mismo que los demás y reintentan juntos) con
+PoliticaReintentos (backoff exponencial con jitter completo).
+
+Uso:
+    python benchmarks/bench_contencion.py [--sesiones 50] [--rondas 5] [--rtt-ms 10]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+
+def politica_sin_jitter(app, politica):
+    """Misma progresión que `politica` pero sin azar, como los sleep fijos de antes"""
+    import acceso_remoto  # Tras cargar_app, que agrega la raíz del repo a sys.path
+    class PoliticaDeterminista(acceso_remoto.PoliticaReintentos):
+        def espera(self, intento: int) -> float:
+            return min(self.tope, self.base * 2 ** min(intento, 32))
+
+    return PoliticaDeterminista(politica.base, politica.tope, politica.max_intentos, politica.plazo)
+
+
+def percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+def rafaga(app, ruta: str, sesiones: int, ronda: int):
+    """Envíos simultáneos; devuelve la latencia de cada uno y cuántos fallaron"""
+    latencias = []
+    fallidos = []
+    barrera = threading.Barrier(sesiones)
+
+    def enviar(i):
+        registro = f"2024-01-01 00:00:00,{ronda}-{i},Alumno {i},a{i}@uam.mx,5\n"
+        barrera.wait()
+        inicio = time.perf_counter()
+        ok = app.SSHManager.append_remote_file(ruta, registro, header=app.ENCABEZADO_CALIFICACIONES)
+        latencias.append(time.perf_counter() - inicio)
+        if not ok:
+            fallidos.append(i)
+
+    hilos = [threading.Thread(target=enviar, args=(i,)) for i in range(sesiones)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return latencias, len(fallidos)
+
+
+def medir(app, sesiones: int, rondas: int) -> dict:
+    ruta = ruta_calificaciones(app)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(app.ENCABEZADO_CALIFICACIONES)
+
+    latencias = []
+    fallidos = 0
+    for ronda in range(rondas):
+        resultado, errores = rafaga(app, ruta, sesiones, ronda)
+        latencias += resultado
+        fallidos += errores
+
+    filas = sum(1 for _ in open(ruta, encoding="utf-8")) - 1
+    return {
+        'p50': percentil(latencias, 0.50),
+        'p95': percentil(latencias, 0.95),
+        'p99': percentil(latencias, 0.99),
+        'max': max(latencias),
+        'fallidos': fallidos,
+        'perdidas': sesiones * rondas - fallidos - filas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sesiones", type=int, default=50)
+    parser.add_argument("--rondas", type=int, default=5)
+    parser.add_argument("--rtt-ms", type=float, default=10, help="Ida y vuelta simulada en milisegundos")
+    args = parser.parse_args()
+
+    with ServidorSFTPLocal(latencia=args.rtt_ms / 2000) as servidor:
+        app = cargar_app(servidor)
+        pool = app.SSHManager._connection_pool
+        originales = (app.SSHManager._reintentos_lock, pool.reintentos)
+
+        # Calentar el pool para no medir los handshakes iniciales
+        rafaga(app, ruta_calificaciones(app), pool.max_connections, -1)
+
+        resultados = {}
+        for nombre, con_jitter in (("sin jitter (anterior)", False), ("jitter completo (actual)", True)):
+            if con_jitter:
+                app.SSHManager._reintentos_lock, pool.reintentos = originales
+            else:
+                app.SSHManager._reintentos_lock, pool.reintentos = (politica_sin_jitter(app, p) for p in originales)
+            resultados[nombre] = medir(app, args.sesiones, args.rondas)
+        app.SSHManager.cleanup()
+
+    print(f"{args.sesiones} sesiones simultáneas x {args.rondas} rondas, append_remote_file directo "
+          f"(RTT simulado {args.rtt_ms:g} ms, pool de {pool.max_connections} conexiones)")
+    print(f"{'esperas':<26}{'p50 s':>8}{'p95 s':>8}{'p99 s':>8}{'máx s':>8}{'fallidos':>10}{'perdidas':>10}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<26}{r['p50']:>8.2f}{r['p95']:>8.2f}{r['p99']:>8.2f}{r['max']:>8.2f}"
+              f"{r['fallidos']:>10}{r['perdidas']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Locks remotos e idas y vueltas cuando un grupo completo envía sus calificaciones a la vez.
+
+Compara un append_remote_file por alumno con el group commit (EscrituraAgrupada) y con
+el diario local, que también agrupa la ráfaga antes de enviarla.
+
+Uso:
+    python benchmarks/bench_escritura_agrupada.py [--alumnos 60]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app, diario_calificaciones, iniciar_sesion, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+
+def rafaga(alumnos: int, guardar) -> float:
+    """Lanza `alumnos` envíos simultáneos y devuelve el tiempo hasta que todos regresan"""
+    hilos = [threading.Thread(target=guardar, args=(i,)) for i in range(alumnos)]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return time.perf_counter() - inicio
+
+
+def medir(app, servidor, alumnos: int, modo: str) -> dict:
+    ruta = ruta_calificaciones(app)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(app.ENCABEZADO_CALIFICACIONES)
+    import acceso_remoto  # Tras cargar_app, que agrega la raíz del repo a sys.path
+    metricas = app.SSHManager._connection_pool.metricas
+    locks_antes = metricas.contador("ssh_locks_total", resultado="adquirido")
+    servidor.contador.reiniciar()
+
+    def guardar(i):
+        iniciar_sesion(f"{modo}-{i}")
+        registro = f"2024-01-01 00:00:00,{i},Alumno {i},a{i}@uam.mx,5\n"
+        if modo == 'directo':
+            app.SSHManager.append_remote_file(ruta, registro, header=app.ENCABEZADO_CALIFICACIONES)
+        elif modo == 'agrupado':
+            acceso_remoto.obtener_escritura_agrupada().agregar(ruta, registro, app.ENCABEZADO_CALIFICACIONES)
+        else:
+            app.persistir_registro(app.CONFIG, ruta, registro, app.ENCABEZADO_CALIFICACIONES)
+
+    respuesta = rafaga(alumnos, guardar)
+    if modo == 'diario':
+        diario = diario_calificaciones(app)
+        while diario.pendientes():
+            time.sleep(0.05)
+
+    filas = sum(1 for _ in open(ruta, encoding="utf-8")) - 1
+    return {
+        'respuesta_s': respuesta,
+        'locks': metricas.contador("ssh_locks_total", resultado="adquirido") - locks_antes,
+        'rtt': servidor.contador.total(),
+        'filas': filas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--alumnos", type=int, default=60)
+    args = parser.parse_args()
+
+    with ServidorSFTPLocal() as servidor:
+        app = cargar_app(servidor)
+        resultados = {modo: medir(app, servidor, args.alumnos, modo)
+                      for modo in ('directo', 'agrupado', 'diario')}
+        app.SSHManager.cleanup()
+
+    print(f"{args.alumnos} envíos simultáneos (servidor local)")
+    print(f"{'modo':<12}{'respuesta s':>14}{'locks':>8}{'RTT':>8}{'filas':>8}")
+    for modo, r in resultados.items():
+        print(f"{modo:<12}{r['respuesta_s']:>14.3f}{r['locks']:>8g}{r['rtt']:>8}{r['filas']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+Handshakes y conexiones en el servidor con un transporte por conexión o con canales multiplexados.
+
+Cada ronda lanza `--sesiones` sesiones simultáneas que hacen lo que una sesión de examen:
+comprobar la conexión, consultar el CSV y entregar su calificación (por el diario local).
+Con un transporte por conexión el pool abre hasta max_connections conexiones SSH (un
+handshake y un proceso sshd cada una); en modo multiplexado abre canales SFTP sobre
+uno o dos transportes. El servidor limita los canales por conexión como MaxSessions.
+
+Uso:
+    python benchmarks/bench_multiplexacion.py [--sesiones 50] [--rondas 3] [--rtt-ms 10] [--max-sessions 10]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app, diario_calificaciones, iniciar_sesion, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+
+def nuevo_pool(app, multiplexar: bool):
+    """Pool independiente del singleton de la app, vacío y sin precalentamiento"""
+    import acceso_remoto  # Tras cargar_app, que agrega la raíz del repo a sys.path
+    class Pool(acceso_remoto.SSHConnectionPool):
+        _instance = None
+
+    pool = Pool()
+    pool.multiplexar = multiplexar
+    return pool
+
+
+def percentil(valores, p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))]
+
+
+def rafaga(app, ruta: str, sesiones: int, ronda: int):
+    """Sesiones simultáneas; devuelve la latencia de cada una y los fallos"""
+    latencias = []
+    fallidos = []
+    barrera = threading.Barrier(sesiones)
+
+    def sesion(i):
+        iniciar_sesion(f"sesion-{ronda}-{i}")
+        barrera.wait()
+        inicio = time.perf_counter()
+        ssh = app.SSHManager.get_connection(app.SSHManager._connection_pool.PRIORIDAD_SONDEO, timeout=2)
+        if ssh:
+            app.SSHManager.return_connection(ssh)
+        leido = app.SSHManager.stat_remote_file(ruta) is not None
+        escrito = app.persistir_registro(
+            app.CONFIG, ruta, f"2024-01-01 00:00:00,{ronda}-{i},Alumno {i},a{i}@uam.mx,5\n",
+            app.ENCABEZADO_CALIFICACIONES
+        )
+        latencias.append(time.perf_counter() - inicio)
+        if not (ssh and leido and escrito):
+            fallidos.append(i)
+
+    hilos = [threading.Thread(target=sesion, args=(i,)) for i in range(sesiones)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    return latencias, len(fallidos)
+
+
+def medir(app, servidor, multiplexar: bool, sesiones: int, rondas: int) -> dict:
+    pool = nuevo_pool(app, multiplexar)
+    app.SSHManager._connection_pool = pool
+    ruta = ruta_calificaciones(app)
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(app.ENCABEZADO_CALIFICACIONES)
+    servidor.contador.reiniciar()
+
+    latencias = []
+    fallidos = 0
+    maximo_transportes = 0
+    inicio = time.perf_counter()
+    diario = diario_calificaciones(app)
+    for ronda in range(rondas):
+        resultado, errores = rafaga(app, ruta, sesiones, ronda)
+        latencias += resultado
+        fallidos += errores
+        while diario is not None and diario.pendientes():
+            time.sleep(0.05)
+        # El pool conserva las conexiones en reposo: al terminar la ronda siguen todas abiertas
+        maximo_transportes = max(maximo_transportes, servidor.transportes_activos())
+    duracion = time.perf_counter() - inicio
+
+    peticiones = dict(servidor.contador.peticiones)
+    filas = sum(1 for _ in open(ruta, encoding="utf-8")) - 1
+    pool.cleanup()
+    return {
+        'handshakes': peticiones.get('handshake', 0),
+        'transportes': maximo_transportes,
+        'canales': peticiones.get('canal', 0),
+        'rechazados': peticiones.get('canal_rechazado', 0),
+        'p50': percentil(latencias, 0.50),
+        'p99': percentil(latencias, 0.99),
+        'duracion': duracion,
+        'fallidos': fallidos,
+        'perdidas': sesiones * rondas - fallidos - filas,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sesiones", type=int, default=50)
+    parser.add_argument("--rondas", type=int, default=3)
+    parser.add_argument("--rtt-ms", type=float, default=10, help="Ida y vuelta simulada en milisegundos")
+    parser.add_argument("--max-sessions", type=int, default=10, help="Canales por conexión que admite el servidor")
+    args = parser.parse_args()
+
+    with ServidorSFTPLocal(latencia=args.rtt_ms / 2000, max_canales=args.max_sessions) as servidor:
+        app = cargar_app(servidor)
+        # El pool de la app (con su precalentamiento) no participa: cada modo usa uno nuevo
+        pool_app = app.SSHManager._connection_pool
+        pool_app.cleanup()
+        pool_app._hilo_precalentamiento.join()
+        resultados = {
+            'un transporte por conexión': medir(app, servidor, False, args.sesiones, args.rondas),
+            'multiplexado': medir(app, servidor, True, args.sesiones, args.rondas),
+        }
+
+    print(f"{args.sesiones} sesiones simultáneas x {args.rondas} rondas (RTT simulado {args.rtt_ms:g} ms, "
+          f"MaxSessions {args.max_sessions})")
+    print(f"{'modo':<28}{'handshakes':>11}{'conexiones':>11}{'canales':>9}{'rechazados':>11}"
+          f"{'p50 s':>8}{'p99 s':>8}{'total s':>9}{'fallidos':>10}{'perdidas':>10}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<28}{r['handshakes']:>11}{r['transportes']:>11}{r['canales']:>9}{r['rechazados']:>11}"
+              f"{r['p50']:>8.2f}{r['p99']:>8.2f}{r['duracion']:>9.2f}{r['fallidos']:>10}{r['perdidas']:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+"""
+Latencia e idas y vueltas por operación de SSHManager con red y fallos simulados.
+
+Primero cada operación se repite en serie con el pool ya caliente, para contar las
+peticiones que hace al servidor sin interferencia de otras sesiones. Después `--sesiones`
+sesiones envían su calificación a la vez durante `--rondas` rondas y se reportan p50/p95/p99
+del envío por el diario local (lo que espera el alumno) y con append_remote_file directo,
+junto con las filas perdidas o duplicadas. La red se simula en el servidor local:
+latencia, ancho de banda y una fracción de peticiones SFTP que fallan.
+
+Uso:
+    python benchmarks/bench_operaciones.py [--rtt-ms 10] [--ancho-banda-mbps 10] [--tasa-fallos 0.01]
+                                           [--repeticiones 50] [--sesiones 50] [--rondas 3] [--filas 2000]
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app, diario_calificaciones, iniciar_sesion, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+
+def percentiles(valores) -> tuple:
+    ordenados = sorted(valores)
+    return tuple(ordenados[min(len(ordenados) - 1, int(p * len(ordenados)))] for p in (0.50, 0.95, 0.99))
+
+
+def registro(etiqueta) -> str:
+    return f"2024-01-01 00:00:00,{etiqueta},Alumno {etiqueta},a{etiqueta}@uam.mx,5\n"
+
+
+def esperar_diario(app, limite: float = 60) -> int:
+    """Espera a que el diario entregue lo pendiente; devuelve lo que quedó sin enviar"""
+    diario = diario_calificaciones(app)
+    fin = time.monotonic() + limite
+    while diario.pendientes() and time.monotonic() < fin:
+        time.sleep(0.05)
+    return diario.pendientes()
+
+
+def operaciones(app, ruta: str) -> dict:
+    """Operación -> función de un argumento (número de repetición); devuelve falso si falló"""
+    S = app.SSHManager
+    contenido = S.get_remote_file(ruta)
+
+    def leer(_):
+        # Sin la caché de contenido: se mide la descarga completa
+        S._cache_archivos.invalidar(ruta)
+        return S.get_remote_file(ruta) is not None
+
+    def envio_diario(i):
+        return app.persistir_registro(app.CONFIG, ruta, registro(f"d{i}"), app.ENCABEZADO_CALIFICACIONES)
+
+    return {
+        'stat': lambda _: S.stat_remote_file(ruta) is not None,
+        'cola 4 KB': lambda _: S.get_remote_tail(ruta, 4096) is not None,
+        'leer completo': leer,
+        'anexar': lambda i: S.append_remote_file(ruta, registro(f"a{i}"), app.ENCABEZADO_CALIFICACIONES),
+        'reemplazar': lambda _: S.write_remote_file(ruta + ".copia", contenido),
+        'envío (diario)': envio_diario,
+    }
+
+
+def medir_serie(app, servidor, ruta: str, repeticiones: int) -> dict:
+    resultados = {}
+    for nombre, operacion in operaciones(app, ruta).items():
+        servidor.contador.reiniciar()
+        tiempos = []
+        fallidos = 0
+        for i in range(repeticiones):
+            inicio = time.perf_counter()
+            if not operacion(i):
+                fallidos += 1
+            tiempos.append(time.perf_counter() - inicio)
+        if nombre == 'envío (diario)':
+            # Lo que cuesta al servidor es la entrega en segundo plano, no la respuesta al alumno
+            esperar_diario(app)
+        resultados[nombre] = {
+            'peticiones': servidor.contador.total() / repeticiones,
+            'percentiles': percentiles(tiempos),
+            'fallidos': fallidos,
+            'inyectados': servidor.contador.peticiones['sftp_fallido'],
+        }
+    return resultados
+
+
+def medir_envios(app, servidor, ruta: str, modo: str, sesiones: int, rondas: int) -> dict:
+    with open(ruta, "w", encoding="utf-8") as f:
+        f.write(app.ENCABEZADO_CALIFICACIONES)
+    app.SSHManager._cache_archivos.invalidar(ruta)
+    app.SSHManager._archivos_verificados.discard(ruta)
+    servidor.contador.reiniciar()
+
+    tiempos = []
+    fallidos = []
+    for ronda in range(rondas):
+        barrera = threading.Barrier(sesiones)
+
+        def enviar(i):
+            iniciar_sesion(f"{modo}-{ronda}-{i}")
+            fila = registro(f"{ronda}-{i}")
+            barrera.wait()
+            inicio = time.perf_counter()
+            if modo == 'diario':
+                ok = app.persistir_registro(app.CONFIG, ruta, fila, app.ENCABEZADO_CALIFICACIONES)
+            else:
+                ok = app.SSHManager.append_remote_file(ruta, fila, header=app.ENCABEZADO_CALIFICACIONES)
+            tiempos.append(time.perf_counter() - inicio)
+            if not ok:
+                fallidos.append(i)
+
+        hilos = [threading.Thread(target=enviar, args=(i,)) for i in range(sesiones)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+    sin_enviar = esperar_diario(app) if modo == 'diario' else 0
+    entregadas = sesiones * rondas - len(fallidos) - sin_enviar
+    filas = sum(1 for _ in open(ruta, encoding="utf-8")) - 1
+    return {
+        'peticiones': servidor.contador.total() / (sesiones * rondas),
+        'percentiles': percentiles(tiempos),
+        'fallidos': len(fallidos),
+        'inyectados': servidor.contador.peticiones['sftp_fallido'],
+        'sin_enviar': sin_enviar,
+        # Un fallo después de escribir (p. ej. al cerrar) hace que el reintento duplique la fila
+        'perdidas': max(0, entregadas - filas),
+        'duplicadas': max(0, filas - entregadas),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rtt-ms", type=float, default=10, help="Ida y vuelta simulada en milisegundos")
+    parser.add_argument("--ancho-banda-mbps", type=float, default=None,
+                        help="Límite por sentido y conexión en megabits por segundo (sin límite si se omite)")
+    parser.add_argument("--tasa-fallos", type=float, default=0, help="Fracción de peticiones SFTP que fallan")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--repeticiones", type=int, default=50, help="Repeticiones en serie de cada operación")
+    parser.add_argument("--sesiones", type=int, default=50)
+    parser.add_argument("--rondas", type=int, default=3)
+    parser.add_argument("--filas", type=int, default=2000, help="Filas iniciales del CSV de calificaciones")
+    args = parser.parse_args()
+
+    ancho_banda = args.ancho_banda_mbps * 125_000 if args.ancho_banda_mbps else None
+    with ServidorSFTPLocal(latencia=args.rtt_ms / 2000, ancho_banda=ancho_banda) as servidor:
+        app = cargar_app(servidor)
+        ruta = ruta_calificaciones(app)
+        with open(ruta, "w", encoding="utf-8") as f:
+            f.write(app.ENCABEZADO_CALIFICACIONES)
+            f.writelines(registro(i) for i in range(args.filas))
+
+        # Calentar el pool antes de medir y recién entonces inyectar fallos
+        app.SSHManager.stat_remote_file(ruta)
+        servidor.tasa_fallos = args.tasa_fallos
+        servidor.azar.seed(args.semilla)
+
+        serie = medir_serie(app, servidor, ruta, args.repeticiones)
+        envios = {modo: medir_envios(app, servidor, ruta, modo, args.sesiones, args.rondas)
+                  for modo in ('diario', 'directo')}
+        fallos_inyectados = sum(r['inyectados'] for r in list(serie.values()) + list(envios.values()))
+        app.SSHManager.cleanup()
+
+    red = f"RTT {args.rtt_ms:g} ms"
+    if args.ancho_banda_mbps:
+        red += f", {args.ancho_banda_mbps:g} Mbit/s"
+    print(f"Red simulada: {red}, {args.tasa_fallos:.1%} de peticiones SFTP con fallo")
+    print()
+    print(f"En serie ({args.repeticiones} repeticiones, CSV de {args.filas} filas); latencia en ms")
+    print(f"{'operación':<16}{'peticiones':>11}{'p50':>9}{'p95':>9}{'p99':>9}{'fallidos':>10}")
+    for nombre, r in serie.items():
+        p50, p95, p99 = (t * 1000 for t in r['percentiles'])
+        print(f"{nombre:<16}{r['peticiones']:>11.1f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{r['fallidos']:>10}")
+    print()
+    print(f"Envío concurrente ({args.sesiones} sesiones x {args.rondas} rondas); latencia en ms")
+    print(f"{'modo':<16}{'peticiones':>11}{'p50':>9}{'p95':>9}{'p99':>9}{'fallidos':>10}"
+          f"{'sin enviar':>12}{'perdidas':>10}{'duplicadas':>12}")
+    for modo, r in envios.items():
+        p50, p95, p99 = (t * 1000 for t in r['percentiles'])
+        print(f"{modo:<16}{r['peticiones']:>11.1f}{p50:>9.1f}{p95:>9.1f}{p99:>9.1f}{r['fallidos']:>10}"
+              f"{r['sin_enviar']:>12}{r['perdidas']:>10}{r['duplicadas']:>12}")
+    print(f"\nPeticiones con fallo inyectado en la corrida: {fallos_inyectados}")
+
+
+if __name__ == "__main__":
+    main()
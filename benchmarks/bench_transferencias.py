@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Rendimiento de descargas y subidas SFTP grandes con latencia de red simulada.
+
+Compara la transferencia anterior (f.read() y f.write() simples: una ida y vuelta por
+bloque) con la actual de SSHManager (lecturas y escrituras pipelined).
+
+Uso:
+    python benchmarks/bench_transferencias.py [--tamanos 1,10,100] [--rtt-ms 10]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+MB = 1024 * 1024
+
+
+def leer_anterior(app, sftp, ruta):
+    with sftp.file(ruta, 'r') as f:
+        return f.read()
+
+
+def leer_actual(app, sftp, ruta):
+    with sftp.file(ruta, 'r') as f:
+        return app.SSHManager._leer_pipelined(f, f.stat().st_size)
+
+
+def escribir_anterior(app, sftp, ruta, datos):
+    with sftp.file(ruta, 'w') as f:
+        f.write(datos)
+
+
+def escribir_actual(app, sftp, ruta, datos):
+    app.SSHManager._escribir_pipelined(sftp, ruta, datos)
+
+
+def cronometrar(funcion, *args) -> float:
+    inicio = time.perf_counter()
+    funcion(*args)
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--tamanos", default="1,10,100", help="Tamaños en MB separados por comas")
+    parser.add_argument("--rtt-ms", type=float, default=10, help="Ida y vuelta simulada en milisegundos")
+    args = parser.parse_args()
+    tamanos = [int(t) for t in args.tamanos.split(",")]
+
+    with ServidorSFTPLocal(latencia=args.rtt_ms / 2000) as servidor:
+        app = cargar_app(servidor)
+        pool = app.SSHManager._connection_pool
+        ssh = pool.get_connection()
+        sftp = pool.get_sftp(ssh)
+        directorio = app.CONFIG.REMOTE['DIR']
+
+        print(f"RTT simulado {args.rtt_ms:g} ms, bloque {app.CONFIG.SFTP_CHUNK_SIZE // 1024} KiB, "
+              f"{app.CONFIG.SFTP_MAX_PENDIENTES} peticiones en vuelo")
+        print(f"{'tamaño':>8}{'operación':>12}{'anterior MB/s':>16}{'actual MB/s':>14}{'mejora':>9}")
+        for tamano in tamanos:
+            datos = os.urandom(tamano * MB)
+            ruta = os.path.join(directorio, f"bench_{tamano}mb.bin")
+
+            subida = (cronometrar(escribir_anterior, app, sftp, ruta, datos),
+                      cronometrar(escribir_actual, app, sftp, ruta, datos))
+            bajada = (cronometrar(leer_anterior, app, sftp, ruta),
+                      cronometrar(leer_actual, app, sftp, ruta))
+            assert leer_actual(app, sftp, ruta) == datos
+
+            for operacion, (anterior, actual) in (("subida", subida), ("bajada", bajada)):
+                print(f"{tamano:>6}MB{operacion:>12}{tamano / anterior:>16.1f}{tamano / actual:>14.1f}"
+                      f"{anterior / actual:>8.1f}x")
+            os.remove(ruta)
+
+        pool.return_connection(ssh)
+        app.SSHManager.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Idas y vueltas por operación según cómo valida SSHConnectionPool sus conexiones.
+
+Compara la validación anterior (exec_command "echo" al entregar y al devolver cada
+conexión) con la validación a nivel de transporte (is_active + keepalive).
+
+Uso:
+    python benchmarks/bench_validacion_pool.py [--operaciones 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from entorno import cargar_app, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+
+def pool_validacion_exec(app):
+    """Pool que valida como antes: un canal exec con "echo" en cada entrega y devolución"""
+    import acceso_remoto  # Tras cargar_app, que agrega la raíz del repo a sys.path
+    class PoolValidacionExec(acceso_remoto.SSHConnectionPool):
+        _instance = None
+
+        def _conexion_activa(self, conn_data) -> bool:
+            try:
+                conn_data['ssh'].exec_command("echo 'Connection test'", timeout=5)
+                return True
+            except Exception:
+                return False
+
+        def return_connection(self, ssh):
+            try:
+                ssh.exec_command("echo 'Connection test'", timeout=5)
+            except Exception:
+                pass
+            super().return_connection(ssh)
+
+    return PoolValidacionExec()
+
+
+def medir(app, servidor, pool, operaciones: int) -> dict:
+    app.SSHManager._connection_pool = pool
+    ruta = ruta_calificaciones(app)
+
+    # Calentar el pool para no contar el handshake inicial
+    app.SSHManager.get_remote_file(ruta)
+    servidor.contador.reiniciar()
+
+    inicio = time.perf_counter()
+    for _ in range(operaciones):
+        app.SSHManager.get_remote_file(ruta)
+    duracion = time.perf_counter() - inicio
+
+    peticiones = dict(servidor.contador.peticiones)
+    pool.cleanup()
+    return {
+        'rtt_por_operacion': servidor.contador.total() / operaciones,
+        # Cada exec_command abre un canal y envía la petición exec: dos idas y vueltas
+        'validacion_por_operacion': 2 * peticiones.get('exec', 0) / operaciones,
+        'ms_por_operacion': duracion * 1000 / operaciones,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--operaciones", type=int, default=200)
+    args = parser.parse_args()
+
+    with ServidorSFTPLocal() as servidor:
+        app = cargar_app(servidor)
+        import acceso_remoto
+        with open(ruta_calificaciones(app), "w", encoding="utf-8") as f:
+            f.write(app.ENCABEZADO_CALIFICACIONES)
+
+        resultados = {
+            'exec "echo" (anterior)': medir(app, servidor, pool_validacion_exec(app), args.operaciones),
+            'transporte (actual)': medir(app, servidor, acceso_remoto.SSHConnectionPool(), args.operaciones),
+        }
+
+    print(f"get_remote_file x {args.operaciones} (pool caliente, servidor local)")
+    print(f"{'validación':<26}{'RTT/op':>10}{'RTT validación/op':>20}{'ms/op':>10}")
+    for nombre, r in resultados.items():
+        print(f"{nombre:<26}{r['rtt_por_operacion']:>10.2f}{r['validacion_por_operacion']:>20.2f}"
+              f"{r['ms_por_operacion']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
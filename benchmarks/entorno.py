@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Carga una app de calificaciones fuera de `streamlit run`, apuntando a un servidor SFTP local.
+
+Las apps leen su configuración de st.secrets al importarse, así que se genera un
+.streamlit/secrets.toml temporal y se importa el módulo desde ese directorio.
+"""
+import importlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import warnings
+
+# Silenciar avisos de dependencias y los errores de socket del servidor local al cerrar
+warnings.filterwarnings("ignore")
+logging.getLogger("paramiko").setLevel(logging.CRITICAL)
+
+RAIZ_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def cargar_app(servidor, modulo: str = "calificaciones101", secrets_extra: dict = None):
+    """Importa la app indicada con secrets que apuntan a `servidor` (ServidorSFTPLocal)"""
+    directorio_remoto = os.path.join(servidor.directorio, "datos")
+    os.makedirs(directorio_remoto, exist_ok=True)
+
+    secrets = {
+        "remote_host": servidor.host,
+        "remote_user": "benchmark",
+        "remote_password": "benchmark",
+        "remote_port": servidor.port,
+        "remote_dir": directorio_remoto,
+        "remote_calificaciones": "calificaciones.csv",
+        "remote_calificacionesI": "calificaciones.csv",
+    }
+    trabajo = tempfile.mkdtemp(prefix="benchmark_app_")
+    # El diario local de cada corrida vive en su directorio de trabajo, no en ~
+    secrets["journal_dir"] = os.path.join(trabajo, "diario")
+    secrets.update(secrets_extra or {})
+
+    os.makedirs(os.path.join(trabajo, ".streamlit"))
+    with open(os.path.join(trabajo, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        for clave, valor in secrets.items():
+            f.write(f"{clave} = {valor!r}\n".replace("'", '"'))
+
+    # st.secrets busca el archivo relativo al directorio actual al importar streamlit;
+    # sin `streamlit run` cada st.* emite avisos que aquí no aportan nada
+    os.chdir(trabajo)
+    import streamlit.config
+    import streamlit.logger
+    streamlit.config.set_option("global.showWarningOnDirectExecution", False)
+    streamlit.logger.set_log_level("error")
+
+    if RAIZ_REPO not in sys.path:
+        sys.path.insert(0, RAIZ_REPO)
+    # Como el hilo del script en `streamlit run`: sin sesión st.cache_resource no guarda nada
+    iniciar_sesion("benchmark")
+    if modulo in sys.modules:
+        return importlib.reload(sys.modules[modulo])
+    return importlib.import_module(modulo)
+
+
+def iniciar_sesion(sesion_id: str):
+    """Da al hilo actual su propia sesión de Streamlit, como un hilo de `streamlit run` por navegador.
+    
+    Sin esto st.session_state no existe fuera de `streamlit run` y st.cache_resource crea un
+    objeto nuevo en cada llamada en lugar de compartirlo. Los mensajes que la app
+    mandaría al navegador se descartan. Depende de la API interna de streamlit==1.32.0.
+    """
+    from streamlit.runtime.memory_uploaded_file_manager import MemoryUploadedFileManager
+    from streamlit.runtime.scriptrunner import ScriptRunContext, add_script_run_ctx
+    from streamlit.runtime.state import SafeSessionState, SessionState
+
+    contexto = ScriptRunContext(
+        session_id=sesion_id,
+        _enqueue=lambda mensaje: None,
+        query_string="",
+        session_state=SafeSessionState(SessionState(), lambda: None),
+        uploaded_file_mgr=MemoryUploadedFileManager("/_stcore/upload_file"),
+        main_script_path="",
+        page_script_hash="",
+        user_info={"email": None},
+    )
+    add_script_run_ctx(threading.current_thread(), contexto)
+
+
+def ruta_calificaciones(app) -> str:
+    """Ruta remota del archivo de calificaciones configurado en la app"""
+    return os.path.join(app.CONFIG.REMOTE['DIR'], app.CONFIG.REMOTE['CALIFICACIONES_FILE'])
+
+
+def diario_calificaciones(app):
+    """Diario local de calificaciones de la app (None si no se pudo abrir)"""
+    import acceso_remoto  # Tras cargar_app, que agrega la raíz del repo a sys.path
+    return acceso_remoto.obtener_diario_calificaciones(app.CONFIG)
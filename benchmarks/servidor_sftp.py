@@ -0,0 +1,307 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor SFTP local (paramiko) que sustituye al servidor de la universidad en los benchmarks.
+
+Sirve un directorio temporal en 127.0.0.1 aceptando cualquier usuario/contraseña y
+cuenta cada petición que el cliente hace al servidor (apertura de canal, exec,
+subsistema y cada paquete SFTP), que es lo que cuesta una ida y vuelta en la red.
+Con `latencia` se retrasa cada sentido de la conexión para simular una red lejana,
+con `ancho_banda` se limita lo que cabe por segundo en cada sentido, con `tasa_fallos`
+se responde con error una fracción de las peticiones SFTP (como un disco o un servidor
+sobrecargado) y con `max_canales` se limitan los canales por conexión, como MaxSessions de sshd.
+
+Uso como fixture:
+
+    with ServidorSFTPLocal(latencia=0.005, ancho_banda=1_000_000, tasa_fallos=0.01) as servidor:
+        app = entorno.cargar_app(servidor)
+        ...
+        servidor.contador.peticiones  # idas y vueltas por tipo
+"""
+import os
+import queue
+import random
+import socket
+import threading
+import tempfile
+import time
+from collections import Counter
+
+import paramiko
+from paramiko import SFTPAttributes, SFTPHandle, SFTPServer, SFTPServerInterface
+
+
+class _Contador:
+    """Contador de peticiones compartido por todas las conexiones de un servidor"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.peticiones = Counter()
+
+    def sumar(self, tipo: str):
+        with self._lock:
+            self.peticiones[tipo] += 1
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.peticiones.values())
+
+    def reiniciar(self):
+        with self._lock:
+            self.peticiones.clear()
+
+
+class _LineaConRetraso:
+    """Une un socket externo con uno interno retrasando `retraso` segundos cada sentido.
+    
+    Los bytes se reciben de inmediato y se entregan cuando vence su retraso, así que
+    las peticiones en vuelo se solapan como en una red real. Con `ancho_banda` (bytes por
+    segundo y sentido) los bytes además hacen fila para salir, como en el enlace más lento
+    del camino: un bloque grande retrasa a los que vienen detrás.
+    """
+    def __init__(self, externo: socket.socket, retraso: float, ancho_banda: float = None):
+        self.retraso = retraso
+        self.ancho_banda = ancho_banda
+        self.interno, propio = socket.socketpair()
+        for origen, destino in ((externo, propio), (propio, externo)):
+            cola = queue.Queue()
+            threading.Thread(target=self._recibir, args=(origen, cola), daemon=True).start()
+            threading.Thread(target=self._entregar, args=(destino, cola), daemon=True).start()
+
+    def _recibir(self, origen, cola):
+        libre = 0.0  # Cuándo termina de salir lo que ya está en el enlace
+        while True:
+            try:
+                datos = origen.recv(65536)
+            except OSError:
+                datos = b""
+            salida = time.monotonic()
+            if self.ancho_banda:
+                libre = max(libre, salida) + len(datos) / self.ancho_banda
+                salida = libre
+            cola.put((salida + self.retraso, datos))
+            if not datos:
+                return
+
+    def _entregar(self, destino, cola):
+        while True:
+            vence, datos = cola.get()
+            espera = vence - time.monotonic()
+            if espera > 0:
+                time.sleep(espera)
+            try:
+                if not datos:
+                    destino.shutdown(socket.SHUT_WR)
+                    return
+                destino.sendall(datos)
+            except OSError:
+                return
+
+
+class _ServidorSSH(paramiko.ServerInterface):
+    def __init__(self, contador: _Contador, transport: paramiko.Transport = None, max_canales: int = None):
+        self.contador = contador
+        self.transport = transport
+        self.max_canales = max_canales
+
+    def get_allowed_auths(self, username):
+        return "password"
+
+    def check_auth_password(self, username, password):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        # Se consulta antes de registrar el canal nuevo: _channels tiene solo los ya abiertos
+        if self.max_canales is not None and len(self.transport._channels) >= self.max_canales:
+            self.contador.sumar('canal_rechazado')
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        self.contador.sumar('canal')
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_channel_exec_request(self, channel, command):
+        self.contador.sumar('exec')
+        # Responde como un shell que ejecuta "echo"
+        salida = command.decode('utf-8', errors='replace')
+        if salida.startswith('echo '):
+            salida = salida[5:].strip("'\"")
+        channel.send((salida + "\n").encode('utf-8'))
+        channel.send_exit_status(0)
+        return True
+
+    def check_channel_subsystem_request(self, channel, name):
+        self.contador.sumar('subsistema')
+        return super().check_channel_subsystem_request(channel, name)
+
+
+class _ManejadorArchivo(SFTPHandle):
+    def stat(self):
+        try:
+            return SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class _SistemaArchivos(SFTPServerInterface):
+    """Expone el sistema de archivos local con rutas absolutas, como lo haría sshd"""
+
+    def list_folder(self, path):
+        path = self.canonicalize(path)
+        try:
+            resultado = []
+            for nombre in os.listdir(path):
+                attr = SFTPAttributes.from_stat(os.stat(os.path.join(path, nombre)))
+                attr.filename = nombre
+                resultado.append(attr)
+            return resultado
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return SFTPAttributes.from_stat(os.stat(self.canonicalize(path)))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        path = self.canonicalize(path)
+        try:
+            fd = os.open(path, flags, 0o666)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        if flags & os.O_WRONLY:
+            modo = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            modo = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            modo = "rb"
+        archivo = os.fdopen(fd, modo)
+        manejador = _ManejadorArchivo(flags)
+        manejador.filename = path
+        manejador.readfile = archivo
+        manejador.writefile = archivo
+        return manejador
+
+    def remove(self, path):
+        try:
+            os.remove(self.canonicalize(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        # SFTPv3: el rename falla si el destino existe (igual que OpenSSH)
+        oldpath, newpath = self.canonicalize(oldpath), self.canonicalize(newpath)
+        if os.path.exists(newpath):
+            return paramiko.SFTP_FAILURE
+        try:
+            os.rename(oldpath, newpath)
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def posix_rename(self, oldpath, newpath):
+        try:
+            os.replace(self.canonicalize(oldpath), self.canonicalize(newpath))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self.canonicalize(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self.canonicalize(path))
+        except OSError as e:
+            return SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+
+class _ServidorSFTPContado(SFTPServer):
+    """Subsistema SFTP que cuenta cada paquete recibido y responde con error a una fracción de ellos"""
+    contador = None
+    servidor = None
+
+    def _process(self, t, request_number, msg):
+        self.contador.sumar('sftp')
+        # Se consulta en cada petición: la tasa puede cambiarse con el servidor en marcha
+        if self.servidor.tasa_fallos and self.servidor.azar.random() < self.servidor.tasa_fallos:
+            # La petición no se ejecuta: el cliente recibe SSH_FX_FAILURE como de un servidor en problemas
+            self.contador.sumar('sftp_fallido')
+            self._send_status(request_number, paramiko.SFTP_FAILURE, "Fallo inyectado")
+            return
+        return super()._process(t, request_number, msg)
+
+
+class ServidorSFTPLocal:
+    """Servidor SFTP en un hilo de fondo; usar como context manager"""
+    _host_key = None
+
+    def __init__(self, directorio: str = None, latencia: float = 0, max_canales: int = None,
+                 ancho_banda: float = None, tasa_fallos: float = 0, semilla: int = None):
+        self.directorio = directorio or tempfile.mkdtemp(prefix="sftp_local_")
+        self.latencia = latencia  # Segundos por sentido: una ida y vuelta cuesta el doble
+        self.max_canales = max_canales  # Canales simultáneos por conexión (None: sin límite)
+        self.ancho_banda = ancho_banda  # Bytes por segundo en cada sentido de cada conexión (None: sin límite)
+        self.tasa_fallos = tasa_fallos  # Fracción de peticiones SFTP que fallan (0 a 1)
+        self.azar = random.Random(semilla)  # Con semilla, los fallos caen siempre en las mismas peticiones
+        self.contador = _Contador()
+        self.host = "127.0.0.1"
+        self.port = None
+        self._socket = None
+        self._transportes = []
+        self._activo = False
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    def iniciar(self):
+        if ServidorSFTPLocal._host_key is None:
+            ServidorSFTPLocal._host_key = paramiko.RSAKey.generate(2048)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((self.host, 0))
+        self._socket.listen(128)
+        self.port = self._socket.getsockname()[1]
+        self._activo = True
+        threading.Thread(target=self._aceptar, daemon=True).start()
+
+    def transportes_activos(self) -> int:
+        """Conexiones SSH abiertas en este momento (en OpenSSH, un proceso sshd por cada una)"""
+        return sum(1 for transport in self._transportes if transport.is_active())
+    
+    def detener(self):
+        self._activo = False
+        try:
+            self._socket.close()
+        except OSError:
+            pass
+        for transport in self._transportes:
+            transport.close()
+
+    def _aceptar(self):
+        while self._activo:
+            try:
+                cliente, _ = self._socket.accept()
+            except OSError:
+                return
+            self.contador.sumar('handshake')
+            if self.latencia or self.ancho_banda:
+                cliente = _LineaConRetraso(cliente, self.latencia, self.ancho_banda).interno
+            transport = paramiko.Transport(cliente)
+            transport.add_server_key(self._host_key)
+            subsistema = type('_SFTP', (_ServidorSFTPContado,), {'contador': self.contador, 'servidor': self})
+            transport.set_subsystem_handler("sftp", subsistema, _SistemaArchivos)
+            transport.start_server(server=_ServidorSSH(self.contador, transport, self.max_canales))
+            self._transportes.append(transport)
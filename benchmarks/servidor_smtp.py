@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+Servidor SMTP local que sustituye al servidor de correo en los benchmarks.
+
+Atiende en 127.0.0.1 lo que usa EmailManager: EHLO, STARTTLS (con un certificado
+autofirmado generado al iniciar), AUTH con cualquier usuario/contraseña, MAIL, RCPT
+y DATA. No entrega nada: guarda los destinatarios de cada mensaje recibido. Con
+`latencia` cada respuesta se retrasa una ida y vuelta, ya que smtplib espera la
+respuesta de cada comando antes de mandar el siguiente.
+
+Uso como fixture:
+
+    with ServidorSMTPLocal(latencia=0.005) as smtp:
+        app = entorno.cargar_app(servidor, secrets_extra=smtp.secrets())
+        ...
+        smtp.recibidos  # un elemento por mensaje aceptado
+"""
+import datetime
+import os
+import socketserver
+import ssl
+import tempfile
+import threading
+import time
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+
+def _certificado_autofirmado(directorio: str) -> tuple:
+    """Genera un certificado para 127.0.0.1; devuelve las rutas (certificado, llave)"""
+    llave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nombre = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    ahora = datetime.datetime.now(datetime.timezone.utc)
+    certificado = (x509.CertificateBuilder()
+                   .subject_name(nombre).issuer_name(nombre)
+                   .public_key(llave.public_key())
+                   .serial_number(x509.random_serial_number())
+                   .not_valid_before(ahora - datetime.timedelta(minutes=1))
+                   .not_valid_after(ahora + datetime.timedelta(days=1))
+                   .sign(llave, hashes.SHA256()))
+    ruta_certificado = os.path.join(directorio, "smtp.crt")
+    ruta_llave = os.path.join(directorio, "smtp.key")
+    with open(ruta_certificado, "wb") as f:
+        f.write(certificado.public_bytes(serialization.Encoding.PEM))
+    with open(ruta_llave, "wb") as f:
+        f.write(llave.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.TraditionalOpenSSL,
+                                    serialization.NoEncryption()))
+    return ruta_certificado, ruta_llave
+
+
+class _SesionSMTP(socketserver.StreamRequestHandler):
+    """Una conexión de cliente: un comando por línea, una respuesta por comando"""
+    def responder(self, linea: str):
+        if self.server.smtp.latencia:
+            time.sleep(2 * self.server.smtp.latencia)
+        self.wfile.write(linea.encode("ascii") + b"\r\n")
+        self.wfile.flush()
+
+    def handle(self):
+        smtp = self.server.smtp
+        destinatarios = []
+        self.responder("220 127.0.0.1 ESMTP benchmark")
+        while True:
+            linea = self.rfile.readline()
+            if not linea:
+                return
+            comando = linea.decode("utf-8", "replace").strip()
+            verbo = comando.split(" ", 1)[0].upper()
+            if verbo == "EHLO":
+                extensiones = ["250-127.0.0.1", "250-AUTH PLAIN LOGIN"]
+                if not isinstance(self.connection, ssl.SSLSocket):
+                    extensiones.append("250-STARTTLS")
+                self.responder("\r\n".join(extensiones + ["250 8BITMIME"]))
+            elif verbo == "STARTTLS":
+                self.responder("220 Listo para TLS")
+                self.connection = smtp.contexto_tls.wrap_socket(self.connection, server_side=True)
+                self.rfile = self.connection.makefile("rb")
+                self.wfile = self.connection.makefile("wb")
+            elif verbo == "AUTH":
+                if comando.upper().startswith("AUTH LOGIN"):
+                    # Usuario y contraseña en dos líneas más, codificados en base64
+                    for _ in range(2 if len(comando.split()) == 2 else 1):
+                        self.responder("334 ")
+                        self.rfile.readline()
+                self.responder("235 Autenticado")
+            elif verbo == "MAIL":
+                destinatarios = []
+                self.responder("250 OK")
+            elif verbo == "RCPT":
+                destinatarios.append(comando.split(":", 1)[-1].strip(" <>"))
+                self.responder("250 OK")
+            elif verbo == "DATA":
+                self.responder("354 Termine con <CRLF>.<CRLF>")
+                while self.rfile.readline() not in (b".\r\n", b""):
+                    pass
+                smtp.registrar(destinatarios)
+                self.responder("250 Aceptado")
+            elif verbo == "QUIT":
+                self.responder("221 Hasta luego")
+                return
+            else:
+                self.responder("250 OK")
+
+
+class _ServidorTCP(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+class ServidorSMTPLocal:
+    """Servidor SMTP en un hilo de fondo; usar como context manager"""
+    def __init__(self, latencia: float = 0):
+        self.latencia = latencia  # Segundos por sentido: cada respuesta cuesta una ida y vuelta
+        self.host = "127.0.0.1"
+        self.port = None
+        self.recibidos = []  # Destinatarios de cada mensaje aceptado
+        self.contexto_tls = None
+        self._lock = threading.Lock()
+        self._servidor = None
+
+    def __enter__(self):
+        self.iniciar()
+        return self
+
+    def __exit__(self, *exc):
+        self.detener()
+
+    def iniciar(self):
+        self.contexto_tls = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        self.contexto_tls.load_cert_chain(*_certificado_autofirmado(tempfile.mkdtemp(prefix="smtp_local_")))
+        self._servidor = _ServidorTCP((self.host, 0), _SesionSMTP)
+        self._servidor.smtp = self
+        self.port = self._servidor.server_address[1]
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def registrar(self, destinatarios: list):
+        with self._lock:
+            self.recibidos.append(destinatarios)
+
+    def secrets(self) -> dict:
+        """Secrets de correo de las apps apuntando a este servidor (para entorno.cargar_app)"""
+        return {
+            "smtp_server": self.host,
+            "smtp_port": self.port,
+            "email_user": "benchmark@localhost",
+            "email_password": "benchmark",
+            "notification_email": "admin@localhost",
+        }
@@ -4,15 +4,17 @@ import pandas as pd
 import csv
 import os
 from datetime import datetime
-import paramiko
-import time
 import re
-from typing import Optional, List, Dict, Any
-import threading
+from typing import List, Dict
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from acceso_remoto import (
+    ConfigRemota, SSHManager, archivos_calificaciones_verificados, configurar, persistir_registro,
+    show_admin_metrics
+)
+
 # Configuración de la página
 st.set_page_config(
     page_title="Sistema Académico - Evaluación",
@@ -24,17 +26,15 @@ st.set_page_config(
 # ====================
 # CONFIGURACIÓN INICIAL
 # ====================
-class Config:
+class Config(ConfigRemota):
+    MAX_RETRIES = 3
+    SSH_MAX_CONEXIONES = 5
+    SSH_REINTENTO_BASE = 2.0
+    SSH_SOLO_PASSWORD = True
+    
     def __init__(self):
-        # Configuración para conexión remota
-        self.REMOTE = {
-            'HOST': st.secrets["remote_host"],
-            'USER': st.secrets["remote_user"],
-            'PASSWORD': st.secrets["remote_password"],
-            'PORT': int(st.secrets.get("remote_port")),
-            'DIR': st.secrets["remote_dir"],
-            'CALIFICACIONES_FILE': st.secrets["remote_calificaciones"]
-        }
+        super().__init__()
+        self.REMOTE['CALIFICACIONES_FILE'] = st.secrets["remote_calificaciones"]
         
         # Configuración para envío de correos
         self.EMAIL_CONFIGURED = False
@@ -50,290 +50,17 @@ class Config:
             st.warning(f"⚠️ Configuración de correo incompleta: {e}. El envío de correos estará deshabilitado.")
             self.EMAIL = {}
         
-        # Tiempo máximo de espera para conexión (segundos)
-        self.TIMEOUT = 15
-        # Número máximo de reintentos de conexión
-        self.MAX_RETRIES = 3
+        # Directorio del diario local donde se confirman las calificaciones antes de enviarlas
+        self.JOURNAL_DIR = st.secrets.get(
+            "journal_dir", os.path.join(os.path.expanduser("~"), ".calificaciones_diario")
+        )
+        # Contraseña del panel de métricas (?admin=1); sin ella el panel queda deshabilitado
+        self.ADMIN_PASSWORD = st.secrets.get("admin_password")
 
 CONFIG = Config()
+configurar(CONFIG)
 
 
-# ==================
-# FUNCIONES SSH/SFTP
-# ==================
-class SSHConnectionPool:
-    """Pool de conexiones SSH para manejar múltiples usuarios simultáneos"""
-    _instance = None
-    _lock = threading.Lock()
-    
-    def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(SSHConnectionPool, cls).__new__(cls)
-                cls._instance._initialize()
-            return cls._instance
-    
-    def _initialize(self):
-        self.available_connections = []
-        self.in_use_connections = []
-        self.max_connections = 5
-        self.connection_timeout = 300
-    
-    def get_connection(self):
-        """Obtiene una conexión del pool"""
-        with self._lock:
-            current_time = time.time()
-            
-            # Limpiar conexiones expiradas
-            self.available_connections = [
-                conn for conn in self.available_connections
-                if (current_time - conn['last_used']) < self.connection_timeout
-            ]
-            
-            # Reutilizar conexión disponible
-            while self.available_connections:
-                conn_data = self.available_connections.pop()
-                ssh = conn_data['ssh']
-                
-                try:
-                    transport = ssh.get_transport()
-                    if transport and transport.is_active():
-                        self.in_use_connections.append({
-                            'ssh': ssh,
-                            'last_used': current_time
-                        })
-                        return ssh
-                except:
-                    try:
-                        ssh.close()
-                    except:
-                        pass
-                    continue
-            
-            # Crear nueva conexión si no hay disponibles
-            if len(self.in_use_connections) < self.max_connections:
-                ssh = self._create_new_connection()
-                if ssh:
-                    self.in_use_connections.append({
-                        'ssh': ssh,
-                        'last_used': current_time
-                    })
-                    return ssh
-            
-            return None
-    
-    def _create_new_connection(self):
-        """Crea una nueva conexión SSH"""
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        for attempt in range(CONFIG.MAX_RETRIES):
-            try:
-                ssh.connect(
-                    hostname=CONFIG.REMOTE['HOST'],
-                    port=CONFIG.REMOTE['PORT'],
-                    username=CONFIG.REMOTE['USER'],
-                    password=CONFIG.REMOTE['PASSWORD'],
-                    timeout=CONFIG.TIMEOUT,
-                    banner_timeout=30,
-                    allow_agent=False,
-                    look_for_keys=False
-                )
-                return ssh
-            except Exception as e:
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error(f"Error de conexión SSH después de {CONFIG.MAX_RETRIES} intentos: {str(e)}")
-                    return None
-                time.sleep(2)
-    
-    def return_connection(self, ssh):
-        """Devuelve una conexión al pool"""
-        with self._lock:
-            self.in_use_connections = [
-                conn for conn in self.in_use_connections
-                if conn['ssh'] != ssh
-            ]
-            
-            try:
-                transport = ssh.get_transport()
-                if transport and transport.is_active():
-                    self.available_connections.append({
-                        'ssh': ssh,
-                        'last_used': time.time()
-                    })
-                else:
-                    try:
-                        ssh.close()
-                    except:
-                        pass
-            except:
-                try:
-                    ssh.close()
-                except:
-                    pass
-    
-    def cleanup(self):
-        """Limpia todas las conexiones"""
-        with self._lock:
-            for conn_data in self.available_connections + self.in_use_connections:
-                try:
-                    conn_data['ssh'].close()
-                except:
-                    pass
-            self.available_connections = []
-            self.in_use_connections = []
-
-
-class SSHManager:
-    _connection_pool = SSHConnectionPool()
-    _file_lock_timeout = 30
-
-    @staticmethod
-    def get_connection():
-        return SSHManager._connection_pool.get_connection()
-
-    @staticmethod
-    def return_connection(ssh):
-        SSHManager._connection_pool.return_connection(ssh)
-
-    @staticmethod
-    def cleanup():
-        SSHManager._connection_pool.cleanup()
-
-    @staticmethod
-    def _acquire_file_lock(remote_path: str, sftp) -> bool:
-        lock_path = remote_path + '.lock'
-        max_attempts = 10
-        attempt = 0
-        
-        while attempt < max_attempts:
-            try:
-                try:
-                    sftp.stat(lock_path)
-                    time.sleep(0.5)
-                    attempt += 1
-                    continue
-                except FileNotFoundError:
-                    try:
-                        with sftp.file(lock_path, 'w') as f:
-                            f.write(f"locked_{datetime.now().isoformat()}")
-                        time.sleep(0.1)
-                        try:
-                            sftp.stat(lock_path)
-                            return True
-                        except FileNotFoundError:
-                            continue
-                    except:
-                        continue
-            except Exception:
-                attempt += 1
-                time.sleep(0.5)
-        
-        return False
-
-    @staticmethod
-    def _release_file_lock(remote_path: str, sftp):
-        lock_path = remote_path + '.lock'
-        try:
-            sftp.remove(lock_path)
-        except:
-            pass
-
-    @staticmethod
-    def get_remote_file(remote_path: str) -> Optional[str]:
-        for attempt in range(CONFIG.MAX_RETRIES):
-            ssh = SSHManager.get_connection()
-            if not ssh:
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error("No se pudo obtener conexión SSH")
-                    return None
-                continue
-            
-            try:
-                sftp = ssh.open_sftp()
-                
-                if not SSHManager._acquire_file_lock(remote_path, sftp):
-                    if attempt == CONFIG.MAX_RETRIES - 1:
-                        SSHManager.return_connection(ssh)
-                        return None
-                    continue
-                
-                try:
-                    with sftp.file(remote_path, 'r') as f:
-                        content = f.read().decode('utf-8')
-                    return content
-                finally:
-                    SSHManager._release_file_lock(remote_path, sftp)
-                    
-            except FileNotFoundError:
-                SSHManager._release_file_lock(remote_path, sftp)
-                return ""
-            except Exception as e:
-                SSHManager._release_file_lock(remote_path, sftp)
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error(f"Error leyendo archivo remoto: {str(e)}")
-                    return None
-            finally:
-                SSHManager.return_connection(ssh)
-        return None
-
-    @staticmethod
-    def write_remote_file(remote_path: str, content: str) -> bool:
-        for attempt in range(CONFIG.MAX_RETRIES):
-            ssh = SSHManager.get_connection()
-            if not ssh:
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error("No se pudo obtener conexión SSH para escritura")
-                    return False
-                continue
-            
-            try:
-                sftp = ssh.open_sftp()
-                
-                if not SSHManager._acquire_file_lock(remote_path, sftp):
-                    if attempt == CONFIG.MAX_RETRIES - 1:
-                        SSHManager.return_connection(ssh)
-                        return False
-                    continue
-                
-                try:
-                    dir_path = os.path.dirname(remote_path)
-                    try:
-                        sftp.stat(dir_path)
-                    except FileNotFoundError:
-                        parts = dir_path.split('/')
-                        current_path = ""
-                        for part in parts:
-                            if part:
-                                current_path += '/' + part
-                                try:
-                                    sftp.stat(current_path)
-                                except FileNotFoundError:
-                                    sftp.mkdir(current_path)
-                    
-                    temp_path = remote_path + '.tmp'
-                    with sftp.file(temp_path, 'w') as f:
-                        f.write(content.encode('utf-8'))
-                    
-                    try:
-                        sftp.rename(temp_path, remote_path)
-                    except:
-                        with sftp.file(remote_path, 'w') as f:
-                            f.write(content.encode('utf-8'))
-                    
-                    return True
-                finally:
-                    SSHManager._release_file_lock(remote_path, sftp)
-                    
-            except Exception as e:
-                SSHManager._release_file_lock(remote_path, sftp)
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error(f"Error escribiendo archivo remoto: {str(e)}")
-                    return False
-            finally:
-                SSHManager.return_connection(ssh)
-        return False
-
 # ====================
 # FUNCIONES DE CORREO
 # ====================
@@ -442,31 +169,38 @@ class EmailManager:
 # ====================
 # FUNCIONES DE CALIFICACIONES
 # ====================
+ENCABEZADO_CALIFICACIONES = "Fecha,Número Económico,Nombre Completo,Email,Calificación\n"
+
 def inicializar_archivo_calificaciones() -> bool:
-    """Inicializa el archivo CSV si no existe"""
+    """Comprueba el encabezado del CSV (y lo crea si falta) una sola vez por proceso"""
     remote_path = os.path.join(CONFIG.REMOTE['DIR'], CONFIG.REMOTE['CALIFICACIONES_FILE'])
+    verificados = archivos_calificaciones_verificados()
+    if remote_path in verificados:
+        return True
     
     with st.spinner("Conectando al servidor..."):
-        csv_content = SSHManager.get_remote_file(remote_path)
+        # Basta con los primeros bytes: el resto del archivo no se descarga
+        inicio_csv = SSHManager.get_remote_head(remote_path, len(ENCABEZADO_CALIFICACIONES.encode('utf-8')) + 64)
 
-    if csv_content is None:
+    if inicio_csv is None:
         st.error("❌ No se pudo conectar al servidor remoto")
         return False
 
-    if csv_content == "" or not csv_content.startswith("Fecha,Número Económico,Nombre Completo,Email,Calificación"):
-        nuevo_contenido = "Fecha,Número Económico,Nombre Completo,Email,Calificación\n"
+    if inicio_csv == "" or not inicio_csv.startswith(ENCABEZADO_CALIFICACIONES.strip()):
+        nuevo_contenido = ENCABEZADO_CALIFICACIONES
         with st.spinner("Creando archivo de calificaciones..."):
             success = SSHManager.write_remote_file(remote_path, nuevo_contenido)
         if success:
             st.success("✅ Archivo de calificaciones inicializado correctamente")
         else:
             st.error("❌ Error al inicializar el archivo de calificaciones")
-        return success
+            return False
     
+    verificados.add(remote_path)
     return True
 
 def guardar_calificacion(numero_economico: str, nombre: str, email: str, calificacion: int) -> bool:
-    """Guarda la calificación en el archivo CSV remoto con lock"""
+    """Guarda la calificación en el diario local; un hilo de fondo la envía al CSV remoto"""
     fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     nombre_limpio = nombre.replace(',', ';')
     nuevo_registro = f"{fecha},{numero_economico},{nombre_limpio},{email},{calificacion}\n"
@@ -475,22 +209,10 @@ def guardar_calificacion(numero_economico: str, nombre: str, email: str, calific
     remote_path = os.path.join(CONFIG.REMOTE['DIR'], CONFIG.REMOTE['CALIFICACIONES_FILE'])
     
     with st.spinner("Guardando calificación..."):
-        csv_content = SSHManager.get_remote_file(remote_path)
-
-    if csv_content is None:
-        st.error("❌ Error al leer el archivo de calificaciones existente")
-        return False
-
-    if csv_content and not csv_content.endswith('\n'):
-        csv_content += '\n'
-
-    nuevo_contenido = csv_content + nuevo_registro
-    
-    with st.spinner("Escribiendo en archivo remoto..."):
-        success = SSHManager.write_remote_file(remote_path, nuevo_contenido)
+        success = persistir_registro(CONFIG, remote_path, nuevo_registro, ENCABEZADO_CALIFICACIONES)
     
     if success:
-        st.success("✅ Calificación guardada correctamente en el archivo remoto")
+        st.success("✅ Calificación guardada correctamente en el sistema")
     else:
         st.error("❌ Error al guardar la calificación en el archivo remoto")
     
@@ -759,10 +481,11 @@ def main():
         st.header("Estado del Sistema")
         
         with st.spinner("Probando conexión..."):
-            ssh = SSHManager.get_connection()
-            if ssh:
-                st.success("✅ Conectado al servidor")
-                SSHManager.return_connection(ssh)
+            if SSHManager.almacenamiento_disponible():
+                st.success(f"✅ Conectado al {SSHManager._almacen.descripcion}")
+            elif not SSHManager.servidor_disponible():
+                espera = SSHManager._connection_pool.circuito.segundos_para_sondeo()
+                st.error(f"❌ Servidor no disponible (nuevo intento en {espera:.0f} s)")
             else:
                 st.error("❌ Error de conexión")
         
@@ -770,6 +493,8 @@ def main():
         if st.session_state.examen_iniciado:
             respuestas_contestadas = sum(1 for r in st.session_state.respuestas if r is not None)
             st.info(f"Progreso: {respuestas_contestadas}/{len(preguntas)}")
+        
+        show_admin_metrics(CONFIG)
     
     if 'archivo_inicializado' not in st.session_state:
         with st.spinner("Inicializando sistema..."):
@@ -829,5 +554,3 @@ try:
         main()
 except Exception as e:
     st.error(f"Error crítico en la aplicación: {str(e)}")
-finally:
-    SSHManager.cleanup()
@@ -4,15 +4,17 @@ import pandas as pd
 import csv
 import os
 from datetime import datetime
-import paramiko
-import time
 import re
-from typing import Optional, List, Dict, Any
-import threading
+from typing import List, Dict
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
+from acceso_remoto import (
+    ConfigRemota, SSHManager, archivos_calificaciones_verificados, configurar, persistir_registro,
+    show_admin_metrics
+)
+
 # Configuración de la página
 st.set_page_config(
     page_title="Sistema Académico - Evaluación Semana 5",
@@ -24,17 +26,10 @@ st.set_page_config(
 # ====================
 # CONFIGURACIÓN INICIAL
 # ====================
-class Config:
+class Config(ConfigRemota):
     def __init__(self):
-        # Configuración para conexión remota
-        self.REMOTE = {
-            'HOST': st.secrets["remote_host"],
-            'USER': st.secrets["remote_user"],
-            'PASSWORD': st.secrets["remote_password"],
-            'PORT': st.secrets["remote_port"],
-            'DIR': st.secrets["remote_dir"],
-            'CALIFICACIONES_FILE': st.secrets["remote_calificaciones"]
-        }
+        super().__init__()
+        self.REMOTE['CALIFICACIONES_FILE'] = st.secrets["remote_calificaciones"]
         
         # Configuración para envío de correos (usando los nombres correctos de tus secrets)
         self.EMAIL_CONFIGURED = False
@@ -51,306 +46,17 @@ class Config:
             st.warning(f"⚠️ Configuración de correo incompleta: {e}. El envío de correos estará deshabilitado.")
             self.EMAIL = {}
         
-        # Tiempo máximo de espera para conexión (segundos)
-        self.TIMEOUT = 15
-        # Número máximo de reintentos de conexión
-        self.MAX_RETRIES = 2
+        # Directorio del diario local donde se confirman las calificaciones antes de enviarlas
+        self.JOURNAL_DIR = st.secrets.get(
+            "journal_dir", os.path.join(os.path.expanduser("~"), ".calificaciones_diario")
+        )
+        # Contraseña del panel de métricas (?admin=1); sin ella el panel queda deshabilitado
+        self.ADMIN_PASSWORD = st.secrets.get("admin_password")
 
 CONFIG = Config()
+configurar(CONFIG)
 
 
-# ==================
-# FUNCIONES SSH/SFTP
-# ==================
-class SSHConnectionPool:
-    """Pool de conexiones SSH para manejar múltiples usuarios simultáneos"""
-    _instance = None
-    _lock = threading.Lock()
-    
-    def __new__(cls):
-        with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(SSHConnectionPool, cls).__new__(cls)
-                cls._instance._initialize()
-            return cls._instance
-    
-    def _initialize(self):
-        self.available_connections = []
-        self.in_use_connections = []
-        self.max_connections = 10  # Máximo de conexiones simultáneas
-        self.connection_timeout = 300  # 5 minutos para reutilizar conexión
-    
-    def get_connection(self):
-        """Obtiene una conexión del pool"""
-        with self._lock:
-            current_time = time.time()
-            
-            # Limpiar conexiones expiradas
-            self.available_connections = [
-                conn for conn in self.available_connections
-                if (current_time - conn['last_used']) < self.connection_timeout
-            ]
-            
-            # Reutilizar conexión disponible
-            while self.available_connections:
-                conn_data = self.available_connections.pop()
-                ssh = conn_data['ssh']
-                
-                try:
-                    # Verificar si la conexión sigue activa
-                    ssh.exec_command("echo 'Connection test'", timeout=5)
-                    self.in_use_connections.append({
-                        'ssh': ssh,
-                        'last_used': current_time
-                    })
-                    return ssh
-                except:
-                    try:
-                        ssh.close()
-                    except:
-                        pass
-                    continue
-            
-            # Crear nueva conexión si no hay disponibles y no excedemos el límite
-            if len(self.in_use_connections) < self.max_connections:
-                ssh = self._create_new_connection()
-                if ssh:
-                    self.in_use_connections.append({
-                        'ssh': ssh,
-                        'last_used': current_time
-                    })
-                    return ssh
-            
-            return None
-    
-    def _create_new_connection(self):
-        """Crea una nueva conexión SSH"""
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        
-        for attempt in range(CONFIG.MAX_RETRIES):
-            try:
-                ssh.connect(
-                    hostname=CONFIG.REMOTE['HOST'],
-                    port=CONFIG.REMOTE['PORT'],
-                    username=CONFIG.REMOTE['USER'],
-                    password=CONFIG.REMOTE['PASSWORD'],
-                    timeout=CONFIG.TIMEOUT,
-                    banner_timeout=30
-                )
-                return ssh
-            except Exception as e:
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error(f"Error de conexión SSH después de {CONFIG.MAX_RETRIES} intentos: {str(e)}")
-                    return None
-                time.sleep(1)
-    
-    def return_connection(self, ssh):
-        """Devuelve una conexión al pool"""
-        with self._lock:
-            # Encontrar y remover de in_use_connections
-            self.in_use_connections = [
-                conn for conn in self.in_use_connections
-                if conn['ssh'] != ssh
-            ]
-            
-            # Verificar que la conexión aún esté activa antes de devolverla al pool
-            try:
-                ssh.exec_command("echo 'Connection test'", timeout=5)
-                self.available_connections.append({
-                    'ssh': ssh,
-                    'last_used': time.time()
-                })
-            except:
-                try:
-                    ssh.close()
-                except:
-                    pass
-    
-    def cleanup(self):
-        """Limpia todas las conexiones"""
-        with self._lock:
-            for conn_data in self.available_connections + self.in_use_connections:
-                try:
-                    conn_data['ssh'].close()
-                except:
-                    pass
-            self.available_connections = []
-            self.in_use_connections = []
-
-
-class SSHManager:
-    _connection_pool = SSHConnectionPool()
-    _file_lock_timeout = 30  # 30 segundos máximo para esperar un lock
-
-    @staticmethod
-    def get_connection():
-        """Obtiene una conexión del pool"""
-        return SSHManager._connection_pool.get_connection()
-
-    @staticmethod
-    def return_connection(ssh):
-        """Devuelve una conexión al pool"""
-        SSHManager._connection_pool.return_connection(ssh)
-
-    @staticmethod
-    def cleanup():
-        """Limpia todas las conexiones del pool"""
-        SSHManager._connection_pool.cleanup()
-
-    @staticmethod
-    def _acquire_file_lock(remote_path: str, sftp) -> bool:
-        """Adquiere un lock para el archivo usando archivo .lock"""
-        lock_path = remote_path + '.lock'
-        max_attempts = 10
-        attempt = 0
-        
-        while attempt < max_attempts:
-            try:
-                # Intentar crear el archivo lock
-                try:
-                    sftp.stat(lock_path)
-                    # Lock existe, esperar
-                    time.sleep(0.5)
-                    attempt += 1
-                    continue
-                except FileNotFoundError:
-                    # Lock no existe, crearlo
-                    try:
-                        with sftp.file(lock_path, 'w') as f:
-                            f.write(f"locked_{datetime.now().isoformat()}")
-                        # Verificar que somos los dueños del lock
-                        time.sleep(0.1)
-                        try:
-                            sftp.stat(lock_path)
-                            return True
-                        except FileNotFoundError:
-                            # Alguien más creó el lock
-                            continue
-                    except:
-                        continue
-            except Exception:
-                attempt += 1
-                time.sleep(0.5)
-        
-        return False
-
-    @staticmethod
-    def _release_file_lock(remote_path: str, sftp):
-        """Libera el lock del archivo"""
-        lock_path = remote_path + '.lock'
-        try:
-            sftp.remove(lock_path)
-        except:
-            pass  # Ignorar errores al liberar lock
-
-    @staticmethod
-    def get_remote_file(remote_path: str) -> Optional[str]:
-        """Lee archivo remoto con manejo de errores y reintentos"""
-        for attempt in range(CONFIG.MAX_RETRIES):
-            ssh = SSHManager.get_connection()
-            if not ssh:
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    return None
-                continue
-            
-            try:
-                sftp = ssh.open_sftp()
-                
-                # Adquirir lock antes de leer
-                if not SSHManager._acquire_file_lock(remote_path, sftp):
-                    st.warning("Esperando acceso al archivo...")
-                    if attempt == CONFIG.MAX_RETRIES - 1:
-                        SSHManager.return_connection(ssh)
-                        return None
-                    continue
-                
-                try:
-                    with sftp.file(remote_path, 'r') as f:
-                        content = f.read().decode('utf-8')
-                    return content
-                finally:
-                    # Liberar lock después de leer
-                    SSHManager._release_file_lock(remote_path, sftp)
-                    
-            except FileNotFoundError:
-                SSHManager._release_file_lock(remote_path, sftp)
-                return ""  # Archivo no existe, retornar vacío
-            except Exception as e:
-                SSHManager._release_file_lock(remote_path, sftp)
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error(f"Error leyendo archivo remoto: {str(e)}")
-                    return None
-                # En caso de error, reintentar
-            finally:
-                SSHManager.return_connection(ssh)
-        return None
-
-    @staticmethod
-    def write_remote_file(remote_path: str, content: str) -> bool:
-        """Escribe en archivo remoto con manejo de errores y reintentos"""
-        for attempt in range(CONFIG.MAX_RETRIES):
-            ssh = SSHManager.get_connection()
-            if not ssh:
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    return False
-                continue
-            
-            try:
-                sftp = ssh.open_sftp()
-                
-                # Adquirir lock antes de escribir
-                if not SSHManager._acquire_file_lock(remote_path, sftp):
-                    st.warning("Esperando acceso al archivo...")
-                    if attempt == CONFIG.MAX_RETRIES - 1:
-                        SSHManager.return_connection(ssh)
-                        return False
-                    continue
-                
-                try:
-                    # Crear directorio si no existe
-                    dir_path = os.path.dirname(remote_path)
-                    try:
-                        sftp.stat(dir_path)
-                    except FileNotFoundError:
-                        # Crear directorio recursivamente
-                        parts = dir_path.split('/')
-                        current_path = ""
-                        for part in parts:
-                            if part:
-                                current_path += '/' + part
-                                try:
-                                    sftp.stat(current_path)
-                                except FileNotFoundError:
-                                    sftp.mkdir(current_path)
-                    
-                    # Escribir contenido temporal primero
-                    temp_path = remote_path + '.tmp'
-                    with sftp.file(temp_path, 'w') as f:
-                        f.write(content.encode('utf-8'))
-                    
-                    # Reemplazar archivo original
-                    try:
-                        sftp.rename(temp_path, remote_path)
-                    except:
-                        # Si falla el rename, intentar escribir directamente
-                        with sftp.file(remote_path, 'w') as f:
-                            f.write(content.encode('utf-8'))
-                    
-                    return True
-                finally:
-                    # Liberar lock después de escribir
-                    SSHManager._release_file_lock(remote_path, sftp)
-                    
-            except Exception as e:
-                SSHManager._release_file_lock(remote_path, sftp)
-                if attempt == CONFIG.MAX_RETRIES - 1:
-                    st.error(f"Error escribiendo archivo remoto: {str(e)}")
-                    return False
-            finally:
-                SSHManager.return_connection(ssh)
-        return False
-
 # ====================
 # FUNCIONES DE CORREO
 # ====================
@@ -473,44 +179,39 @@ class EmailManager:
 # ====================
 # FUNCIONES DE CALIFICACIONES
 # ====================
+ENCABEZADO_CALIFICACIONES = "Fecha,Número Económico,Nombre Completo,Email,Calificación\n"
+
 def inicializar_archivo_calificaciones() -> bool:
-    """Inicializa el archivo CSV si no existe"""
+    """Comprueba el encabezado del CSV (y lo crea si falta) una sola vez por proceso"""
     remote_path = os.path.join(CONFIG.REMOTE['DIR'], CONFIG.REMOTE['CALIFICACIONES_FILE'])
-    csv_content = SSHManager.get_remote_file(remote_path)
+    verificados = archivos_calificaciones_verificados()
+    if remote_path in verificados:
+        return True
+    
+    # Basta con los primeros bytes: el resto del archivo no se descarga
+    inicio_csv = SSHManager.get_remote_head(remote_path, len(ENCABEZADO_CALIFICACIONES.encode('utf-8')) + 64)
 
-    if csv_content is None:
-        return False  # Error de conexión
+    if inicio_csv is None:
+        return False  # Error de conexión (no se guarda, se reintenta en el siguiente rerun)
 
-    if csv_content == "" or not csv_content.strip().startswith("Fecha,Número Económico,Nombre Completo,Email,Calificación"):
+    if inicio_csv == "" or not inicio_csv.strip().startswith(ENCABEZADO_CALIFICACIONES.strip()):
         # Crear nuevo archivo con encabezados
-        nuevo_contenido = "Fecha,Número Económico,Nombre Completo,Email,Calificación\n"
-        return SSHManager.write_remote_file(remote_path, nuevo_contenido)
+        nuevo_contenido = ENCABEZADO_CALIFICACIONES
+        if not SSHManager.write_remote_file(remote_path, nuevo_contenido):
+            return False
     
+    verificados.add(remote_path)
     return True
 
 def guardar_calificacion(numero_economico: str, nombre: str, email: str, calificacion: int) -> bool:
-    """Guarda la calificación en el archivo CSV remoto con lock"""
+    """Guarda la calificación en el diario local; un hilo de fondo la envía al CSV remoto"""
     fecha = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     nuevo_registro = f'"{fecha}","{numero_economico}","{nombre}","{email}",{calificacion}\n'
 
     remote_path = os.path.join(CONFIG.REMOTE['DIR'], CONFIG.REMOTE['CALIFICACIONES_FILE'])
-    csv_content = SSHManager.get_remote_file(remote_path)
-
-    if csv_content is None:
-        st.error("❌ Error: No se pudo acceder al archivo remoto de calificaciones")
-        return False
 
-    # Si el archivo está vacío o solo tiene encabezados, empezar desde cero
-    if not csv_content.strip():
-        nuevo_contenido = "Fecha,Número Económico,Nombre Completo,Email,Calificación\n" + nuevo_registro
-    else:
-        # Asegurar que el contenido termina con nueva línea
-        if not csv_content.endswith('\n'):
-            csv_content += '\n'
-        nuevo_contenido = csv_content + nuevo_registro
-
-    # Escribir el archivo actualizado
-    if SSHManager.write_remote_file(remote_path, nuevo_contenido):
+    # Confirmar en el diario local; al enviarlo se escribe antes el encabezado si el archivo está vacío
+    if persistir_registro(CONFIG, remote_path, nuevo_registro, ENCABEZADO_CALIFICACIONES):
         st.success("✅ Calificación guardada correctamente en el sistema")
         return True
     else:
@@ -796,10 +497,11 @@ def main():
     # Mostrar estado de conexión
     with st.sidebar:
         st.header("Estado del Sistema")
-        ssh = SSHManager.get_connection()
-        if ssh:
-            st.success("✅ Conectado al servidor")
-            SSHManager.return_connection(ssh)
+        if SSHManager.almacenamiento_disponible():
+            st.success(f"✅ Conectado al {SSHManager._almacen.descripcion}")
+        elif not SSHManager.servidor_disponible():
+            espera = SSHManager._connection_pool.circuito.segundos_para_sondeo()
+            st.error(f"❌ Servidor no disponible (nuevo intento en {espera:.0f} s)")
         else:
             st.error("❌ Error de conexión")
         
@@ -807,6 +509,8 @@ def main():
         if st.session_state.examen_iniciado:
             respuestas_contestadas = sum(1 for r in st.session_state.respuestas if r is not None)
             st.info(f"Progreso: {respuestas_contestadas}/{len(preguntas)}")
+        
+        show_admin_metrics(CONFIG)
     
     # Flujo principal de la aplicación
     if not st.session_state.examen_iniciado:
@@ -857,9 +561,5 @@ def main():
                     else:
                         st.error("❌ Error al guardar la calificación. Contacta al administrador: polanco@unam.mx.")
 
-    # Limpieza al cerrar
-    import atexit
-    atexit.register(SSHManager.cleanup)
-
 if __name__ == "__main__":
     main()
@@ -7,18 +7,27 @@ from email.mime.text import MIMEText
 from email.mime.base import MIMEBase
 from email import encoders
 from email.utils import formatdate
-import paramiko
 import time
 import csv
+import contextlib
 from datetime import datetime
 import ssl
 import re
 
+from acceso_remoto import ConfigRemota, SSHManager, configurar
+
 # ====================
 # CONFIGURACIÓN INICIAL
 # ====================
-class Config:
+class Config(ConfigRemota):
+    # Tiempo máximo de espera para conexión (segundos)
+    TIMEOUT = 30
+    ALMACEN_SQLITE = ".materias_almacen.db"
+    # Alumnos y materias se leen completos en cada registro y cada consulta del profesor
+    CACHE_ARCHIVOS_MB = 32
+
     def __init__(self):
+        super().__init__()
         self.SMTP_SERVER = st.secrets["smtp_server"]
         self.SMTP_PORT = st.secrets["smtp_port"]
         self.EMAIL_USER = st.secrets["email_user"]
@@ -26,29 +35,22 @@ class Config:
         self.NOTIFICATION_EMAIL = st.secrets["notification_email"]
         self.CSV_MATERIAS = st.secrets["csv_materias_file"]
         self.MAX_FILE_SIZE_MB = 10
-        self.TIMEOUT_SECONDS = 30
         
-        self.REMOTE = {
-            'HOST': st.secrets["remote_host"],
-            'USER': st.secrets["remote_user"],
-            'PASSWORD': st.secrets["remote_password"],
-            'PORT': st.secrets["remote_port"],
-            'DIR': st.secrets["remote_dir"],
-            'FILES': {
-                'Cálculo Diferencial e Integral III': st.secrets["remote_calculo3"],
-                'Cálculo Diferencial e Integral IV': st.secrets["remote_calculo4"],
-                'Estadística no Paramétrica': st.secrets["remote_parametrica"],
-                'Bioestadística I': st.secrets["remote_bioestadistica1"],
-                'Bioestadística II': st.secrets["remote_bioestadistica2"],
-                'Análisis Multivariado y Multicategórico': st.secrets["remote_categorico"],
-                'Manejo e Interpretación de Datos': st.secrets["remote_manejo"],
-                'Análisis de Experimentos': st.secrets["remote_diseno"],
-                'Inteligencia Artificial en Enfermería': st.secrets["remote_inteligencia_enfermeria"],
-                'Inteligencia Artificial en Investigación': st.secrets["remote_inteligencia_investigacion"]
-            }
+        self.REMOTE['FILES'] = {
+            'Cálculo Diferencial e Integral III': st.secrets["remote_calculo3"],
+            'Cálculo Diferencial e Integral IV': st.secrets["remote_calculo4"],
+            'Estadística no Paramétrica': st.secrets["remote_parametrica"],
+            'Bioestadística I': st.secrets["remote_bioestadistica1"],
+            'Bioestadística II': st.secrets["remote_bioestadistica2"],
+            'Análisis Multivariado y Multicategórico': st.secrets["remote_categorico"],
+            'Manejo e Interpretación de Datos': st.secrets["remote_manejo"],
+            'Análisis de Experimentos': st.secrets["remote_diseno"],
+            'Inteligencia Artificial en Enfermería': st.secrets["remote_inteligencia_enfermeria"],
+            'Inteligencia Artificial en Investigación': st.secrets["remote_inteligencia_investigacion"]
         }
 
 CONFIG = Config()
+configurar(CONFIG)
 
 # ===================
 # FUNCIONES DE VALIDACIÓN
@@ -153,142 +155,62 @@ TEMARIOS = {
     }
 }
 
-# ==================
-# FUNCIONES SSH/SFTP
-# ==================
-class SSHManager:
-    @staticmethod
-    def get_connection():
-        """Establece conexión SSH segura"""
-        ssh = paramiko.SSHClient()
-        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        try:
-            ssh.connect(
-                hostname=CONFIG.REMOTE['HOST'],
-                port=CONFIG.REMOTE['PORT'],
-                username=CONFIG.REMOTE['USER'],
-                password=CONFIG.REMOTE['PASSWORD'],
-                timeout=CONFIG.TIMEOUT_SECONDS
-            )
-            return ssh
-        except Exception as e:
-            st.error(f"Error de conexión SSH: {str(e)}")
-            return None
-
-    @staticmethod
-    def get_remote_file(remote_path):
-        """Lee archivo remoto con manejo de errores"""
-        ssh = SSHManager.get_connection()
-        if not ssh:
-            return None
-        
-        try:
-            sftp = ssh.open_sftp()
-            with sftp.file(remote_path, 'r') as f:
-                content = f.read().decode('utf-8')
-            return content
-        except Exception as e:
-            st.error(f"Error leyendo archivo remoto: {str(e)}")
-            return None
-        finally:
-            ssh.close()
-
-    @staticmethod
-    def write_remote_file(remote_path, content):
-        """Escribe en archivo remoto con manejo de errores"""
-        ssh = SSHManager.get_connection()
-        if not ssh:
-            return False
-        
-        try:
-            sftp = ssh.open_sftp()
-            with sftp.file(remote_path, 'w') as f:
-                f.write(content.encode('utf-8'))
-            return True
-        except Exception as e:
-            st.error(f"Error escribiendo archivo remoto: {str(e)}")
-            return False
-        finally:
-            ssh.close()
-
-    @staticmethod
-    def append_to_remote_file(remote_path, content):
-        """Añade contenido a un archivo remoto existente"""
-        ssh = SSHManager.get_connection()
-        if not ssh:
-            return False
-        
-        try:
-            sftp = ssh.open_sftp()
-            # Leer contenido existente
-            try:
-                existing_content = sftp.file(remote_path, 'r').read().decode('utf-8')
-            except:
-                existing_content = ""
-            
-            # Escribir contenido completo
-            with sftp.file(remote_path, 'w') as f:
-                f.write((existing_content + content).encode('utf-8'))
-            return True
-        except Exception as e:
-            st.error(f"Error añadiendo a archivo remoto: {str(e)}")
-            return False
-        finally:
-            ssh.close()
-
 # ====================
 # FUNCIONES PRINCIPALES
 # ====================
 def obtener_alumnos(materia):
     """Obtiene alumnos de una materia con validación robusta"""
     remote_path = os.path.join(CONFIG.REMOTE['DIR'], CONFIG.CSV_MATERIAS)
-    csv_content = SSHManager.get_remote_file(remote_path)
-    
-    if not csv_content:
-        return []
-
+    expected_headers = ['fecha', 'nombre', 'email', 'materias']
     alumnos = []
-    lines = csv_content.splitlines()
     
-    # Verificar encabezados
-    headers = [h.strip().lower() for h in lines[0].split(',')]
-    expected_headers = ['fecha', 'nombre', 'email', 'materias']
+    try:
+        # Las filas se procesan conforme llegan: el archivo nunca está completo en memoria
+        with contextlib.closing(SSHManager.iter_remote_csv(remote_path)) as filas:
+            headers = [h.strip().lower() for h in next(filas, [])]
+            if not headers:
+                return []
+            formato_valido = all(h in headers for h in expected_headers)
+            
+            # Procesar cada registro
+            for fila in filas if formato_valido else ():
+                if not any(p.strip() for p in fila):
+                    continue
+                    
+                try:
+                    # Manejar formato inconsistente
+                    parts = [p.strip() for p in fila]
+                    if len(parts) < 4:
+                        continue
+                        
+                    fecha = parts[0]
+                    nombre = clean_name(parts[1])
+                    email = parts[2].lower()
+                    materias = [m.strip() for m in parts[3:] if m.strip()]
+                    
+                    if not validate_email(email):
+                        continue
+                        
+                    if materia in materias:
+                        alumnos.append({
+                            'nombre': nombre,
+                            'email': email,
+                            'fecha': fecha
+                        })
+                except Exception as e:
+                    st.warning(f"Error procesando línea: {','.join(fila)}. Error: {str(e)}")
+                    continue
+    except Exception as e:
+        st.error(f"Error leyendo archivo remoto: {str(e)}")
+        return []
     
-    if not all(h in headers for h in expected_headers):
+    # Verificar encabezados (con la lectura ya cerrada antes de reescribir)
+    if not formato_valido:
         st.error("El archivo CSV no tiene el formato esperado. Se creará uno nuevo.")
         # Crear nuevo archivo con formato correcto
         new_content = "fecha,nombre,email,materias\n"
         SSHManager.write_remote_file(remote_path, new_content)
         return []
-    
-    # Procesar cada registro
-    for line in lines[1:]:
-        if not line.strip():
-            continue
-            
-        try:
-            # Manejar formato inconsistente
-            parts = [p.strip() for p in line.split(',')]
-            if len(parts) < 4:
-                continue
-                
-            fecha = parts[0]
-            nombre = clean_name(parts[1])
-            email = parts[2].lower()
-            materias = [m.strip() for m in parts[3:] if m.strip()]
-            
-            if not validate_email(email):
-                continue
-                
-            if materia in materias:
-                alumnos.append({
-                    'nombre': nombre,
-                    'email': email,
-                    'fecha': fecha
-                })
-        except Exception as e:
-            st.warning(f"Error procesando línea: {line}. Error: {str(e)}")
-            continue
             
     return alumnos
 
@@ -314,11 +236,9 @@ def registrar_alumno(nombre, email, materias):
     csv_content = SSHManager.get_remote_file(remote_path)
 
     # Si el archivo no existe o está mal formado, crear uno nuevo
-    if not csv_content or not csv_content.startswith("fecha,nombre,email,materias"):
+    archivo_valido = bool(csv_content) and csv_content.startswith("fecha,nombre,email,materias")
+    if not archivo_valido:
         csv_content = "fecha,nombre,email,materias\n"
-    else:
-        if not csv_content.endswith('\n'):
-            csv_content += '\n'
 
     # Verificar si el alumno ya existe
     lines = csv_content.splitlines()
@@ -329,8 +249,12 @@ def registrar_alumno(nombre, email, materias):
     # Crear nuevo registro con formato consistente
     nuevo_registro = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{nombre},{email},{','.join(materias)}\n"
 
-    # Escribir el archivo principal
-    if not SSHManager.write_remote_file(remote_path, csv_content + nuevo_registro):
+    # Escribir el archivo principal: añadir solo el registro nuevo si el archivo es válido
+    if archivo_valido:
+        escrito = SSHManager.append_remote_file(remote_path, nuevo_registro)
+    else:
+        escrito = SSHManager.write_remote_file(remote_path, csv_content + nuevo_registro)
+    if not escrito:
         return False
 
     # Registrar en archivos específicos de materias
@@ -341,15 +265,18 @@ def registrar_alumno(nombre, email, materias):
             current_content = SSHManager.get_remote_file(materia_path) or ""
             
             # Normalizar archivo de materia si es necesario
-            if not current_content.startswith("fecha,nombre,email"):
+            materia_valida = current_content.startswith("fecha,nombre,email")
+            if not materia_valida:
                 current_content = "fecha,nombre,email\n"
-            elif not current_content.endswith('\n'):
-                current_content += '\n'
                 
             # Verificar si el alumno ya está en este archivo específico
             if email not in current_content:
                 registro = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{nombre},{email}\n"
-                if not SSHManager.write_remote_file(materia_path, current_content + registro):
+                if materia_valida:
+                    escrito = SSHManager.append_remote_file(materia_path, registro)
+                else:
+                    escrito = SSHManager.write_remote_file(materia_path, current_content + registro)
+                if not escrito:
                     st.warning(f"No se pudo actualizar el archivo para {materia}")
             else:
                 st.info(f"El alumno ya estaba registrado en {materia}")
@@ -493,10 +420,8 @@ def modo_profesor():
     # Verificar conexión remota
     with st.expander("Estado del sistema", expanded=False):
         with st.spinner("Verificando conexión con servidor..."):
-            ssh = SSHManager.get_connection()
-            if ssh:
-                st.success("Conexión SSH establecida correctamente")
-                ssh.close()
+            if SSHManager.almacenamiento_disponible():
+                st.success(f"Conexión con el {SSHManager._almacen.descripcion} establecida correctamente")
             else:
                 st.error("No se pudo conectar al servidor remoto")
                 return
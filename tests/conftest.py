@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures comunes: el servidor SFTP local de los benchmarks y una app cargada contra él.
+
+Uso:
+    python -m pytest -q
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+from entorno import cargar_app, ruta_calificaciones  # noqa: E402
+from servidor_sftp import ServidorSFTPLocal  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def servidor():
+    with ServidorSFTPLocal() as servidor:
+        yield servidor
+
+
+@pytest.fixture(scope="session")
+def app(servidor):
+    """calificaciones101 configurada contra el servidor local; comparte pool y caché entre pruebas"""
+    app = cargar_app(servidor)
+    yield app
+    app.SSHManager.cleanup()
+
+
+@pytest.fixture
+def acceso_remoto(app):
+    import acceso_remoto  # Tras cargar_app, que agrega la raíz del repo a sys.path
+    return acceso_remoto
+
+
+@pytest.fixture
+def ruta(app, request):
+    """Ruta remota propia de cada prueba, junto al CSV de calificaciones de la app"""
+    directorio = os.path.dirname(ruta_calificaciones(app))
+    return os.path.join(directorio, f"{request.node.name}.csv")
+
+
+@pytest.fixture(autouse=True)
+def sin_fallos(servidor):
+    """Cada prueba empieza y termina sin fallos inyectados"""
+    servidor.tasa_fallos = 0
+    yield
+    servidor.tasa_fallos = 0
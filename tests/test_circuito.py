@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""Transiciones del circuito hacia el servidor y su efecto sobre el pool"""
+import time
+
+import pytest
+
+
+@pytest.fixture
+def circuito(acceso_remoto):
+    return acceso_remoto.CircuitoRemoto(umbral_fallos=2, intervalo_sondeo=0.2,
+                                        metricas=acceso_remoto.MetricasSSH())
+
+
+@pytest.fixture
+def pool(app, monkeypatch):
+    """Pool de la app sin sondeos durante la prueba; el circuito vuelve a quedar cerrado al terminar"""
+    pool = app.SSHManager._connection_pool
+    monkeypatch.setattr(pool.circuito, "intervalo_sondeo", 60)
+    yield pool
+    pool.circuito.registrar_exito()
+
+
+def abrir(circuito):
+    for _ in range(circuito.umbral_fallos):
+        circuito.registrar_fallo()
+
+
+def test_se_abre_tras_el_umbral_de_fallos(circuito):
+    circuito.registrar_fallo()
+    assert circuito.estado == circuito.CERRADO
+    circuito.registrar_exito()
+    circuito.registrar_fallo()
+    assert circuito.estado == circuito.CERRADO  # El éxito reinicia la cuenta
+
+    circuito.registrar_fallo()
+    assert circuito.estado == circuito.ABIERTO
+    assert not circuito.disponible()
+    assert not circuito.permitir()
+    assert 0 < circuito.segundos_para_sondeo() <= 0.2
+
+
+def test_un_solo_sondeo_al_cumplirse_el_intervalo(circuito):
+    abrir(circuito)
+    time.sleep(0.25)
+    assert circuito.disponible()
+    assert circuito.permitir()
+    assert circuito.estado == circuito.SEMIABIERTO
+    assert not circuito.permitir()  # Mientras el sondeo no informa, los demás fallan rápido
+
+
+def test_el_sondeo_cierra_o_reabre_el_circuito(circuito):
+    abrir(circuito)
+    time.sleep(0.25)
+    circuito.permitir()
+    circuito.registrar_fallo()  # Un solo fallo en semiabierto basta para reabrir
+    assert circuito.estado == circuito.ABIERTO
+
+    time.sleep(0.25)
+    circuito.permitir()
+    circuito.registrar_exito()
+    assert circuito.estado == circuito.CERRADO
+    assert circuito.segundos_para_sondeo() == 0
+    metricas = circuito.metricas
+    assert metricas.contador("ssh_circuito_transiciones_total", estado=circuito.ABIERTO) == 2
+    assert metricas.contador("ssh_circuito_transiciones_total", estado=circuito.SEMIABIERTO) == 2
+    assert metricas.contador("ssh_circuito_transiciones_total", estado=circuito.CERRADO) == 1
+
+
+def test_un_sondeo_que_nunca_informa_no_bloquea_el_circuito(circuito):
+    abrir(circuito)
+    time.sleep(0.25)
+    assert circuito.permitir()
+    time.sleep(0.25)
+    assert circuito.permitir()
+
+
+def test_con_el_circuito_abierto_se_siguen_entregando_conexiones_vivas(app, pool):
+    ssh = app.SSHManager.get_connection(timeout=5)
+    assert ssh is not None
+    app.SSHManager.return_connection(ssh)
+
+    abrir(pool.circuito)
+    ssh = app.SSHManager.get_connection(timeout=1)
+    assert ssh is not None
+    app.SSHManager.return_connection(ssh)
+    assert app.SSHManager.almacenamiento_disponible() is False
+
+
+def test_con_el_circuito_abierto_no_hay_handshakes(pool):
+    abrir(pool.circuito)
+    rechazados = pool.metricas.contador("ssh_handshakes_total", resultado="circuito_abierto")
+    assert pool._conectar() is None
+    assert pool.metricas.contador("ssh_handshakes_total", resultado="circuito_abierto") == rechazados + 1
+
+    # Cumplido el intervalo, el sondeo conecta con el servidor (que sí responde) y cierra el circuito
+    pool.circuito.intervalo_sondeo = 0
+    ssh = pool._conectar()
+    assert ssh is not None
+    ssh.close()
+    assert pool.circuito.estado == pool.circuito.CERRADO
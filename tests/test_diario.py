@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Reclamo de lotes del diario local entre procesos y vencimiento del lease"""
+import time
+
+import pytest
+
+
+@pytest.fixture
+def diarios(acceso_remoto, tmp_path):
+    """Dos diarios sobre el mismo archivo, como dos procesos de apps con el mismo CSV"""
+    ruta_db = str(tmp_path / "diario.sqlite3")
+    abiertos = [acceso_remoto.DiarioCalificaciones(ruta_db) for _ in range(2)]
+    yield abiertos
+    for diario in abiertos:
+        diario.detener()
+
+
+def registrar(diario, ruta, cuantos, etiqueta="r"):
+    for i in range(cuantos):
+        assert diario.registrar(ruta, f"{etiqueta}{i},5\n", "clave,calificacion\n")
+
+
+def test_un_lote_reclamado_no_se_entrega_a_otro_proceso(diarios, ruta):
+    primero, segundo = diarios
+    registrar(primero, ruta, 3)
+
+    ruta_lote, encabezado, ids, registros = primero._siguiente_lote()
+    assert (ruta_lote, encabezado) == (ruta, "clave,calificacion\n")
+    assert registros == ["r0,5\n", "r1,5\n", "r2,5\n"]
+    assert segundo._siguiente_lote() is None
+    assert primero._siguiente_lote() is None
+
+    # Lo que llega después del reclamo forma un lote aparte
+    registrar(segundo, ruta, 1, etiqueta="n")
+    _, _, ids_nuevos, registros_nuevos = segundo._siguiente_lote()
+    assert registros_nuevos == ["n0,5\n"]
+    assert not set(ids) & set(ids_nuevos)
+
+
+def test_el_lote_se_libera_al_fallar_el_envio(diarios, ruta):
+    primero, segundo = diarios
+    registrar(primero, ruta, 2)
+    _, _, ids, _ = primero._siguiente_lote()
+
+    primero._liberar_lote(ids)
+    _, _, reclamados, _ = segundo._siguiente_lote()
+    assert reclamados == ids
+
+
+def test_un_lease_vencido_se_vuelve_a_entregar(diarios, ruta):
+    primero, segundo = diarios
+    primero.lease_lote = 0.1
+    registrar(primero, ruta, 2)
+    _, _, ids, _ = primero._siguiente_lote()
+    assert segundo._siguiente_lote() is None
+
+    # El dueño murió sin confirmar ni liberar: al vencer el lease el lote vuelve a estar libre
+    time.sleep(0.15)
+    _, _, reclamados, _ = segundo._siguiente_lote()
+    assert reclamados == ids
+
+    # El dueño anterior ya no puede devolver un lote que ahora pertenece a otro
+    primero._liberar_lote(ids)
+    assert primero._siguiente_lote() is None
+
+
+def test_enviar_pendientes_entrega_y_borra_el_lote(diarios, ruta):
+    primero, _ = diarios
+    registrar(primero, ruta, 3)
+
+    assert primero.enviar_pendientes()
+    assert primero.pendientes() == 0
+    with open(ruta, encoding="utf-8") as f:
+        assert f.read() == "clave,calificacion\nr0,5\nr1,5\nr2,5\n"
+
+
+def test_enviar_pendientes_omite_lotes_de_otro_proceso(diarios, ruta):
+    primero, segundo = diarios
+    registrar(primero, ruta, 2)
+    primero._siguiente_lote()
+
+    assert segundo.enviar_pendientes()
+    assert segundo.pendientes() == 2
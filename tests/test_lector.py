@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Seguimiento incremental del CSV remoto: filas nuevas, appends a medias y truncado"""
+import pytest
+
+ENCABEZADO = "Fecha,Número Económico,Nombre Completo,Email,Calificación\n"
+
+
+def fila(i, calificacion=5):
+    return f'"2024-01-01",{i},"Ñandú, Alumno {i}",a{i}@uam.mx,{calificacion}\n'
+
+
+def escribir(ruta, contenido, modo="w"):
+    with open(ruta, modo, encoding="utf-8") as f:
+        f.write(contenido)
+
+
+@pytest.fixture
+def lector(acceso_remoto, ruta):
+    return acceso_remoto.LectorIncremental(ruta)
+
+
+def test_solo_devuelve_las_filas_nuevas(app, ruta, lector):
+    assert lector.actualizar() == []
+    escribir(ruta, ENCABEZADO + fila(1) + fila(2))
+    assert [f[1] for f in lector.actualizar()] == ["1", "2"]
+    assert lector.encabezado == ENCABEZADO.strip().split(",")
+
+    metricas = app.SSHManager._connection_pool.metricas
+    leidos = metricas.contador("ssh_bytes_leidos_total")
+    escribir(ruta, fila(3), "a")
+    assert [f[1] for f in lector.actualizar()] == ["3"]
+    # Solo se descarga lo añadido más los bytes testigo
+    assert metricas.contador("ssh_bytes_leidos_total") - leidos <= len(fila(3).encode()) + lector.BYTES_TESTIGO
+    assert lector.actualizar() == []
+    assert len(lector.filas) == 3
+
+
+def test_una_fila_a_medias_espera_a_completarse(ruta, lector):
+    escribir(ruta, ENCABEZADO + fila(1))
+    lector.actualizar()
+    completa = fila(2)
+    escribir(ruta, completa[:10], "a")
+    assert lector.actualizar() == []
+    escribir(ruta, completa[10:], "a")
+    assert [f[1] for f in lector.actualizar()] == ["2"]
+    assert lector.reinicios == 0
+
+
+def test_un_archivo_truncado_se_vuelve_a_leer_completo(ruta, lector):
+    escribir(ruta, ENCABEZADO + "".join(fila(i) for i in range(50)))
+    lector.actualizar()
+
+    escribir(ruta, ENCABEZADO + fila(100))
+    assert [f[1] for f in lector.actualizar()] == ["100"]
+    assert lector.reinicios == 1
+    assert [f[1] for f in lector.filas] == ["100"]
+
+
+def test_un_archivo_reemplazado_por_otro_mas_largo_se_detecta(ruta, lector):
+    escribir(ruta, ENCABEZADO + fila(1, calificacion=5))
+    lector.actualizar()
+
+    # El archivo nuevo parece haber crecido: solo los bytes testigo delatan que se reemplazó
+    escribir(ruta, ENCABEZADO + fila(1, calificacion=9) + fila(2))
+    nuevas = lector.actualizar()
+    assert lector.reinicios == 1
+    assert [f[-1] for f in nuevas] == ["9", "5"]
+
+
+def test_resumen_de_calificaciones(app, acceso_remoto):
+    ruta = acceso_remoto._ruta_calificaciones(app.CONFIG)
+    # Las líneas vacías o sin calificación no cuentan
+    escribir(ruta, ENCABEZADO + fila(1, 5) + fila(2, 3) + "\n" + fila(3, 5) + '"2024-01-01",4,"Incompleta"\n')
+    assert acceso_remoto.resumen_calificaciones(app.CONFIG) == {
+        'total': 3, 'promedio': pytest.approx(13 / 3), 'distribucion': {3: 1, 5: 2},
+    }
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Lock de archivo por SFTP: lease según la escritura y locks vencidos que se rompen"""
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def sftp(app):
+    ssh = app.SSHManager.get_connection()
+    yield app.SSHManager._connection_pool.get_sftp(ssh)
+    app.SSHManager.return_connection(ssh)
+
+
+@pytest.fixture
+def espera_corta(acceso_remoto, monkeypatch):
+    """Sin esto un lock ocupado se espera hasta _file_lock_timeout"""
+    monkeypatch.setattr(acceso_remoto.SSHManager, "_reintentos_lock",
+                        acceso_remoto.PoliticaReintentos(base=0.01, tope=0.02, plazo=0.2))
+
+
+def escribir_lock(ruta, contenido, antiguedad=0):
+    with open(ruta + ".lock", "w", encoding="utf-8") as f:
+        f.write(contenido)
+    if antiguedad:
+        momento = time.time() - antiguedad
+        os.utime(ruta + ".lock", (momento, momento))
+
+
+def leer_lock(ruta):
+    with open(ruta + ".lock", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_el_lease_cubre_la_escritura(app, ruta, sftp):
+    S = app.SSHManager
+    assert S._lease_para(0) == S._file_lock_lease
+    assert S._lease_para(10 * 1024 * 1024) > S._lease_para(1024) > S._file_lock_lease
+
+    lease = S._lease_para(50 * 1024 * 1024)
+    token = S._acquire_file_lock(ruta, sftp, lease)
+    propietario, vence = leer_lock(ruta).split("\n")[:2]
+    assert propietario == token
+    assert float(vence) == pytest.approx(time.time() + lease, abs=5)
+
+    assert S._release_file_lock(ruta, sftp, token)
+    assert not os.path.exists(ruta + ".lock")
+
+
+def test_un_lock_vencido_se_rompe(app, ruta, sftp):
+    escribir_lock(ruta, f"otro:1:abc\n{time.time() - 1:.3f}\n")
+    metricas = app.SSHManager._connection_pool.metricas
+    rotos = metricas.contador("ssh_locks_total", resultado="expirado_roto")
+
+    token = app.SSHManager._acquire_file_lock(ruta, sftp)
+    assert token is not None
+    assert leer_lock(ruta).startswith(token + "\n")
+    assert metricas.contador("ssh_locks_total", resultado="expirado_roto") == rotos + 1
+    # El lock apartado con nombre único para romperlo no queda en el directorio
+    assert not [n for n in os.listdir(os.path.dirname(ruta)) if n.endswith(".stale")]
+    app.SSHManager._release_file_lock(ruta, sftp, token)
+
+
+def test_un_lock_vigente_no_se_rompe(app, ruta, sftp, espera_corta):
+    contenido = f"otro:1:abc\n{time.time() + 60:.3f}\n"
+    escribir_lock(ruta, contenido)
+
+    assert app.SSHManager._acquire_file_lock(ruta, sftp) is None
+    assert leer_lock(ruta) == contenido
+    # Liberar con otro token no quita el lock ajeno
+    assert app.SSHManager._release_file_lock(ruta, sftp, "intruso")
+    assert leer_lock(ruta) == contenido
+
+
+def test_un_lock_sin_token_vence_por_su_fecha_de_modificacion(app, ruta, sftp, espera_corta):
+    # Lock vacío (p. ej. el dueño murió antes de escribir el token): vale lo que el lease mínimo
+    escribir_lock(ruta, "")
+    assert app.SSHManager._acquire_file_lock(ruta, sftp) is None
+
+    escribir_lock(ruta, "", antiguedad=app.SSHManager._file_lock_lease + 1)
+    token = app.SSHManager._acquire_file_lock(ruta, sftp)
+    assert token is not None
+    app.SSHManager._release_file_lock(ruta, sftp, token)
+
+
+def test_con_fallos_del_servidor_no_quedan_locks_huerfanos(app, servidor, ruta):
+    servidor.azar.seed(3)
+    servidor.tasa_fallos = 0.1
+    for i in range(20):
+        app.SSHManager.append_remote_file(ruta, f"r{i},5\n", header="clave,calificacion\n")
+        app.SSHManager.write_remote_file(ruta + ".copia", f"r{i},5\n")
+    servidor.tasa_fallos = 0
+
+    assert not os.path.exists(ruta + ".lock")
+    assert not os.path.exists(ruta + ".copia.lock")